@@ -0,0 +1,520 @@
+# -*- coding: utf-8 -*-
+"""Benchmarki gorących ścieżek bota. Uruchamianie: python benchmark.py <nazwa> [opcje]
+
+Każdy benchmark działa w katalogu tymczasowym, więc nie dotyka prawdziwych plików danych.
+"""
+import argparse
+import asyncio
+import collections
+import contextlib
+import datetime
+import functools
+import io
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+os.chdir(tempfile.mkdtemp(prefix="bot-bench-"))
+
+import main  # noqa: E402  (import po zmianie katalogu roboczego)
+
+
+def make_levels(guilds: int, users: int) -> dict:
+    return {str(g): {str(u): {'xp': random.randint(0, 5000), 'level': random.randint(1, 30)} for u in range(users)} for g in range(guilds)}
+
+
+# =================================================================
+# TRWAŁOŚĆ: zapis pełnego pliku vs. write-behind
+# =================================================================
+def bench_persistence(args):
+    levels = make_levels(args.guilds, args.users)
+    messages = [(str(random.randrange(args.guilds)), str(random.randrange(args.users))) for _ in range(args.messages)]
+
+    def legacy():
+        for guild_id, user_id in messages:
+            levels[guild_id][user_id]['xp'] += 20
+            with open('levels.json', 'w', encoding='utf-8') as f: json.dump(levels, f, indent=4)
+
+    async def write_behind():
+        engine = main.PersistenceEngine(interval=args.interval)
+        tracked = engine.load('levels.json', nested=True)
+        engine.start()
+        for i, (guild_id, user_id) in enumerate(messages):
+            tracked[guild_id][user_id]['xp'] += 20
+            engine.mark_dirty(tracked, 'levels.json', guild_id, user_id)
+            if i % 50 == 0: await asyncio.sleep(0)
+        elapsed = time.perf_counter() - started
+        await engine.stop()
+        return elapsed, engine.flush_count
+
+    started = time.perf_counter(); legacy(); legacy_elapsed = time.perf_counter() - started
+    started = time.perf_counter(); new_elapsed, flushes = asyncio.run(write_behind())
+    print(f"Dane: {args.guilds} serwerów x {args.users} użytkowników, {args.messages} wiadomości")
+    print(f"  pełny zapis na wiadomość : {args.messages / legacy_elapsed:>12,.0f} wiad./s")
+    print(f"  write-behind             : {args.messages / new_elapsed:>12,.0f} wiad./s ({flushes} zrzutów)")
+
+
+# =================================================================
+# RANKING: sorted() na każde wywołanie vs. RankIndex
+# =================================================================
+def bench_leaderboard(args):
+    members = {user_id: (random.randint(1, 60), random.randint(0, 20000)) for user_id in range(args.members)}
+    guild_levels = {str(u): {'level': l, 'xp': x} for u, (l, x) in members.items()}
+
+    started = time.perf_counter()
+    for _ in range(args.queries):
+        sorted(guild_levels.items(), key=lambda item: (item[1].get('level', 0), item[1].get('xp', 0)), reverse=True)[:10]
+    sort_elapsed = (time.perf_counter() - started) / args.queries
+
+    started = time.perf_counter()
+    index = main.RankIndex((user_id, level, xp) for user_id, (level, xp) in members.items())
+    build_elapsed = time.perf_counter() - started
+
+    user_ids = random.choices(list(members), k=args.updates)
+    started = time.perf_counter()
+    for user_id in user_ids:
+        level, xp = members[user_id]
+        members[user_id] = (level, xp + 20)
+        index.update(user_id, level, xp + 20)
+    update_elapsed = (time.perf_counter() - started) / args.updates
+
+    started = time.perf_counter()
+    for i in range(args.queries): index.page((i % 100) * 10, 10)
+    page_elapsed = (time.perf_counter() - started) / args.queries
+
+    started = time.perf_counter()
+    for user_id in user_ids[:args.queries]: index.rank(user_id)
+    rank_elapsed = (time.perf_counter() - started) / min(args.queries, len(user_ids))
+
+    print(f"Serwer z {args.members:,} członkami")
+    print(f"  sorted() + top 10        : {sort_elapsed * 1e3:>10.3f} ms/zapytanie")
+    print(f"  budowa indeksu           : {build_elapsed * 1e3:>10.1f} ms (jednorazowo)")
+    print(f"  aktualizacja XP          : {update_elapsed * 1e6:>10.2f} µs")
+    print(f"  strona 10 pozycji        : {page_elapsed * 1e6:>10.2f} µs")
+    print(f"  pozycja użytkownika      : {rank_elapsed * 1e6:>10.2f} µs")
+
+
+
+# =================================================================
+# COOLDOWNY XP: słownik bez wygaszania vs. CooldownStore
+# =================================================================
+def bench_cooldowns(args):
+    clock = [0.0]
+    real_monotonic, time.monotonic = time.monotonic, lambda: clock[0]
+    rounds = args.users // args.active
+
+    def legacy():
+        cooldowns = {}
+        for r in range(rounds):
+            now = datetime.datetime(2024, 1, 1) + datetime.timedelta(seconds=r * 60)
+            for u in range(r * args.active, (r + 1) * args.active):
+                key = f"{random.randrange(1 << 60)}-{u}"
+                if key in cooldowns and (now - cooldowns[key]).total_seconds() < 60: continue
+                cooldowns[key] = now
+        return cooldowns
+
+    def store():
+        cooldowns = main.CooldownStore()
+        for r in range(rounds):
+            clock[0] = r * 60.0
+            for u in range(r * args.active, (r + 1) * args.active): cooldowns.try_acquire(random.randrange(1 << 60), u, 60)
+        return cooldowns
+
+    try:
+        for name, func in (("dict f-string -> datetime", legacy), ("CooldownStore", store)):
+            tracemalloc.start()
+            started = time.perf_counter(); result = func(); elapsed = time.perf_counter() - started
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"  {name:<26}: {len(result):>9,} wpisów, {current / 1024 / 1024:>7.2f} MiB, {args.users / elapsed:>10,.0f} sprawdzeń/s")
+            del result
+    finally:
+        time.monotonic = real_monotonic
+    print(f"({args.users:,} różnych osób, {args.active:,} aktywnych na minutowe okno)")
+
+
+
+# =================================================================
+# NALICZANIE XP: obsługa w on_message vs. XpPipeline (zalew wiadomości)
+# =================================================================
+def bench_xp_flood(args):
+    bot = main.bot
+    messages = [(random.randrange(args.guilds), random.randrange(args.users), random.randrange(5)) for _ in range(args.messages)]
+
+    async def inline():
+        for guild_id, user_id, channel_id in messages:
+            cooldown = await bot.get_config(guild_id, 'xp_cooldown')
+            if not bot.xp_cooldowns.try_acquire(guild_id, user_id, args.cooldown if cooldown is None else cooldown): continue
+            user_data = await bot.storage.get_level(guild_id, user_id) or {'xp': 0, 'level': 1}
+            xp, level = user_data['xp'] + random.randint(15, 25), user_data['level']
+            if xp >= int(5 * (level ** 2) + 50 * level + 100): level += 1
+            await bot.storage.set_level(guild_id, user_id, xp, level)
+            bot.leaderboards.update(guild_id, user_id, level, xp)
+
+    async def pipeline():
+        xp_pipeline = main.XpPipeline(bot, max_size=len(messages) + 1, batch_size=args.batch, window=0)
+        xp_pipeline.start()
+        started = time.perf_counter()
+        for guild_id, user_id, channel_id in messages: xp_pipeline.ingest(guild_id, user_id, channel_id)
+        ingest_elapsed = time.perf_counter() - started
+        while xp_pipeline.queue or xp_pipeline.processed < len(messages): await asyncio.sleep(0)
+        total_elapsed = time.perf_counter() - started
+        await xp_pipeline.stop()
+        return ingest_elapsed, total_elapsed, xp_pipeline.batches
+
+    async def configure():
+        for guild_id in range(args.guilds): await bot.storage.update_config(guild_id, {'xp_cooldown': args.cooldown})
+    asyncio.run(configure())  # działa z oboma magazynami (STORAGE_BACKEND=json|sqlite)
+    bot.xp_cooldowns = main.CooldownStore()
+    started = time.perf_counter(); asyncio.run(inline()); inline_elapsed = time.perf_counter() - started
+    bot.xp_cooldowns = main.CooldownStore()
+    ingest_elapsed, total_elapsed, batches = asyncio.run(pipeline())
+    print(f"{args.messages:,} wiadomości, {args.guilds} serwerów x {args.users} użytkowników, cooldown {args.cooldown} s")
+    print(f"  w on_message (per wiadomość) : {args.messages / inline_elapsed:>12,.0f} wiad./s")
+    print(f"  XpPipeline - przyjęcie        : {args.messages / ingest_elapsed:>12,.0f} wiad./s")
+    print(f"  XpPipeline - naliczenie       : {args.messages / total_elapsed:>12,.0f} wiad./s ({batches} partii)")
+
+
+# =================================================================
+# KRZYWA POZIOMÓW: pętla po wzorze vs. tablica progów
+# =================================================================
+def bench_level_curve(args):
+    xps = [random.randint(0, 5 * args.max_level ** 2) for _ in range(args.members)]
+
+    def legacy(xp):
+        level = 1
+        while xp >= int(5 * (level ** 2) + 50 * level + 100): level += 1
+        return level
+
+    started = time.perf_counter(); curve = main.LevelCurve(max_level=args.max_level); build_elapsed = time.perf_counter() - started
+    results = {}
+    for name, func in (("pętla po wzorze", lambda: [legacy(xp) for xp in xps]), ("levels_for (cały serwer)", lambda: curve.levels_for(xps))):
+        started = time.perf_counter(); results[name] = func(); elapsed = time.perf_counter() - started
+        print(f"  {name:<26}: {elapsed * 1e3:>10.1f} ms ({args.members / elapsed:>12,.0f} użytk./s)")
+    assert len({tuple(levels) for levels in results.values()}) == 1
+    print(f"({args.members:,} członków, tablica {args.max_level} progów zbudowana w {build_elapsed * 1e3:.2f} ms)")
+
+
+# =================================================================
+# AUDIO: PCM + głośność w Pythonie vs. Opus passthrough / filtr FFmpeg
+# =================================================================
+def bench_audio(args):
+    if not shutil.which('ffmpeg') or not shutil.which('ffprobe'): return print("Benchmark wymaga ffmpeg i ffprobe w PATH.")
+    tone = os.path.abspath('tone.webm')
+    subprocess.run(['ffmpeg', '-loglevel', 'error', '-y', '-f', 'lavfi', '-i', f'sine=frequency=440:duration={args.seconds + 5}', '-ac', '2', '-ar', '48000', '-c:a', 'libopus', tone], check=True)
+    encoder = None
+    if main.discord.opus.is_loaded() or main.discord.opus._load_default(): encoder = main.discord.opus.Encoder()
+    else: print("Brak libopus - ścieżka PCM zostanie pominięta (bot i tak by jej nie uruchomił).")
+
+    def play(source, stop_at):
+        # Jak AudioPlayer discord.py: ramka co 20 ms, kodowanie do Opus tylko dla źródeł PCM.
+        frame, started = 0, time.perf_counter()
+        while time.perf_counter() < stop_at:
+            data = source.read()
+            if not data: break
+            if not source.is_opus(): encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+            frame += 1
+            if (delay := started + frame * 0.02 - time.perf_counter()) > 0: time.sleep(delay)
+        source.cleanup()
+
+    async def open_all(engine, volume):
+        return [await main.open_audio_source(tone, volume, engine=engine) for _ in range(args.streams)]
+
+    cases = [("opus passthrough (100%)", "opus", 1.0), ("opus + filtr FFmpeg (50%)", "opus", 0.5)]
+    if encoder: cases.insert(0, ("PCM + PCMVolumeTransformer", "pcm", 0.5))
+    for name, engine, volume in cases:
+        sources = asyncio.run(open_all(engine, volume))
+        before_self, before_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        started = time.perf_counter()
+        threads = [threading.Thread(target=play, args=(source, started + args.seconds)) for source in sources]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        wall = time.perf_counter() - started
+        after_self, after_children = resource.getrusage(resource.RUSAGE_SELF), resource.getrusage(resource.RUSAGE_CHILDREN)
+        bot_cpu = (after_self.ru_utime + after_self.ru_stime) - (before_self.ru_utime + before_self.ru_stime)
+        ffmpeg_cpu = (after_children.ru_utime + after_children.ru_stime) - (before_children.ru_utime + before_children.ru_stime)
+        print(f"  {name:<28}: bot {bot_cpu / wall / args.streams * 100:>6.2f}% CPU/strumień, ffmpeg {ffmpeg_cpu / wall / args.streams * 100:>6.2f}% CPU/strumień")
+    print(f"({args.streams} równoległych strumieni przez {args.seconds} s)")
+
+
+
+# =================================================================
+# SZTUCZNY GATEWAY: ruch syntetyczny na prawdziwych handlerach bota
+# =================================================================
+# Lokalne zamienniki obiektów discord.py - tylko atrybuty i metody, po które sięgają handlery.
+# Wywołania REST (send, delete, add_roles...) kończą się natychmiast, więc mierzony jest sam bot.
+AVATAR = types.SimpleNamespace(url="https://cdn.invalid/avatar.png")
+
+class FakeRole:
+    __slots__ = ('id', 'name', 'guild')
+    def __init__(self, role_id: int, guild): self.id, self.name, self.guild = role_id, f"rola-{role_id}", guild
+
+class FakeMessage:
+    __slots__ = ('id', 'guild', 'channel', 'author', 'content', 'attachments', 'created_at')
+    def __init__(self, message_id: int, channel, author=None, content: str = "", created_at=None):
+        self.id, self.guild, self.channel, self.author, self.content = message_id, channel.guild, channel, author, content
+        self.attachments, self.created_at = [], created_at or main.discord.utils.utcnow()
+    async def delete(self, **kwargs): pass
+    async def edit(self, **kwargs): return self
+
+class FakeTextChannel:
+    __slots__ = ('id', 'guild', 'name', 'mention', 'sent')
+    def __init__(self, channel_id: int, guild): self.id, self.guild, self.name, self.mention, self.sent = channel_id, guild, f"kanal-{channel_id}", f"<#{channel_id}>", 0
+    async def send(self, content=None, **kwargs):
+        self.sent += 1
+        return FakeMessage(random.getrandbits(62), self, content=content or "")
+    async def history(self, limit=100, after=None, oldest_first=None, **kwargs):
+        now = main.discord.utils.utcnow()
+        for i in range(min(limit or 0, 1000)):
+            message = FakeMessage(random.getrandbits(62), self, self.guild.owner, f"spam {i}", now - datetime.timedelta(seconds=i))
+            if after and message.created_at <= after: return
+            yield message
+    async def delete_messages(self, messages, **kwargs): pass
+
+class FakeVoiceClient:
+    def __init__(self, channel): self.channel, self.guild, self.source, self._playing = channel, channel.guild, None, False
+    def is_connected(self) -> bool: return True
+    def is_playing(self) -> bool: return self._playing
+    def is_paused(self) -> bool: return False
+    def play(self, source, after=None): self.source, self._playing = source, True
+    def stop(self): self._playing = False
+    async def disconnect(self, **kwargs): self.stop(); self.guild.voice_client = None
+
+class FakeVoiceChannel:
+    __slots__ = ('id', 'guild', 'members')
+    def __init__(self, channel_id: int, guild): self.id, self.guild, self.members = channel_id, guild, []
+    async def connect(self, **kwargs):
+        self.guild.voice_client = FakeVoiceClient(self)
+        return self.guild.voice_client
+
+class FakeMember:
+    __slots__ = ('id', 'guild', 'bot', 'name', 'display_name', 'mention', 'color', 'display_avatar', 'roles', 'voice', 'top_role')
+    def __init__(self, user_id: int, guild):
+        self.id, self.guild, self.bot, self.name = user_id, guild, False, f"user{user_id}"
+        self.display_name, self.mention, self.color, self.display_avatar = self.name, f"<@{user_id}>", main.discord.Color.default(), AVATAR
+        self.roles, self.top_role = [], None
+        self.voice = types.SimpleNamespace(channel=guild.voice_channel)
+    async def add_roles(self, *roles, **kwargs): self.roles.extend(roles)
+    async def kick(self, **kwargs): pass
+    async def ban(self, **kwargs): pass
+
+class FakeGuild:
+    def __init__(self, guild_id: int, members: int):
+        self.id, self.name, self.icon, self.voice_client = guild_id, f"serwer-{guild_id}", None, None
+        self.created_at = main.discord.utils.utcnow()
+        self.text_channel, self.voice_channel = FakeTextChannel(guild_id * 10 + 1, self), FakeVoiceChannel(guild_id * 10 + 2, self)
+        self.auto_role = FakeRole(guild_id * 10 + 3, self)
+        self.members = {}
+        for user_id in range(guild_id * 100000, guild_id * 100000 + members): self.members[user_id] = FakeMember(user_id, self)
+        self.owner = self.me = next(iter(self.members.values()))
+    @property
+    def member_count(self) -> int: return len(self.members)
+    def get_member(self, user_id: int): return self.members.get(user_id)
+    def get_role(self, role_id: int): return self.auto_role if role_id == self.auto_role.id else None
+    def get_channel(self, channel_id: int): return self.text_channel if channel_id == self.text_channel.id else None
+
+class FakeResponse:
+    def __init__(self): self._done = False
+    def is_done(self) -> bool: return self._done
+    async def send_message(self, content=None, **kwargs): self._done = True
+    async def defer(self, **kwargs): self._done = True
+
+class FakeFollowup:
+    def __init__(self, channel): self.channel = channel
+    async def send(self, content=None, **kwargs): return FakeMessage(random.getrandbits(62), self.channel, content=content or "")
+
+class FakeInteraction:
+    def __init__(self, guild, user):
+        self.id, self.guild, self.user, self.channel = random.getrandbits(62), guild, user, guild.text_channel
+        self.response, self.followup = FakeResponse(), FakeFollowup(guild.text_channel)
+        self.expires_at = main.discord.utils.utcnow() + datetime.timedelta(minutes=15)
+    async def edit_original_response(self, **kwargs): pass
+    async def delete_original_response(self): pass
+
+class FakeAudioSource(main.discord.AudioSource):
+    def read(self) -> bytes: return b''
+    def is_opus(self) -> bool: return True
+    elapsed = 0.0
+
+class FakeSpotify:
+    async def track(self, url: str) -> dict: return {'name': f"utwor {url[-6:]}", 'artist': "wykonawca"}
+    async def playlist_tracks(self, url: str) -> list: return [{'name': f"utwor {i}", 'artist': "wykonawca"} for i in range(20)]
+    def shutdown(self): pass
+
+class FakeSession:
+    class _Response:
+        status = 200
+        async def __aenter__(self): return self
+        async def __aexit__(self, *exc): return False
+    def head(self, url, **kwargs): return self._Response()
+    async def close(self): pass
+
+def percentile(values: list, q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+def rss_mib() -> float:
+    try:
+        with open('/proc/self/statm') as f: return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError): return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def bench_gateway(args):
+    """Odtwarza zalew wiadomości, fale wejść, komendy /uzytkowe i /moderacja oraz /music play na tysiącach serwerów.
+
+    Handlery są wołane jak przez discord.py - każde zdarzenie jako osobne zadanie - a checki uprawnień komend są pomijane.
+    yt-dlp (funkcja pracownika ExtractionPool), Spotify, HEAD na strumień i FFmpeg są zastąpione atrapami.
+    """
+    bot = main.bot
+    ytdl_delay = args.ytdl_delay
+
+    def fake_extract(query: str, in_process: bool) -> dict:
+        time.sleep(ytdl_delay)  # blokujące wywołanie yt-dlp w wątku pracownika
+        video_id = f"{abs(hash(query)) % 10 ** 11:011d}"
+        entry = {'id': video_id, 'url': f"https://stream.invalid/{video_id}?expire={int(time.time()) + 6 * 3600}", 'title': query, 'thumbnail': None, 'duration': 200}
+        return entry if query.startswith("https://") else {'entries': [entry]}
+
+    async def open_fake_source(url, volume, start_at=0.0, engine=main.AUDIO_ENGINE): return FakeAudioSource()
+
+    async def run():
+        started = time.perf_counter()
+        guilds = [FakeGuild(guild_id, args.members) for guild_id in range(1, args.guilds + 1)]
+        channels = {guild.text_channel.id: guild.text_channel for guild in guilds}
+        by_id = {guild.id: guild for guild in guilds}
+        for guild in guilds:
+            # Co drugi serwer ma kanał powitań i auto-rolę, żeby fale wejść szły obiema ścieżkami JoinAggregatora.
+            config = {'xp_cooldown': args.cooldown}
+            if guild.id % 2: config.update(welcome_channel_id=guild.text_channel.id, auto_role_id=guild.auto_role.id)
+            bot.storage.configs[guild.id] = main.GuildConfig(guild.id, config)
+        print(f"{args.guilds:,} serwerów x {args.members} członków przygotowanych w {time.perf_counter() - started:.1f} s, RSS {rss_mib():.0f} MiB")
+
+        bot.get_channel, bot.get_guild, bot.session = channels.get, by_id.get, FakeSession()
+        main.ytdl_worker.init_worker, main.ytdl_worker.extract_info, main.open_audio_source = (lambda options: None), fake_extract, open_fake_source
+        bot.joins.window, bot.joins.rate, bot.joins.burst = args.join_window, args.role_rate, max(1, int(args.role_rate))
+        bot.persistence.start(); bot.rest.start(); bot.xp_pipeline.start()
+        music = bot.music_cog = main.Music(bot)
+        music.spotify, music.audio_cache.threshold = FakeSpotify(), float('inf')
+        music._warmup = asyncio.get_running_loop().create_future(); music._warmup.set_result(None)
+        groups = {'uzytkowe': main.Uzytkowe(bot), 'moderacja': main.Moderacja(bot), 'music': music}
+        def command(group: str, name: str): return functools.partial(groups[group].get_command(name).callback, groups[group])
+
+        lags = []
+        async def monitor():
+            while True:
+                tick = time.perf_counter(); await asyncio.sleep(0.01); lags.append(time.perf_counter() - tick - 0.01)
+        monitor_task = asyncio.create_task(monitor())
+
+        results = {}
+        async def phase(name: str, events, drained=None):
+            latencies, errors = [], collections.Counter()
+            async def handle(queued, coro):
+                try: await coro
+                except Exception as e: errors[type(e).__name__] += 1
+                latencies.append(time.perf_counter() - queued)
+            lag_start, started = len(lags), time.perf_counter()
+            count, log = 0, io.StringIO()
+            with contextlib.redirect_stdout(log):  # komunikaty bota (np. nieudane wyszukiwania) są tylko liczone
+                for burst in iter(lambda: list(itertools.islice(events, args.burst)), []):
+                    queued = time.perf_counter()
+                    await asyncio.gather(*(asyncio.create_task(handle(queued, coro)) for coro in burst))
+                    count += len(burst)
+                dispatched = time.perf_counter() - started
+                if drained:
+                    while not drained(): await asyncio.sleep(0.01)
+            elapsed = time.perf_counter() - started
+            latencies.sort(); phase_lags = sorted(lags[lag_start:])
+            results[name] = {'events': count, 'throughput': count / elapsed, 'dispatch_throughput': count / dispatched,
+                             'p50_ms': percentile(latencies, 0.5) * 1e3, 'p99_ms': percentile(latencies, 0.99) * 1e3,
+                             'lag_p99_ms': percentile(phase_lags, 0.99) * 1e3, 'lag_max_ms': (phase_lags[-1] if phase_lags else 0) * 1e3,
+                             'rss_mib': rss_mib(), 'errors': dict(errors), 'bot_log_lines': log.getvalue().count("\n")}
+            row = results[name]
+            print(f"  {name:<12}: {count:>8,} zdarzeń, {row['throughput']:>10,.0f}/s, p50 {row['p50_ms']:>8.2f} ms, p99 {row['p99_ms']:>8.2f} ms, "
+                  f"lag p99 {row['lag_p99_ms']:>6.1f} ms, RSS {row['rss_mib']:>6.0f} MiB" + (f", błędy {dict(errors)}" if errors else "")
+                  + (f", {row['bot_log_lines']} komunikatów bota" if row['bot_log_lines'] else ""))
+
+        def messages():
+            for i in range(args.messages):
+                # Zalew: połowa ruchu idzie na 1% serwerów.
+                guild = guilds[random.randrange(max(1, args.guilds // 100))] if i % 2 else random.choice(guilds)
+                author = guild.members[guild.id * 100000 + random.randrange(args.members)]
+                yield main.on_message(FakeMessage(i, guild.text_channel, author, "wiadomość"))
+        processed = bot.xp_pipeline.processed
+        await phase("on_message", messages(), lambda: bot.xp_pipeline.processed + bot.xp_pipeline.dropped - processed >= args.messages)
+
+        def joins():
+            for i in range(args.joins):
+                # Fale wejść (raid) skupione na kilku serwerach naraz.
+                guild = guilds[(i // args.burst * 7) % args.guilds]
+                member = FakeMember(10 ** 12 + i, guild); guild.members[member.id] = member
+                yield main.on_member_join(member)
+        await phase("join", joins(), lambda: not bot.joins.pending and not bot.joins.grants)
+
+        info, avatar, level, leaderboard = (command('uzytkowe', name) for name in ("info", "avatar", "level", "leaderboard"))
+        warn, history, kick, clear = (command('moderacja', name) for name in ("warn", "history", "kick", "clear"))
+        def commands():
+            for i in range(args.commands):
+                guild = random.choice(guilds); user = guild.members[guild.id * 100000 + random.randrange(args.members)]
+                interaction = FakeInteraction(guild, user)
+                yield random.choice((lambda: info(interaction), lambda: avatar(interaction), lambda: level(interaction), lambda: leaderboard(interaction),
+                                     lambda: warn(interaction, user, "spam"), lambda: history(interaction, user), lambda: kick(interaction, user),
+                                     lambda: clear(interaction, 50)))()
+        await phase("komendy", commands())
+
+        play = command('music', "play")
+        def plays():
+            for i in range(args.plays):
+                guild = random.choice(guilds); user = guild.members[guild.id * 100000 + random.randrange(args.members)]
+                query = f"https://open.spotify.com/track/{i:06d}" if i % 4 == 0 else f"utwor {random.randrange(args.plays // 2 + 1)}"
+                yield play(FakeInteraction(guild, user), query)
+        await phase("music play", plays(), lambda: not any(music.resolvers.values()))
+        results["music play"]['ytdl'] = music.extractor.stats()
+        print(f"  (yt-dlp: {music.extractor.stats()['completed']} ekstrakcji, {music.extractor.stats()['rejected']} odrzuconych po czekaniu na miejsce w kolejce)")
+
+        monitor_task.cancel()
+        for task in music.prefetchers.values(): task.cancel()
+        await music.close()
+        await bot.xp_pipeline.stop(); bot.joins.stop(); bot.rest.stop(); await bot.persistence.stop()
+        lags.sort()
+        return {'phases': results, 'loop_lag_p50_ms': percentile(lags, 0.5) * 1e3, 'loop_lag_p99_ms': percentile(lags, 0.99) * 1e3,
+                'loop_lag_max_ms': (lags[-1] if lags else 0) * 1e3, 'rss_peak_mib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+
+    summary = asyncio.run(run())
+    print(f"Opóźnienie pętli zdarzeń: p50 {summary['loop_lag_p50_ms']:.2f} ms, p99 {summary['loop_lag_p99_ms']:.2f} ms, max {summary['loop_lag_max_ms']:.1f} ms; "
+          f"szczytowy RSS {summary['rss_peak_mib']:.0f} MiB")
+    if args.output:
+        # Jeden wiersz JSON na przebieg - kolejne uruchomienia można porównywać, żeby wyłapać regresje.
+        options = {key: value for key, value in vars(args).items() if key not in ('func', 'output')}
+        with open(os.path.join(REPO_DIR, args.output) if not os.path.isabs(args.output) else args.output, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'timestamp': datetime.datetime.now().isoformat(timespec='seconds'), 'options': options, **summary}) + "\n")
+        print(f"Dopisano wynik do {args.output}")
+
+BENCHMARKS = {
+    'persistence': (bench_persistence, [('--guilds', 300), ('--users', 50), ('--messages', 2000), ('--interval', 0.05)]),
+    'leaderboard': (bench_leaderboard, [('--members', 100000), ('--updates', 20000), ('--queries', 50)]),
+    'cooldowns': (bench_cooldowns, [('--users', 500000), ('--active', 2000)]),
+    'xp-flood': (bench_xp_flood, [('--messages', 200000), ('--guilds', 200), ('--users', 500), ('--cooldown', 0), ('--batch', 500)]),
+    'level-curve': (bench_level_curve, [('--members', 200000), ('--max-level', 1000)]),
+    'audio': (bench_audio, [('--streams', 10), ('--seconds', 20)]),
+    'gateway': (bench_gateway, [('--guilds', 2000), ('--members', 50), ('--messages', 200000), ('--joins', 20000), ('--commands', 5000), ('--plays', 1000),
+                                ('--burst', 500), ('--cooldown', 60.0), ('--join-window', 0.2), ('--role-rate', 1000.0), ('--ytdl-delay', 0.05), ('--output', '')]),
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    subparsers = parser.add_subparsers(dest='name', required=True)
+    for name, (func, options) in BENCHMARKS.items():
+        sub = subparsers.add_parser(name)
+        for option, default in options: sub.add_argument(option, type=type(default), default=default)
+        sub.set_defaults(func=func)
+    parsed = parser.parse_args()
+    parsed.func(parsed)
@@ -3,6 +3,8 @@
 # =================================================================
 # SEKCJA 1: WSZYSTKIE IMPORTY
 # =================================================================
+import time
+STARTUP_STARTED = time.perf_counter()  # punkt zero raportu czasu startu
 import discord
 from discord.ext import commands, tasks
 from discord import app_commands, ui, ButtonStyle, Interaction, Member, Role, TextChannel, CategoryChannel
@@ -14,48 +16,1636 @@ from typing import Optional
 import re
 import aiohttp
 import os
-import spotipy
-from spotipy.oauth2 import SpotifyClientCredentials
-import yt_dlp as youtube_dl
+import sqlite3
+import concurrent.futures
+import collections
+import itertools
+import urllib.parse
+import threading
+import functools
+import heapq
+import bisect
+import math
+import sys
+import traceback
+import subprocess
+import signal
+import hashlib
+import glob
+import abc
+import mmap
+from multiprocessing import shared_memory, resource_tracker
+import ytdl_worker
+# spotipy i yt_dlp są importowane leniwie (Music.warm_up / pracownicy ekstrakcji) - nie spowalniają startu.
+STARTUP_IMPORTED = time.perf_counter()
+
+
+# =================================================================
+# SEKCJA 1A: TRWAŁOŚĆ DANYCH (WRITE-BEHIND)
+# =================================================================
+PERSIST_INTERVAL = float(os.getenv("PERSIST_INTERVAL", "5"))
+PERSIST_MAX_DIRTY = int(os.getenv("PERSIST_MAX_DIRTY", "200"))
+
+class PersistenceEngine:
+    """Zapis opóźniony plików JSON: zmiany są oznaczane jako brudne i zapisywane zbiorczo.
+
+    Każdy plik to słownik najwyższego poziomu z kluczami tekstowymi (np. ID serwera -> dane)
+    z pamięcią podręczną zserializowanych fragmentów. Pliki wczytane z nested=True (serwer ->
+    użytkownik -> dane) mają fragmenty o dwa poziomy w głąb, więc zmiana XP jednej osoby nie
+    wymaga ponownej serializacji całego serwera. Na pętli zdarzeń powstaje jedynie migawka
+    referencji do brudnych wpisów - json.dumps, sklejenie pliku i atomowy zapis (plik tymczasowy
+    + os.replace) odbywają się w osobnym wątku. Wpis zmieniony w trakcie serializacji jest
+    ponownie brudny, więc trafi do następnego zrzutu.
+    """
+    _REMOVED = object()
+
+    def __init__(self, interval: float = PERSIST_INTERVAL, max_dirty: int = PERSIST_MAX_DIRTY):
+        self.interval = interval
+        self.max_dirty = max_dirty
+        self._data = {}        # nazwa pliku -> śledzony słownik
+        self._fragments = {}   # nazwa pliku -> {klucz: zserializowany JSON albo {podklucz: JSON}}
+        self._dirty = {}       # nazwa pliku -> zbiór brudnych par (klucz, podklucz lub None)
+        self._nested = set()   # pliki z fragmentami dwupoziomowymi
+        self._pending = 0      # liczba niezapisanych zmian od ostatniego zrzutu
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="persistence")
+        self.flush_count = 0
+        self.last_flush_duration = 0.0
+
+    def load(self, filename: str, nested: bool = False) -> dict:
+        try:
+            with open(filename, 'r', encoding='utf-8') as f: data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError): data = {}
+        if nested: self._nested.add(filename)
+        self._data[filename] = data
+        self._fragments[filename] = {k: {sk: json.dumps(sv) for sk, sv in v.items()} if nested else json.dumps(v) for k, v in data.items()}
+        self._dirty.setdefault(filename, set())
+        return data
+
+    def mark_dirty(self, data: dict, filename: str, key=None, subkey=None):
+        """Oznacza wpis (podwpis w plikach nested, albo cały plik, gdy key=None) do zapisu przy najbliższym zrzucie."""
+        if self._data.get(filename) is not data:
+            self._data[filename] = data
+            self._fragments[filename] = {}
+            key = None
+        dirty = self._dirty.setdefault(filename, set())
+        if key is None: dirty.update((k, None) for k in data); dirty.update((k, None) for k in self._fragments[filename])
+        else: dirty.add((key, subkey if filename in self._nested else None))
+        self._pending += 1
+        if self._pending >= self.max_dirty: self._wake.set()
+
+    def mark_dirty_many(self, data: dict, filename: str, keys: list):
+        """mark_dirty dla listy par (klucz, podklucz) naraz - jak po jednej zmianie na parę."""
+        if self._data.get(filename) is not data or filename not in self._nested:
+            for key, subkey in keys: self.mark_dirty(data, filename, key, subkey)
+            return
+        self._dirty.setdefault(filename, set()).update(keys)
+        self._pending += len(keys)
+        if self._pending >= self.max_dirty: self._wake.set()
+
+    def _collect(self, filename: str) -> dict:
+        """Migawka na pętli: referencje do brudnych wpisów (całe wpisy nested jako lista par) - bez serializacji."""
+        data, dirty, nested = self._data[filename], self._dirty[filename], filename in self._nested
+        whole = {key for key, subkey in dirty if subkey is None}
+        changed = {}
+        for key, subkey in dirty:
+            value = data.get(key, self._REMOVED)
+            if subkey is None: changed[(key, None)] = list(value.items()) if nested and value is not self._REMOVED else value
+            elif value is self._REMOVED: changed[(key, None)] = value  # usunięty cały wpis
+            elif key not in whole: changed[(key, subkey)] = value.get(subkey, self._REMOVED)
+        dirty.clear()
+        return changed
+
+    @classmethod
+    def _write_atomic(cls, filename: str, fragments: dict, changed: dict, nested: bool) -> dict:
+        """Serializuje zmiany i zapisuje plik; zwraca nowy słownik fragmentów (bieżący nie jest modyfikowany)."""
+        merged, copied = dict(fragments), set()
+        for (key, subkey), value in changed.items():
+            if subkey is None:
+                if value is cls._REMOVED: merged.pop(key, None)
+                else: merged[key] = {sk: json.dumps(sv) for sk, sv in value} if nested else json.dumps(value); copied.add(key)
+                continue
+            if key not in copied: merged[key] = dict(merged.get(key, {})); copied.add(key)
+            if value is cls._REMOVED: merged[key].pop(subkey, None)
+            else: merged[key][subkey] = json.dumps(value)
+        encode = lambda v: v if isinstance(v, str) else "{" + ", ".join(f"{json.dumps(sk)}: {sv}" for sk, sv in v.items()) + "}"
+        payload = "{" + ", ".join(f"{json.dumps(k)}: {encode(v)}" for k, v in merged.items()) + "}"
+        tmp_name = f"{filename}.tmp"
+        with open(tmp_name, 'w', encoding='utf-8') as f:
+            f.write(payload); f.flush(); os.fsync(f.fileno())
+        os.replace(tmp_name, filename)
+        return merged
+
+    async def flush(self):
+        """Zapisuje wszystkie brudne pliki. Serializacja i zapis odbywają się w wątku, zrzuty nie nakładają się."""
+        async with self._lock:
+            started = time.perf_counter()
+            self._pending = 0
+            self._wake.clear()
+            jobs = [(filename, self._fragments[filename], self._collect(filename)) for filename, dirty in self._dirty.items() if dirty]
+            if not jobs: return
+            loop = asyncio.get_running_loop()
+            for index, (filename, fragments, changed) in enumerate(jobs):
+                # RuntimeError: wpis zmieniony w trakcie serializacji w wątku - zostanie zapisany przy następnym zrzucie.
+                try: merged = await asyncio.shield(loop.run_in_executor(self._executor, self._write_atomic, filename, fragments, changed, filename in self._nested))
+                except (OSError, RuntimeError, TypeError, ValueError) as e: print(f"Błąd zapisu pliku '{filename}': {e}"); self._dirty[filename].update(changed); continue
+                except asyncio.CancelledError:
+                    # Migawka jest już zdjęta ze zbioru brudnych - bez tego przerwany zrzut zgubiłby zmiany.
+                    for filename, _, changed in jobs[index:]: self._dirty[filename].update(changed)
+                    raise
+                # Fragmenty są podmieniane tylko tutaj (pod blokadą), więc wątek czyta je bez kopiowania na pętli.
+                if self._fragments[filename] is fragments: self._fragments[filename] = merged
+            self.flush_count += 1
+            self.last_flush_duration = time.perf_counter() - started
+            metrics.observe("bot_persistence_flush_seconds", self.last_flush_duration)
+
+    async def _run(self):
+        while True:
+            try: await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError: pass
+            try: await self.flush()
+            except Exception as e: print(f"Błąd zrzutu danych: {e}")
+
+    def start(self):
+        if self._task is None: self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Zatrzymuje zadanie w tle i wykonuje ostatni zrzut (wywoływane przy zamykaniu bota)."""
+        if self._task:
+            async with self._lock: self._task.cancel()  # pod blokadą - nigdy w środku trwającego zrzutu
+            try: await self._task
+            except asyncio.CancelledError: pass
+            self._task = None
+        await self.flush()
+        self._executor.shutdown(wait=True)
+
+
+# =================================================================
+# SEKCJA 1B: MAGAZYN DANYCH (JSON / SQLITE)
+# =================================================================
+# Tryb klastra: launcher (`python main.py cluster N`) uruchamia procesy robocze z CLUSTER_ID.
+# Procesy dzielą wtedy bazę SQLite (także konkursy, przypisane do serwera, a nie do procesu); osobny jest tylko stan lokalny procesu.
+CLUSTER_ID = int(os.environ["CLUSTER_ID"]) if "CLUSTER_ID" in os.environ else None
+CLUSTER_LAUNCHER = __name__ == "__main__" and sys.argv[1:2] == ["cluster"]
+STORAGE_BACKEND = "sqlite" if CLUSTER_ID is not None or CLUSTER_LAUNCHER else os.getenv("STORAGE_BACKEND", "json")
+SQLITE_PATH = os.getenv("SQLITE_PATH", "bot.db")
+
+def data_file(filename: str) -> str:
+    """Nazwa pliku danych lokalnego dla procesu (w trybie klastra z sufiksem numeru procesu)."""
+    if CLUSTER_ID is None: return filename
+    root, ext = os.path.splitext(filename)
+    return f"{root}.cluster{CLUSTER_ID}{ext}"
+
+class GuildConfig:
+    """Konfiguracja jednego serwera w stałych polach (zamiast słownika z kluczami-napisami).
+
+    Obiekt powstaje raz przy wczytaniu danych i jest zmieniany wyłącznie przez update(). Role i kanały
+    rozwiązane względem cache serwera są pamiętane do następnej zmiany konfiguracji albo invalidate()
+    (wywoływanego po usunięciu roli/kanału).
+    """
+    ROLE_KEYS = ('auto_role_id', 'verification_role_id', 'ticket_staff_role_id')
+    CHANNEL_KEYS = ('welcome_channel_id', 'goodbye_channel_id', 'ticket_category_id')
+    FIELDS = ROLE_KEYS + CHANNEL_KEYS + ('xp_cooldown', 'xp_multiplier', 'level_curve')
+    __slots__ = FIELDS + ('guild_id', 'extra', '_resolved')
+
+    def __init__(self, guild_id: int, data: Optional[dict] = None):
+        self.guild_id, self.extra, self._resolved = guild_id, {}, None
+        for key in self.FIELDS: setattr(self, key, None)
+        if data: self.update(data)
+
+    def get(self, key: str, default=None):
+        value = getattr(self, key) if key in self.FIELDS else self.extra.get(key)
+        return default if value is None else value
+
+    def update(self, values: dict):
+        for key, value in values.items():
+            if key in self.FIELDS: setattr(self, key, value)
+            elif value is None: self.extra.pop(key, None)
+            else: self.extra[key] = value
+        self._resolved = None
+
+    def to_dict(self) -> dict:
+        data = {key: value for key in self.FIELDS if (value := getattr(self, key)) is not None}
+        data.update(self.extra)
+        return data
+
+    def invalidate(self):
+        self._resolved = None
+
+    def resolve(self, guild: discord.Guild) -> dict:
+        """Skonfigurowane role i kanały jako obiekty (None, jeśli nie istnieją) - liczone raz na zmianę."""
+        if self._resolved is None or self._resolved[0] is not guild:
+            objects = {key: guild.get_role(role_id) if (role_id := getattr(self, key)) else None for key in self.ROLE_KEYS}
+            objects.update({key: guild.get_channel(channel_id) if (channel_id := getattr(self, key)) else None for key in self.CHANNEL_KEYS})
+            self._resolved = (guild, objects)
+        return self._resolved[1]
+
+    def role(self, guild: discord.Guild, key: str) -> Optional[Role]:
+        return self.resolve(guild)[key]
+
+    def channel(self, guild: discord.Guild, key: str):
+        return self.resolve(guild)[key]
+
+class StorageBackend(abc.ABC):
+    """Wspólny interfejs magazynu poziomów, ostrzeżeń i konfiguracji serwerów."""
+    @abc.abstractmethod
+    async def get_guild_config(self, guild_id: int) -> GuildConfig: ...
+    @abc.abstractmethod
+    async def update_config(self, guild_id: int, values: dict): ...
+    async def set_config(self, guild_id: int, key: str, value): await self.update_config(guild_id, {key: value})
+    def evict(self, guild_id: int): pass  # zwalnia dane serwera trzymane w pamięci podręcznej (nie w magazynie)
+    @abc.abstractmethod
+    async def get_level(self, guild_id: int, user_id: int) -> Optional[dict]: ...
+    @abc.abstractmethod
+    async def set_level(self, guild_id: int, user_id: int, xp: int, level: int): ...
+    @abc.abstractmethod
+    async def get_levels(self, keys: list) -> dict: ...
+    @abc.abstractmethod
+    async def set_levels(self, rows: list): ...
+    @abc.abstractmethod
+    async def top_levels(self, guild_id: int, limit: int, offset: int = 0) -> list: ...
+    @abc.abstractmethod
+    async def get_guild_levels(self, guild_id: int) -> list: ...
+    @abc.abstractmethod
+    async def add_warning(self, guild_id: int, user_id: int, warning: dict) -> int: ...
+    @abc.abstractmethod
+    async def get_warnings(self, guild_id: int, user_id: int) -> list: ...
+    @abc.abstractmethod
+    async def delete_warning(self, guild_id: int, user_id: int, index: int) -> bool: ...
+    @abc.abstractmethod
+    async def load_giveaways(self, owns) -> dict: ...  # owns(guild_id) - czy serwer należy do tego procesu
+    @abc.abstractmethod
+    async def save_giveaway(self, message_id: str, giveaway: dict): ...
+    @abc.abstractmethod
+    async def delete_giveaways(self, message_ids: list): ...
+    async def close(self): pass
+
+class JsonStorage(StorageBackend):
+    """Dotychczasowe pliki JSON trzymane w pamięci, zapisywane przez PersistenceEngine."""
+    def __init__(self, persistence: PersistenceEngine):
+        self.persistence = persistence
+        self.server_configs = persistence.load('server_configs.json')
+        self.configs = {int(guild_id): GuildConfig(int(guild_id), data) for guild_id, data in self.server_configs.items()}
+        self.warnings_data = persistence.load('warnings.json', nested=True)
+        self.levels_data = persistence.load('levels.json', nested=True)
+        self.giveaways_data = persistence.load('giveaways.json')
+
+    async def get_guild_config(self, guild_id: int) -> GuildConfig:
+        if (config := self.configs.get(guild_id)) is None: config = self.configs[guild_id] = GuildConfig(guild_id)
+        return config
+
+    async def update_config(self, guild_id: int, values: dict):
+        config = await self.get_guild_config(guild_id)
+        config.update(values)
+        self.server_configs[str(guild_id)] = config.to_dict()
+        self.persistence.mark_dirty(self.server_configs, 'server_configs.json', str(guild_id))
+
+    async def get_level(self, guild_id: int, user_id: int) -> Optional[dict]:
+        return self.levels_data.get(str(guild_id), {}).get(str(user_id))
+
+    async def set_level(self, guild_id: int, user_id: int, xp: int, level: int):
+        self.levels_data.setdefault(str(guild_id), {})[str(user_id)] = {'xp': xp, 'level': level}
+        self.persistence.mark_dirty(self.levels_data, 'levels.json', str(guild_id), str(user_id))
+
+    async def get_levels(self, keys: list) -> dict:
+        return {(g, u): data for g, u in keys if (data := self.levels_data.get(str(g), {}).get(str(u)))}
+
+    async def set_levels(self, rows: list):
+        keys = []
+        for guild_id, user_id, xp, level in rows:
+            guild_key, user_key = str(guild_id), str(user_id)
+            self.levels_data.setdefault(guild_key, {})[user_key] = {'xp': xp, 'level': level}
+            keys.append((guild_key, user_key))
+        self.persistence.mark_dirty_many(self.levels_data, 'levels.json', keys)
+
+    async def top_levels(self, guild_id: int, limit: int, offset: int = 0) -> list:
+        guild_levels = self.levels_data.get(str(guild_id), {})
+        sorted_users = sorted(guild_levels.items(), key=lambda item: (item[1].get('level', 0), item[1].get('xp', 0)), reverse=True)
+        return [(int(user_id), data.get('level', 0), data.get('xp', 0)) for user_id, data in sorted_users[offset:offset + limit]]
+
+    async def get_guild_levels(self, guild_id: int) -> list:
+        return [(int(user_id), data.get('level', 0), data.get('xp', 0)) for user_id, data in self.levels_data.get(str(guild_id), {}).items()]
+
+    async def add_warning(self, guild_id: int, user_id: int, warning: dict) -> int:
+        user_warns = self.warnings_data.setdefault(str(guild_id), {}).setdefault(str(user_id), [])
+        user_warns.append(warning)
+        self.persistence.mark_dirty(self.warnings_data, 'warnings.json', str(guild_id), str(user_id))
+        return len(user_warns)
+
+    async def get_warnings(self, guild_id: int, user_id: int) -> list:
+        return self.warnings_data.get(str(guild_id), {}).get(str(user_id), [])
+
+    async def delete_warning(self, guild_id: int, user_id: int, index: int) -> bool:
+        user_warns = self.warnings_data.get(str(guild_id), {}).get(str(user_id), [])
+        if not 0 <= index < len(user_warns): return False
+        user_warns.pop(index)
+        self.persistence.mark_dirty(self.warnings_data, 'warnings.json', str(guild_id), str(user_id))
+        return True
+
+    async def load_giveaways(self, owns) -> dict:
+        return {message_id: giveaway for message_id, giveaway in self.giveaways_data.items() if owns(giveaway['guild_id'])}
+
+    async def save_giveaway(self, message_id: str, giveaway: dict):
+        self.giveaways_data[message_id] = giveaway
+        self.persistence.mark_dirty(self.giveaways_data, 'giveaways.json', message_id)
+
+    async def delete_giveaways(self, message_ids: list):
+        for message_id in message_ids:
+            self.giveaways_data.pop(message_id, None)
+            self.persistence.mark_dirty(self.giveaways_data, 'giveaways.json', message_id)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS guild_configs (guild_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (guild_id, key));
+CREATE TABLE IF NOT EXISTS levels (guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, xp INTEGER NOT NULL, level INTEGER NOT NULL, PRIMARY KEY (guild_id, user_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_levels_rank ON levels (guild_id, level DESC, xp DESC);
+CREATE TABLE IF NOT EXISTS warnings (id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id INTEGER NOT NULL, user_id INTEGER NOT NULL, reason TEXT NOT NULL, moderator_id INTEGER, timestamp TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS idx_warnings_user ON warnings (guild_id, user_id, id);
+CREATE TABLE IF NOT EXISTS giveaways (message_id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, data TEXT NOT NULL);
+"""
+
+class SqliteStorage(StorageBackend):
+    """Magazyn SQLite (WAL). Całe połączenie żyje w jednym, dedykowanym wątku wykonawczym."""
+    def __init__(self, path: str = SQLITE_PATH):
+        self.path = path
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn = None
+        self._config_cache = {}
+        self._executor.submit(self._open).result()
+
+    def _open(self):
+        self._conn = sqlite3.connect(self.path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SQLITE_SCHEMA)
+        if not self._conn.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone():
+            migrate_json_to_sqlite(self._conn)
+        if not self._conn.execute("SELECT 1 FROM meta WHERE key = 'giveaways_migrated'").fetchone():
+            migrate_giveaways_to_sqlite(self._conn)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _query(self, sql: str, params=()):
+        return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, sql: str, params=()):
+        with self._conn: return self._conn.execute(sql, params)
+
+    async def get_guild_config(self, guild_id: int) -> GuildConfig:
+        if (config := self._config_cache.get(guild_id)) is None:
+            rows = await self._run(self._query, "SELECT key, value FROM guild_configs WHERE guild_id = ?", (guild_id,))
+            config = self._config_cache.setdefault(guild_id, GuildConfig(guild_id, {key: json.loads(value) for key, value in rows}))
+        return config
+
+    def evict(self, guild_id: int):
+        self._config_cache.pop(guild_id, None)
+
+    async def update_config(self, guild_id: int, values: dict):
+        (await self.get_guild_config(guild_id)).update(values)
+        def write():
+            with self._conn:
+                self._conn.executemany("INSERT OR REPLACE INTO guild_configs (guild_id, key, value) VALUES (?, ?, ?)", [(guild_id, key, json.dumps(value)) for key, value in values.items() if value is not None])
+                self._conn.executemany("DELETE FROM guild_configs WHERE guild_id = ? AND key = ?", [(guild_id, key) for key, value in values.items() if value is None])
+        await self._run(write)
+
+    async def get_level(self, guild_id: int, user_id: int) -> Optional[dict]:
+        rows = await self._run(self._query, "SELECT xp, level FROM levels WHERE guild_id = ? AND user_id = ?", (guild_id, user_id))
+        return {'xp': rows[0][0], 'level': rows[0][1]} if rows else None
+
+    async def set_level(self, guild_id: int, user_id: int, xp: int, level: int):
+        await self._run(self._write, "INSERT OR REPLACE INTO levels (guild_id, user_id, xp, level) VALUES (?, ?, ?, ?)", (guild_id, user_id, xp, level))
+
+    async def get_levels(self, keys: list) -> dict:
+        by_guild = collections.defaultdict(list)
+        for guild_id, user_id in keys: by_guild[guild_id].append(user_id)
+        def select():
+            # Jedno zapytanie IN (...) na serwer i paczkę - poniżej limitu parametrów starszych SQLite (999).
+            result = {}
+            for guild_id, user_ids in by_guild.items():
+                for start in range(0, len(user_ids), 900):
+                    chunk = user_ids[start:start + 900]
+                    sql = f"SELECT user_id, xp, level FROM levels WHERE guild_id = ? AND user_id IN ({','.join('?' * len(chunk))})"
+                    for user_id, xp, level in self._conn.execute(sql, (guild_id, *chunk)): result[(guild_id, user_id)] = {'xp': xp, 'level': level}
+            return result
+        return await self._run(select)
+
+    async def set_levels(self, rows: list):
+        def write():
+            with self._conn: self._conn.executemany("INSERT OR REPLACE INTO levels (guild_id, user_id, xp, level) VALUES (?, ?, ?, ?)", rows)
+        await self._run(write)
+
+    async def top_levels(self, guild_id: int, limit: int, offset: int = 0) -> list:
+        return await self._run(self._query, "SELECT user_id, level, xp FROM levels WHERE guild_id = ? ORDER BY level DESC, xp DESC LIMIT ? OFFSET ?", (guild_id, limit, offset))
+
+    async def get_guild_levels(self, guild_id: int) -> list:
+        return await self._run(self._query, "SELECT user_id, level, xp FROM levels WHERE guild_id = ?", (guild_id,))
+
+    async def add_warning(self, guild_id: int, user_id: int, warning: dict) -> int:
+        def insert():
+            with self._conn:
+                self._conn.execute("INSERT INTO warnings (guild_id, user_id, reason, moderator_id, timestamp) VALUES (?, ?, ?, ?, ?)", (guild_id, user_id, warning['reason'], warning.get('moderator_id'), warning['timestamp']))
+                return self._conn.execute("SELECT COUNT(*) FROM warnings WHERE guild_id = ? AND user_id = ?", (guild_id, user_id)).fetchone()[0]
+        return await self._run(insert)
+
+    async def get_warnings(self, guild_id: int, user_id: int) -> list:
+        rows = await self._run(self._query, "SELECT reason, moderator_id, timestamp FROM warnings WHERE guild_id = ? AND user_id = ? ORDER BY id", (guild_id, user_id))
+        return [{'reason': reason, 'moderator_id': moderator_id, 'timestamp': timestamp} for reason, moderator_id, timestamp in rows]
+
+    async def delete_warning(self, guild_id: int, user_id: int, index: int) -> bool:
+        if index < 0: return False
+        def delete():
+            with self._conn:
+                row = self._conn.execute("SELECT id FROM warnings WHERE guild_id = ? AND user_id = ? ORDER BY id LIMIT 1 OFFSET ?", (guild_id, user_id, index)).fetchone()
+                if not row: return False
+                self._conn.execute("DELETE FROM warnings WHERE id = ?", (row[0],))
+                return True
+        return await self._run(delete)
+
+    async def load_giveaways(self, owns) -> dict:
+        rows = await self._run(self._query, "SELECT message_id, guild_id, data FROM giveaways")
+        return {str(message_id): json.loads(data) for message_id, guild_id, data in rows if owns(guild_id)}
+
+    async def save_giveaway(self, message_id: str, giveaway: dict):
+        # Serializacja na pętli - wątek SQLite nie może czytać listy uczestników zmienianej przez kolejne dołączenia.
+        await self._run(self._write, "INSERT OR REPLACE INTO giveaways (message_id, guild_id, data) VALUES (?, ?, ?)", (int(message_id), giveaway['guild_id'], json.dumps(giveaway)))
+
+    async def delete_giveaways(self, message_ids: list):
+        def delete():
+            with self._conn: self._conn.executemany("DELETE FROM giveaways WHERE message_id = ?", [(int(message_id),) for message_id in message_ids])
+        await self._run(delete)
+
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+def read_json_file(filename: str) -> dict:
+    try:
+        with open(filename, 'r', encoding='utf-8') as f: return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError): return {}
+
+def claim_migration(conn: sqlite3.Connection, marker: str) -> bool:
+    """Otwiera transakcję z blokadą zapisu i sprawdza znacznik migracji pod tą blokadą.
+
+    True oznacza, że migracja jest do zrobienia, a transakcja zostaje otwarta - dane i znacznik trafiają do bazy
+    jednym zatwierdzeniem. Drugi proces czeka na blokadę i widzi już znacznik, więc nic nie wstawia ponownie.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    if conn.execute("SELECT 1 FROM meta WHERE key = ?", (marker,)).fetchone(): conn.rollback(); return False
+    return True
+
+def migrate_json_to_sqlite(conn: sqlite3.Connection):
+    """Jednorazowo przenosi levels.json, server_configs.json i warnings.json do bazy SQLite."""
+    configs, levels, warnings = read_json_file('server_configs.json'), read_json_file('levels.json'), read_json_file('warnings.json')
+    if not claim_migration(conn, 'json_migrated'): return
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO guild_configs (guild_id, key, value) VALUES (?, ?, ?)",
+                         ((int(g), key, json.dumps(value)) for g, cfg in configs.items() for key, value in cfg.items()))
+        conn.executemany("INSERT OR REPLACE INTO levels (guild_id, user_id, xp, level) VALUES (?, ?, ?, ?)",
+                         ((int(g), int(u), d.get('xp', 0), d.get('level', 1)) for g, users in levels.items() for u, d in users.items()))
+        conn.executemany("INSERT INTO warnings (guild_id, user_id, reason, moderator_id, timestamp) VALUES (?, ?, ?, ?, ?)",
+                         ((int(g), int(u), w['reason'], w.get('moderator_id'), w['timestamp']) for g, users in warnings.items() for u, warns in users.items() for w in warns))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', ?)", (datetime.datetime.utcnow().isoformat(),))
+    print(f"Zmigrowano dane JSON do SQLite: {sum(len(u) for u in levels.values())} poziomów, {len(configs)} konfiguracji serwerów.")
+
+def migrate_giveaways_to_sqlite(conn: sqlite3.Connection):
+    """Jednorazowo przenosi konkursy z giveaways.json i dawnych plików procesów klastra (giveaways.clusterN.json)."""
+    giveaways = {}
+    for filename in ['giveaways.json', *sorted(glob.glob('giveaways.cluster*.json'))]: giveaways.update(read_json_file(filename))
+    if not claim_migration(conn, 'giveaways_migrated'): return
+    with conn:
+        conn.executemany("INSERT OR REPLACE INTO giveaways (message_id, guild_id, data) VALUES (?, ?, ?)",
+                         ((int(message_id), g['guild_id'], json.dumps(g)) for message_id, g in giveaways.items()))
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('giveaways_migrated', ?)", (datetime.datetime.utcnow().isoformat(),))
+    if giveaways: print(f"Zmigrowano konkursy do SQLite: {len(giveaways)}.")
+
+
+# =================================================================
+# SEKCJA 1C: RANKINGI POZIOMÓW
+# =================================================================
+class _SkipNode:
+    __slots__ = ('key', 'next', 'width')
+    def __init__(self, key, height: int):
+        self.key = key
+        self.next = [None] * height
+        self.width = [1] * height
+
+class RankIndex:
+    """Ranking jednego serwera jako indeksowana skiplista kluczy (-poziom, -xp, user_id).
+
+    Aktualizacja i pozycja użytkownika kosztują O(log n), strona top-N - O(log n + N).
+    """
+    MAX_HEIGHT = 32
+    _NIL_KEY = (float('inf'),)
+
+    def __init__(self, entries=()):
+        self._nil = _SkipNode(self._NIL_KEY, 0)
+        self._head = _SkipNode(None, self.MAX_HEIGHT)
+        self._keys = {user_id: (-level, -xp, user_id) for user_id, level, xp in entries}
+        self._levels = 1
+        self._build(sorted(self._keys.values()))
+
+    def __len__(self): return len(self._keys)
+    def __contains__(self, user_id: int): return user_id in self._keys
+
+    @staticmethod
+    def _random_height() -> int:
+        height = 1
+        while height < RankIndex.MAX_HEIGHT and random.random() < 0.5: height += 1
+        return height
+
+    def _build(self, keys: list):
+        """Buduje skiplistę z posortowanych kluczy w O(n) (zamiast n wstawień)."""
+        last, last_pos = [self._head] * self.MAX_HEIGHT, [0] * self.MAX_HEIGHT
+        for position, key in enumerate(keys, 1):
+            height = self._random_height()
+            self._levels = max(self._levels, height)
+            node = _SkipNode(key, height)
+            for level in range(height):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_pos[level]
+                last[level], last_pos[level] = node, position
+        for level in range(self.MAX_HEIGHT):
+            last[level].next[level] = self._nil
+            last[level].width[level] = len(keys) + 1 - last_pos[level]
+
+    def _insert(self, key):
+        height = self._random_height()
+        if height > self._levels:
+            for level in range(self._levels, height): self._head.width[level] = len(self._keys) + 1
+            self._levels = height
+        chain, steps_at_level = [None] * self._levels, [0] * self._levels
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while node.next[level].key < key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        new_node, steps = _SkipNode(key, height), 0
+        for level in range(height):
+            prev = chain[level]
+            new_node.next[level] = prev.next[level]
+            prev.next[level] = new_node
+            new_node.width[level] = prev.width[level] - steps
+            prev.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(height, self._levels): chain[level].width[level] += 1
+
+    def _remove(self, key):
+        chain, node = [None] * self._levels, self._head
+        for level in reversed(range(self._levels)):
+            while node.next[level].key < key: node = node.next[level]
+            chain[level] = node
+        target = chain[0].next[0]
+        for level in range(len(target.next)):
+            prev = chain[level]
+            prev.width[level] += target.width[level] - 1
+            prev.next[level] = target.next[level]
+        for level in range(len(target.next), self._levels): chain[level].width[level] -= 1
+
+    def update(self, user_id: int, level: int, xp: int):
+        key = (-level, -xp, user_id)
+        old_key = self._keys.get(user_id)
+        if old_key == key: return
+        # Usunięcie przed wstawieniem: _insert liczy szerokości nowych poziomów z len(self._keys).
+        if old_key is not None: self._remove(old_key); del self._keys[user_id]
+        self._insert(key)
+        self._keys[user_id] = key
+
+    def remove(self, user_id: int):
+        if (key := self._keys.get(user_id)) is not None: self._remove(key); del self._keys[user_id]
+
+    def rank(self, user_id: int) -> Optional[int]:
+        """Pozycja użytkownika (od 1) lub None, jeśli nie ma go w rankingu."""
+        if (key := self._keys.get(user_id)) is None: return None
+        node, position = self._head, 0
+        for level in reversed(range(self._levels)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position + 1
+
+    def page(self, offset: int, limit: int) -> list:
+        """Zwraca listę (user_id, poziom, xp) dla pozycji offset+1 .. offset+limit."""
+        if offset >= len(self._keys) or limit <= 0: return []
+        node, remaining = self._head, offset + 1
+        for level in reversed(range(self._levels)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        result = []
+        while node is not self._nil and len(result) < limit:
+            result.append((node.key[2], -node.key[0], -node.key[1]))
+            node = node.next[0]
+        return result
+
+class Leaderboards:
+    """Leniwie budowane indeksy rankingów per serwer, aktualizowane przyrostowo przy zmianie XP."""
+    def __init__(self, storage: StorageBackend):
+        self.storage = storage
+        self.indexes = {}
+        self._loading = {}  # guild_id -> (zdarzenie gotowości, aktualizacje z czasu ładowania)
+
+    async def get(self, guild_id: int) -> RankIndex:
+        if guild_id in self._loading: await self._loading[guild_id][0].wait()
+        if guild_id in self.indexes: return self.indexes[guild_id]
+        loaded, pending = asyncio.Event(), {}
+        self._loading[guild_id] = (loaded, pending)
+        try:
+            rows = {user_id: (level, xp) for user_id, level, xp in await self.storage.get_guild_levels(guild_id)}
+            # Zmiany z wiadomości przetworzonych w trakcie odczytu są nowsze niż odczytany stan.
+            rows.update(pending)
+            self.indexes[guild_id] = RankIndex((user_id, level, xp) for user_id, (level, xp) in rows.items())
+        finally:
+            del self._loading[guild_id]; loaded.set()
+        return self.indexes[guild_id]
+
+    def update(self, guild_id: int, user_id: int, level: int, xp: int):
+        if (index := self.indexes.get(guild_id)) is not None: index.update(user_id, level, xp)
+        elif guild_id in self._loading: self._loading[guild_id][1][user_id] = (level, xp)
+
+
+# =================================================================
+# SEKCJA 1D: COOLDOWNY XP
+# =================================================================
+XP_COOLDOWN = float(os.getenv("XP_COOLDOWN", "60"))
+
+class CooldownStore:
+    """Cooldowny kluczowane krotką (guild_id, user_id) z czasem wygaśnięcia z zegara monotonicznego.
+
+    Wpisy trafiają do kubełków koła czasowego według czasu wygaśnięcia; przy każdym sprawdzeniu
+    usuwane są kubełki, które już minęły, więc pamięć ogranicza się do osób aktywnych w ostatnim oknie.
+    """
+    def __init__(self, resolution: float = 5.0):
+        self.resolution = resolution
+        self._expiries = {}
+        self._buckets = collections.defaultdict(list)
+        self._next_bucket = int(time.monotonic() // resolution)
+
+    def __len__(self): return len(self._expiries)
+
+    def try_acquire(self, guild_id: int, user_id: int, cooldown: float = XP_COOLDOWN, now: Optional[float] = None) -> bool:
+        """Zwraca True i uruchamia cooldown, jeśli poprzedni już minął; w przeciwnym razie False."""
+        now = time.monotonic() if now is None else now
+        self.sweep(now)
+        key = (guild_id, user_id)
+        if (expires := self._expiries.get(key)) is not None and expires > now: return False
+        expires = now + cooldown
+        self._expiries[key] = expires
+        self._buckets[int(expires // self.resolution)].append(key)
+        return True
+
+    def sweep(self, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        current = int(now // self.resolution)
+        if current <= self._next_bucket: return
+        # Po długiej przerwie taniej przejrzeć istniejące kubełki niż każdy pusty po kolei.
+        due = range(self._next_bucket, current) if current - self._next_bucket <= len(self._buckets) else [b for b in self._buckets if b < current]
+        for bucket in due:
+            for key in self._buckets.pop(bucket, ()):
+                if (expires := self._expiries.get(key)) is not None and expires <= now: del self._expiries[key]
+        self._next_bucket = current
+
+    def discard_guild(self, guild_id: int):
+        for key in [key for key in self._expiries if key[0] == guild_id]: del self._expiries[key]
+
+
+# =================================================================
+# SEKCJA 1E: METRYKI (PROMETHEUS)
+# =================================================================
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 = endpoint wyłączony; w klastrze + CLUSTER_ID
+
+class Histogram:
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    __slots__ = ('counts', 'total', 'count')
+    def __init__(self): self.counts = [0] * len(self.BUCKETS); self.total = 0.0; self.count = 0
+    def observe(self, value: float):
+        for i, bound in enumerate(self.BUCKETS):
+            if value <= bound: self.counts[i] += 1; break
+        self.total += value; self.count += 1
+
+class Metrics:
+    """Rejestr histogramów, liczników i wskaźników wystawiany w formacie tekstowym Prometheusa.
+
+    Zapis odbywa się na pętli zdarzeń, odczyt z wątku serwera HTTP - stąd blokada. Wskaźniki
+    (gauges) są próbkowane na pętli, żeby wątek HTTP nie iterował po żywych strukturach bota.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = collections.defaultdict(float)
+        self.gauges = {}
+        self._gauge_sources = []
+        self._task = None
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted(labels.items())))
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self._lock:
+            if (histogram := self.histograms.get(key)) is None: histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name: str, amount: float = 1, **labels):
+        with self._lock: self.counters[self._key(name, labels)] += amount
+
+    def add_gauges(self, source):
+        """Rejestruje funkcję zwracającą listę (nazwa, etykiety, wartość), wywoływaną na pętli zdarzeń."""
+        self._gauge_sources.append(source)
+
+    def sample_gauges(self):
+        values = {}
+        for source in self._gauge_sources:
+            try:
+                for name, labels, value in source(): values[self._key(name, labels)] = value
+            except Exception as e: print(f"Błąd odczytu metryk: {e}")
+        with self._lock: self.gauges = values
+
+    def timed(self, name: str, **labels):
+        """Dekorator mierzący czas i błędy korutyny (np. eventu bota)."""
+        def decorator(func):
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try: return await func(*args, **kwargs)
+                except Exception:
+                    self.inc(f"{name}_errors_total", **labels); raise
+                finally: self.observe(f"{name}_latency_seconds", time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+    def instrument_tree(self, tree: app_commands.CommandTree):
+        """Owija callback każdej komendy aplikacji pomiarem czasu i licznikiem błędów."""
+        for command in tree.walk_commands():
+            if isinstance(command, app_commands.Command) and not getattr(command._callback, '__wrapped__', None):
+                command._callback = self.timed("bot_command", command=command.qualified_name)(command._callback)
+
+    async def _monitor(self, interval: float):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            lag = max(0.0, loop.time() - expected)
+            self.observe("bot_event_loop_lag_seconds", lag)
+            self.sample_gauges()
+
+    def start(self, host: str = METRICS_HOST, port: int = METRICS_PORT, interval: float = 1.0):
+        if self._task is None: self._task = asyncio.create_task(self._monitor(interval))
+        if not port: return
+        port += CLUSTER_ID or 0
+        import logging
+        from flask import Flask, Response
+        from werkzeug.serving import make_server
+        logging.getLogger("werkzeug").setLevel(logging.WARNING)
+        app = Flask("metrics")
+        app.add_url_rule("/metrics", "metrics", lambda: Response(self.render(), mimetype="text/plain; version=0.0.4"))
+        server = make_server(host, port, app, threaded=True)
+        threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+        print(f"Metryki dostępne pod http://{host}:{port}/metrics")
+
+    @staticmethod
+    def _labels(labels: tuple) -> str:
+        if not labels: return ""
+        escape = lambda value: str(value).replace('\\', '\\\\').replace('"', '\\"')
+        return "{" + ",".join(f'{k}="{escape(v)}"' for k, v in labels) + "}"
+
+    def render(self) -> str:
+        lines, typed = [], set()
+        def declare(name, kind):
+            if name not in typed: typed.add(name); lines.append(f"# TYPE {name} {kind}")
+        with self._lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                declare(name, "histogram")
+                cumulative = 0
+                for bound, count in zip(Histogram.BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', bound),))} {cumulative}")
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {histogram.count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram.total}")
+                lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(name, "counter"); lines.append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                declare(name, "gauge"); lines.append(f"{name}{self._labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+
+# =================================================================
+# SEKCJA 1F: DIAGNOSTYKA PĘTLI ZDARZEŃ
+# =================================================================
+STALL_THRESHOLD_MS = int(os.getenv("STALL_THRESHOLD_MS", "0"))  # 0 = strażnik wyłączony
+PROFILE_ON_START = int(os.getenv("PROFILE_ON_START", "0"))      # liczba sekund profilowania po starcie
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+class StallWatchdog:
+    """Wykrywa zablokowanie pętli zdarzeń i wypisuje stos tego, co ją blokuje.
+
+    Pętla co `interval` odświeża znacznik czasu; osobny wątek sprawdza, czy znacznik nie jest
+    starszy niż próg, i jeśli jest - zrzuca stos wątku pętli (raz na każde zablokowanie).
+    """
+    def __init__(self, threshold: float, interval: float = 0.05):
+        self.threshold, self.interval = threshold, interval
+        self._beat = time.monotonic()
+        self._loop = None
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+        self.stalls = 0
+
+    def _heartbeat(self):
+        self._beat = time.monotonic()
+        if not self._stopped.is_set(): self._loop.call_later(self.interval, self._heartbeat)
+
+    def start(self):
+        self._loop, self._loop_thread_id = asyncio.get_running_loop(), threading.get_ident()
+        self._heartbeat()
+        threading.Thread(target=self._watch, name="stall-watchdog", daemon=True).start()
+
+    def stop(self): self._stopped.set()
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat
+            if blocked < self.threshold:
+                if reported is not None: print(f"[watchdog] Pętla zdarzeń odblokowana po ~{(time.monotonic() - reported) * 1000:.0f} ms."); reported = None
+                continue
+            if reported is not None: continue
+            reported = beat
+            self.stalls += 1
+            metrics.inc("bot_event_loop_stalls_total")
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "(brak ramki)"
+            print(f"[watchdog] Pętla zdarzeń zablokowana od {blocked * 1000:.0f} ms. Stos wątku pętli:\n{stack}")
+
+class StartupTimer:
+    """Czas kolejnych etapów startu, liczony od pierwszej linii main.py."""
+    def __init__(self):
+        self.marks = [("importy", STARTUP_IMPORTED)]
+        self.reported = False
+
+    def mark(self, name: str):
+        self.marks.append((name, time.perf_counter()))
+
+    def report(self) -> str:
+        previous, parts = STARTUP_STARTED, []
+        for name, at in self.marks: parts.append(f"{name} {at - previous:.2f} s"); previous = at
+        return f"Start w {previous - STARTUP_STARTED:.2f} s: " + ", ".join(parts)
+
+class SamplingProfiler:
+    """Próbkujący profiler wątku pętli: zbiera stosy co `interval` i zapisuje je w formacie collapsed (flamegraph.pl)."""
+    def __init__(self, interval: float = 0.005, directory: str = PROFILE_DIR):
+        self.interval, self.directory = interval, directory
+        self.samples = collections.Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._target = None
+
+    @property
+    def running(self) -> bool: return self._thread is not None
+
+    def start(self, thread_id: Optional[int] = None):
+        if self.running: return
+        self._target = thread_id or threading.get_ident()
+        self.samples.clear(); self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame, stack = sys._current_frames().get(self._target), []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack: self.samples[";".join(reversed(stack))] += 1
+
+    def stop(self) -> Optional[str]:
+        """Zatrzymuje profilowanie i zapisuje wynik; zwraca ścieżkę pliku."""
+        if not self.running: return None
+        self._stop.set(); self._thread.join(); self._thread = None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"profile-{datetime.datetime.utcnow():%Y%m%d-%H%M%S}.folded")
+        with open(path, 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common(): f.write(f"{stack} {count}\n")
+        return path
+
+
+# =================================================================
+# SEKCJA 1G: KLASTER PROCESÓW
+# =================================================================
+CLUSTER_RESTART_MIN = float(os.getenv("CLUSTER_RESTART_MIN", "1"))  # opóźnienie pierwszego restartu (s), potem x2
+CLUSTER_RESTART_MAX = float(os.getenv("CLUSTER_RESTART_MAX", "300"))
+CLUSTER_STABLE_AFTER = float(os.getenv("CLUSTER_STABLE_AFTER", "600"))  # po tylu sekundach pracy awaria liczy się od nowa
+
+class ClusterStats:
+    """Lokalny kanał IPC klastra: segment pamięci współdzielonej z jednym licznikiem serwerów na proces."""
+    SLOT = 8
+
+    def __init__(self, name: str, slots: int, index: Optional[int] = None, create: bool = False):
+        self.slots, self.index = slots, index
+        self.shm = shared_memory.SharedMemory(name=name, create=create, size=slots * self.SLOT)
+        # Proces roboczy tylko dołącza do segmentu - nie może go usuwać przy wyjściu (robi to launcher).
+        if not create: resource_tracker.unregister(self.shm._name, "shared_memory")
+
+    def publish(self, guild_count: int):
+        self.shm.buf[self.index * self.SLOT:(self.index + 1) * self.SLOT] = guild_count.to_bytes(self.SLOT, 'little')
+
+    def total(self) -> int:
+        return sum(int.from_bytes(self.shm.buf[i * self.SLOT:(i + 1) * self.SLOT], 'little') for i in range(self.slots))
+
+    def close(self, unlink: bool = False):
+        self.shm.close()
+        if unlink: self.shm.unlink()
+
+def split_shards(shard_count: int, processes: int) -> list:
+    """Dzieli shardy 0..shard_count-1 na `processes` ciągłych zakresów."""
+    size, rest = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for i in range(processes):
+        end = start + size + (1 if i < rest else 0)
+        ranges.append(list(range(start, end))); start = end
+    return [r for r in ranges if r]
+
+async def fetch_recommended_shards(token: str) -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get("https://discord.com/api/v10/gateway/bot", headers={"Authorization": f"Bot {token}"}) as r:
+            r.raise_for_status()
+            return (await r.json())['shards']
+
+def run_cluster(token: str, processes: int):
+    """Uruchamia `processes` procesów bota, każdy z własnym zakresem shardów; restartuje te, które padną.
+
+    Restart odbywa się z wykładniczo rosnącym opóźnieniem, więc proces padający zaraz po starcie nie wpada
+    w pętlę; licznik awarii zeruje się, gdy proces przepracował stabilnie CLUSTER_STABLE_AFTER sekund.
+    """
+    shard_count = int(os.getenv("SHARD_COUNT", "0")) or asyncio.run(fetch_recommended_shards(token))
+    shard_ranges = split_shards(shard_count, processes)
+    stats = ClusterStats(name=None, slots=len(shard_ranges), create=True)
+    workers, started, failures, retry_at, stopping = {}, {}, {}, {}, False
+
+    def spawn(cluster_id: int):
+        env = dict(os.environ, CLUSTER_ID=str(cluster_id), CLUSTER_COUNT=str(len(shard_ranges)), CLUSTER_SHM=stats.shm.name,
+                   SHARD_COUNT=str(shard_count), SHARD_IDS=",".join(map(str, shard_ranges[cluster_id])))
+        workers[cluster_id] = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env)
+        started[cluster_id] = time.monotonic()
+        print(f"[klaster] Proces {cluster_id}: shardy {shard_ranges[cluster_id][0]}-{shard_ranges[cluster_id][-1]} z {shard_count} (PID {workers[cluster_id].pid})")
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for process in workers.values(): process.terminate()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    for cluster_id in range(len(shard_ranges)): spawn(cluster_id)
+    try:
+        while not stopping:
+            time.sleep(1)
+            now = time.monotonic()
+            for cluster_id, process in list(workers.items()):
+                if stopping or process.poll() is None: continue
+                if cluster_id not in retry_at:
+                    failures[cluster_id] = 1 if now - started[cluster_id] >= CLUSTER_STABLE_AFTER else failures.get(cluster_id, 0) + 1
+                    delay = min(CLUSTER_RESTART_MAX, CLUSTER_RESTART_MIN * 2 ** (failures[cluster_id] - 1))
+                    retry_at[cluster_id] = now + delay
+                    print(f"[klaster] Proces {cluster_id} zakończył się kodem {process.returncode}, ponowne uruchomienie za {delay:.0f} s (awaria nr {failures[cluster_id]}).")
+                elif now >= retry_at[cluster_id]:
+                    del retry_at[cluster_id]
+                    spawn(cluster_id)
+    finally:
+        for process in workers.values(): process.wait()
+        stats.close(unlink=True)
+
+
+# =================================================================
+# SEKCJA 1H: KRZYWA POZIOMÓW
+# =================================================================
+LEVEL_MAX = int(os.getenv("LEVEL_MAX", "1000"))
+DEFAULT_LEVEL_CURVE = (5, 50, 100)
+
+class LevelCurve:
+    """Stablicowane progi poziomów dla krzywej a*L^2 + b*L + c.
+
+    XP użytkownika jest skumulowane (nie jest zerowane przy awansie), a krzywa podaje łączne XP potrzebne
+    do przejścia z poziomu L na L+1 - dla domyślnych współczynników to dokładnie dawny wzór 5*L^2+50*L+100.
+    thresholds[i] to XP wymagane do poziomu i+1, więc poziom to wyszukiwanie binarne w tablicy.
+    """
+    __slots__ = ('coefficients', 'max_level', 'thresholds')
+
+    def __init__(self, coefficients: tuple = DEFAULT_LEVEL_CURVE, max_level: int = LEVEL_MAX):
+        a, b, c = self.coefficients = tuple(coefficients)
+        self.max_level = max_level
+        self.thresholds = [0] + [int(a * level ** 2 + b * level + c) for level in range(1, max_level)]
+
+    def level_for(self, xp: int) -> int:
+        return bisect.bisect_right(self.thresholds, xp)
+
+    def levels_for(self, xps: list) -> list:
+        """Poziomy dla całej listy XP naraz (przeliczanie całego serwera)."""
+        return list(map(functools.partial(bisect.bisect_right, self.thresholds), xps))
+
+    def next_threshold(self, level: int) -> Optional[int]:
+        """XP potrzebne do kolejnego poziomu albo None na poziomie maksymalnym."""
+        return self.thresholds[level] if level < self.max_level else None
+
+    def progress(self, xp: int) -> tuple:
+        """(poziom, XP zdobyte w obecnym poziomie, XP potrzebne na cały poziom)."""
+        level = self.level_for(xp)
+        if level >= self.max_level: return level, 0, 0
+        return level, xp - self.thresholds[level - 1], self.thresholds[level] - self.thresholds[level - 1]
+
+@functools.lru_cache(maxsize=64)
+def level_curve(coefficients: tuple = DEFAULT_LEVEL_CURVE) -> LevelCurve:
+    """Współdzielona tablica dla danych współczynników - serwery z tą samą krzywą nie budują jej osobno."""
+    return LevelCurve(coefficients)
+
+async def recompute_guild_levels(storage: StorageBackend, leaderboards: Leaderboards, guild_id: int, curve: LevelCurve) -> int:
+    """Przelicza poziomy całego serwera po zmianie krzywej: jeden odczyt, jeden zapis zbiorczy. Zwraca liczbę zmian."""
+    rows = await storage.get_guild_levels(guild_id)
+    levels = curve.levels_for([xp for _, _, xp in rows])
+    changed = [(guild_id, user_id, xp, new_level) for (user_id, level, xp), new_level in zip(rows, levels) if level != new_level]
+    if changed:
+        await storage.set_levels(changed)
+        for _, user_id, xp, level in changed: leaderboards.update(guild_id, user_id, level, xp)
+    return len(changed)
+
+
+# =================================================================
+# SEKCJA 1I: NALICZANIE XP
+# =================================================================
+XP_QUEUE_SIZE = int(os.getenv("XP_QUEUE_SIZE", "20000"))
+XP_BATCH_SIZE = int(os.getenv("XP_BATCH_SIZE", "500"))
+XP_BATCH_WINDOW = float(os.getenv("XP_BATCH_WINDOW", "0.5"))
+XP_ROLLS = range(15, 26)
+
+class XpPipeline:
+    """Naliczanie XP w partiach, oddzielone od on_message.
+
+    on_message tylko wrzuca (guild_id, user_id, channel_id, czas) do kolejki. Konsument zbiera
+    partię, sprawdza cooldowny, nalicza XP jednym odczytem i jednym zapisem do magazynu,
+    a gratulacje awansu łączy w jedną wiadomość na kanał.
+    """
+    def __init__(self, bot_instance: 'ConfigurableBot', max_size: int = XP_QUEUE_SIZE, batch_size: int = XP_BATCH_SIZE, window: float = XP_BATCH_WINDOW):
+        self.bot = bot_instance
+        self.queue = collections.deque()  # lżejsze niż asyncio.Queue: ingest to tylko append, partia to popleft w pętli
+        self.max_size, self.batch_size, self.window = max_size, batch_size, window
+        self.processed = self.dropped = self.batches = 0
+        self._ready = asyncio.Event()
+        self._stopping = False
+        self._task = None
+
+    def ingest(self, guild_id: int, user_id: int, channel_id: int):
+        if len(self.queue) >= self.max_size: self.dropped += 1; return
+        self.queue.append((guild_id, user_id, channel_id, time.monotonic()))
+        if not self._ready.is_set(): self._ready.set()
+
+    def start(self):
+        if self._task is None: self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Zatrzymuje konsumenta i nalicza to, co zostało w kolejce.
+
+        Konsument nie jest anulowany - przerwana w połowie partia zgubiłaby XP (w SQLite bez śladu). Dostaje
+        sygnał, opróżnia kolejkę i kończy się sam; pętla poniżej łapie tylko to, co przyszło już po nim.
+        """
+        if self._task:
+            self._stopping = True; self._ready.set()
+            await self._task; self._task = None
+        while self.queue: await self.apply(self._drain())
+
+    def _drain(self) -> list:
+        popleft = self.queue.popleft
+        return [popleft() for _ in range(min(self.batch_size, len(self.queue)))]
+
+    async def _run(self):
+        while True:
+            if not self.queue:
+                if self._stopping: return
+                self._ready.clear(); await self._ready.wait(); continue
+            # Krótkie okno zbierania, żeby w trakcie zalewu wiadomości zapisy szły dużymi partiami.
+            if self.window and len(self.queue) < self.batch_size and not self._stopping: await asyncio.sleep(self.window)
+            try: await self.apply(self._drain())
+            except Exception as e: print(f"Błąd naliczania XP: {e}")
+
+    async def apply(self, batch: list):
+        grants, settings = {}, {}
+        try_acquire = self.bot.xp_cooldowns.try_acquire
+        # Losowanie XP dla całej partii jednym wywołaniem (ten sam rozkład co randint(15, 25)).
+        for (guild_id, user_id, channel_id, timestamp), roll in zip(batch, random.choices(XP_ROLLS, k=len(batch))):
+            if (setting := settings.get(guild_id)) is None:
+                config = await self.bot.get_guild_config(guild_id)
+                setting = settings[guild_id] = (XP_COOLDOWN if config.xp_cooldown is None else config.xp_cooldown, 1.0 if config.xp_multiplier is None else config.xp_multiplier, level_curve(tuple(config.level_curve or DEFAULT_LEVEL_CURVE)))
+            if not try_acquire(guild_id, user_id, setting[0], now=timestamp): continue
+            key = (guild_id, user_id)
+            gained = round(roll * setting[1]) if setting[1] != 1.0 else roll
+            grants[key] = (grants[key][0] + gained, channel_id) if key in grants else (gained, channel_id)
+        self.processed += len(batch); self.batches += 1
+        if not grants: return
+
+        current = await self.bot.storage.get_levels(list(grants))
+        rows, level_ups = [], collections.defaultdict(list)
+        for (guild_id, user_id), (gained, channel_id) in grants.items():
+            user_data = current.get((guild_id, user_id)) or {'xp': 0, 'level': 1}
+            xp = user_data['xp'] + gained; level = settings[guild_id][2].level_for(xp)
+            rows.append((guild_id, user_id, xp, level))
+            if level > user_data['level']: level_ups[channel_id].append((user_id, level))
+        await self.bot.storage.set_levels(rows)
+        for guild_id, user_id, xp, level in rows: self.bot.leaderboards.update(guild_id, user_id, level, xp)
+        for channel_id, users in level_ups.items(): self._announce(channel_id, users)
+
+    def _announce(self, channel_id: int, users: list):
+        if not (channel := self.bot.get_channel(channel_id)): return
+        if len(users) == 1: content = f"🎉 Gratulacje, <@{users[0][0]}>! Osiągnąłeś **{users[0][1]}** poziom!"
+        else: content = "🎉 Gratulacje! Nowe poziomy: " + ", ".join(f"<@{user_id}> (**{level}**)" for user_id, level in users)
+        self.bot.rest.post('cosmetic', lambda: channel.send(content, delete_after=15))
+
+
+# =================================================================
+# SEKCJA 1J: NAPŁYW NOWYCH CZŁONKÓW
+# =================================================================
+JOIN_WINDOW = float(os.getenv("JOIN_WINDOW", "3"))
+JOIN_WELCOME_MENTIONS = 40
+ROLE_GRANT_RATE = float(os.getenv("ROLE_GRANT_RATE", "2"))     # nadania roli na sekundę na serwer
+ROLE_GRANT_BURST = int(os.getenv("ROLE_GRANT_BURST", "5"))
+ROLE_GRANT_RETRIES = int(os.getenv("ROLE_GRANT_RETRIES", "5"))
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate, self.burst = rate, burst
+        self.tokens, self.updated = float(burst), time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens, self.updated = min(self.burst, self.tokens + (now - self.updated) * self.rate), now
+            if self.tokens >= 1: self.tokens -= 1; return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class JoinAggregator:
+    """Zbiera wejścia na serwer w krótkim oknie: jedno powitanie na okno i kolejka nadawania auto-roli.
+
+    on_member_join tylko odkłada członka - wszystkie wywołania REST idą z zadań w tle, więc fala wejść
+    (raid, duża akcja z zaproszeniami) nie blokuje obsługi gatewaya. Role nadaje jeden worker na serwer,
+    ograniczony kubełkiem tokenów, z ponawianiem i wykładniczym odczekaniem przy 429/5xx.
+    """
+    def __init__(self, bot_instance, window: float = JOIN_WINDOW, rate: float = ROLE_GRANT_RATE, burst: int = ROLE_GRANT_BURST):
+        self.bot = bot_instance
+        self.window, self.rate, self.burst = window, rate, burst
+        self.pending = {}         # guild_id -> członkowie czekający na powitanie
+        self.grants = {}          # guild_id -> deque członków czekających na rolę
+        self.buckets = {}         # guild_id -> TokenBucket
+        self._tasks = {}          # (rodzaj, guild_id) -> zadanie
+        self.welcomed = self.granted = self.retries = 0
+
+    def add(self, member: Member):
+        guild_id = member.guild.id
+        self.pending.setdefault(guild_id, []).append(member)
+        self.grants.setdefault(guild_id, collections.deque()).append(member)
+        self._spawn('welcome', guild_id, self._welcome)
+        self._spawn('roles', guild_id, self._grant_roles)
+
+    def _spawn(self, kind: str, guild_id: int, func):
+        if (task := self._tasks.get((kind, guild_id))) and not task.done(): return
+        self._tasks[(kind, guild_id)] = asyncio.create_task(func(guild_id))
+
+    def stop(self):
+        for task in self._tasks.values(): task.cancel()
+        self._tasks.clear()
+
+    def stats(self) -> dict:
+        return {'pending_welcomes': sum(map(len, self.pending.values())), 'pending_roles': sum(map(len, self.grants.values())),
+                'welcomed': self.welcomed, 'granted': self.granted, 'retries': self.retries}
+
+    async def _welcome(self, guild_id: int):
+        while self.pending.get(guild_id):
+            await asyncio.sleep(self.window)
+            await self._send_welcome(self.pending.pop(guild_id))
+
+    async def _send_welcome(self, members: list):
+        guild = members[0].guild
+        if not (channel := (await self.bot.get_guild_config(guild.id)).channel(guild, 'welcome_channel_id')): return
+        if len(members) == 1:
+            embed = discord.Embed(title=f"Witaj na serwerze {guild.name}!", description=f"Cieszymy się, że dołączyłeś/aś, {members[0].mention}!", color=discord.Color.green())
+            embed.set_thumbnail(url=members[0].display_avatar.url)
+        else:
+            mentions = ", ".join(m.mention for m in members[:JOIN_WELCOME_MENTIONS])
+            if len(members) > JOIN_WELCOME_MENTIONS: mentions += f" i {len(members) - JOIN_WELCOME_MENTIONS} innych"
+            embed = discord.Embed(title=f"Witajcie na serwerze {guild.name}!", description=f"Cieszymy się, że dołączyliście: {mentions}!", color=discord.Color.green())
+            if guild.icon: embed.set_thumbnail(url=guild.icon.url)
+        try:
+            if await self.bot.rest.run('cosmetic', lambda: channel.send(embed=embed)): self.welcomed += len(members)
+        except discord.HTTPException as e: print(f"Błąd powitania na serwerze '{guild.name}': {e}")
+
+    async def _grant_roles(self, guild_id: int):
+        queue = self.grants[guild_id]
+        bucket = self.buckets.setdefault(guild_id, TokenBucket(self.rate, self.burst))
+        try:
+            while queue:
+                member = queue[0]
+                role = (await self.bot.get_guild_config(guild_id)).role(member.guild, 'auto_role_id')
+                if not role: queue.clear(); break
+                if member.guild.get_member(member.id) is None or role in member.roles: queue.popleft(); continue
+                await bucket.acquire()
+                for attempt in range(ROLE_GRANT_RETRIES + 1):
+                    try: await self.bot.rest.run('bulk', lambda: member.add_roles(role)); self.granted += 1; break
+                    except discord.Forbidden: print(f"Błąd uprawnień: Nie mogę nadać roli '{role.name}' na serwerze '{member.guild.name}'."); queue.clear(); return
+                    except discord.NotFound: break
+                    except discord.HTTPException as e:
+                        if (e.status != 429 and e.status < 500) or attempt == ROLE_GRANT_RETRIES: print(f"Nie udało się nadać roli {member} na serwerze '{member.guild.name}': {e}"); break
+                        self.retries += 1
+                        await asyncio.sleep(min(60, 2 ** attempt) * random.uniform(0.5, 1.5))
+                if queue and queue[0] is member: queue.popleft()
+        finally:
+            if not queue and self.grants.get(guild_id) is queue: self.grants.pop(guild_id); self.buckets.pop(guild_id, None)
+
+
+# =================================================================
+# SEKCJA 1K: HARMONOGRAM WYCHODZĄCYCH ŻĄDAŃ REST
+# =================================================================
+REST_CONCURRENCY = int(os.getenv("REST_CONCURRENCY", "6"))
+REST_RESERVED = int(os.getenv("REST_RESERVED", "2"))  # workery obsługujące wyłącznie pasy pilne
+REST_URGENT_LANES = ('moderation', 'interaction')
+REST_LANES = {  # pas: (priorytet, maks. długość kolejki, maks. czas oczekiwania w s) - 0 oznacza brak limitu
+    'moderation': (0, 0, 0),
+    'interaction': (1, 0, 0),
+    'music': (2, 100, 60),
+    'bulk': (3, 0, 0),  # operacje masowe w tle (role przy napływie członków) - bez pilnych workerów, ale bez porzucania
+    'cosmetic': (4, 200, 30),
+}
+
+class RestScheduler:
+    """Wspólna kolejka wywołań REST z pasami priorytetów: moderacja > interakcje > UI muzyki > operacje masowe > kosmetyka.
+
+    Żądania wykonuje REST_CONCURRENCY workerów, zawsze zaczynając od najważniejszego pasa, więc gratulacje
+    za poziom nie wyprzedzą bana. REST_RESERVED z nich obsługuje tylko pasy pilne (moderacja, interakcje):
+    wysyłki kosmetyczne czekające na 429 nie zajmą wszystkich workerów przed banem. Pasy z limitem odrzucają nowe żądania, gdy kolejka jest pełna, i porzucają
+    te, które czekały zbyt długo. Żądania z tym samym kluczem (np. edycja tej samej wiadomości) są scalane -
+    wykona się tylko najnowsza wersja, na pozycji najstarszej. Pierwsze odpowiedzi na interakcje nie przechodzą
+    przez kolejkę: mają własny limit Discorda i 3 sekundy na odpowiedź.
+    """
+    def __init__(self, concurrency: int = REST_CONCURRENCY):
+        self.concurrency = concurrency
+        self.reserved = min(REST_RESERVED, concurrency - 1)
+        self._heaps = {True: [], False: []}  # pilne / w tle
+        self._keys = {}
+        self._wakeup = asyncio.Event()
+        self._seq = itertools.count()
+        self._workers = []
+        self.depth = dict.fromkeys(REST_LANES, 0)
+
+    def start(self):
+        if not self._workers: self._workers = [asyncio.create_task(self._worker(reserved=i < self.reserved)) for i in range(self.concurrency)]
+
+    def stop(self):
+        for task in self._workers: task.cancel()
+        self._workers = []
+        for heap in self._heaps.values():
+            for entry in heap:
+                for future in entry[5]: future.cancel()
+            heap.clear()
+        self._keys.clear(); self.depth = dict.fromkeys(REST_LANES, 0)
+
+    def _enqueue(self, lane: str, factory, key, future) -> bool:
+        if key is not None and (entry := self._keys.get(key)) is not None:
+            entry[4] = factory
+            if future: entry[5].append(future)
+            metrics.inc("bot_rest_coalesced_total", lane=lane)
+            return True
+        priority, limit, _ = REST_LANES[lane]
+        if limit and self.depth[lane] >= limit:
+            metrics.inc("bot_rest_dropped_total", lane=lane, reason="full")
+            return False
+        entry = [priority, next(self._seq), lane, key, factory, [future] if future else [], time.monotonic()]
+        heapq.heappush(self._heaps[lane in REST_URGENT_LANES], entry)
+        if key is not None: self._keys[key] = entry
+        self.depth[lane] += 1
+        self._wakeup.set()
+        return True
+
+    def post(self, lane: str, factory, key=None):
+        """Zleca żądanie bez czekania na wynik; błędy są tylko logowane. `factory` zwraca korutynę."""
+        self._enqueue(lane, factory, key, None)
+
+    async def run(self, lane: str, factory, key=None):
+        """Zleca żądanie i czeka na jego wynik (None, jeśli zostało porzucone pod obciążeniem)."""
+        future = asyncio.get_running_loop().create_future()
+        if not self._enqueue(lane, factory, key, future): return None
+        return await future
+
+    def stats(self) -> list:
+        return [("bot_rest_queue_depth", {'lane': lane}, depth) for lane, depth in self.depth.items()]
+
+    def _take(self, reserved: bool):
+        if self._heaps[True]: return heapq.heappop(self._heaps[True])
+        if not reserved and self._heaps[False]: return heapq.heappop(self._heaps[False])
+        return None
+
+    async def _worker(self, reserved: bool):
+        while True:
+            while (entry := self._take(reserved)) is None:
+                self._wakeup.clear(); await self._wakeup.wait()
+            _, _, lane, key, factory, futures, enqueued = entry
+            if key is not None: self._keys.pop(key, None)
+            self.depth[lane] -= 1
+            waited = time.monotonic() - enqueued
+            metrics.observe("bot_rest_queue_wait_seconds", waited, lane=lane)
+            if (max_wait := REST_LANES[lane][2]) and waited > max_wait:
+                metrics.inc("bot_rest_dropped_total", lane=lane, reason="stale")
+                for future in futures:
+                    if not future.done(): future.set_result(None)
+                continue
+            try: result = await factory()
+            except asyncio.CancelledError:
+                for future in futures: future.cancel()
+                raise
+            except Exception as e:
+                metrics.inc("bot_rest_errors_total", lane=lane)
+                if not futures: print(f"Błąd żądania REST ({lane}): {e}")
+                for future in futures:
+                    if not future.done(): future.set_exception(e)
+            else:
+                for future in futures:
+                    if not future.done(): future.set_result(result)
+
+
+# =================================================================
+# SEKCJA 1L: SPRZĄTANIE STANU
+# =================================================================
+VOICE_IDLE_TIMEOUT = float(os.getenv("VOICE_IDLE_TIMEOUT", "300"))
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "60"))
+
+def deep_sizeof(obj, seen: Optional[set] = None) -> int:
+    """Przybliżony rozmiar struktury w bajtach: kontenery i obiekty ze slotami/__dict__, bez obiektów discord.py.
+
+    Graf jest przechodzony z jawnym stosem - długie łańcuchy węzłów (skiplisty RankIndex) nie wyczerpią limitu rekurencji.
+    """
+    seen = set() if seen is None else seen
+    size, stack = 0, [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, asyncio.Future)) or type(obj).__module__.startswith(('discord', 'asyncio')): continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+        if isinstance(obj, dict): stack.extend(obj.keys()); stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset, collections.deque)): stack.extend(obj)
+        elif hasattr(obj, '__dict__'): stack.append(vars(obj))
+        elif slots := getattr(type(obj), '__slots__', None): stack.extend(getattr(obj, name, None) for name in slots)
+    return size
+
+class StateReaper:
+    """Usuwa stan serwerów, których bot już nie obsługuje, i rozłącza bezczynne połączenia głosowe.
+
+    Reaguje na on_guild_remove i zmiany stanu głosowego, a co REAPER_INTERVAL sekund przegląda wszystko
+    jeszcze raz - na wypadek zdarzeń zgubionych przy reconnectach. Połączenie głosowe jest bezczynne, gdy
+    nic nie gra albo na kanale nie ma nikogo poza botami; po VOICE_IDLE_TIMEOUT sekundach jest zamykane.
+    """
+    def __init__(self, bot_instance, idle_timeout: float = VOICE_IDLE_TIMEOUT, interval: float = REAPER_INTERVAL):
+        self.bot = bot_instance
+        self.idle_timeout, self.interval = idle_timeout, interval
+        self.idle_since = {}
+        self.evicted = self.disconnected = 0
+        self._task = None
+
+    def start(self):
+        if self._task is None: self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task: self._task.cancel(); self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try: await self.sweep()
+            except Exception as e: print(f"Błąd sprzątania stanu: {e}")
+
+    def forget_guild(self, guild_id: int):
+        if music := getattr(self.bot, 'music_cog', None): music.forget(guild_id)
+        self.bot.xp_cooldowns.discard_guild(guild_id)
+        self.bot.leaderboards.indexes.pop(guild_id, None)
+        self.bot.storage.evict(guild_id)
+        self.idle_since.pop(guild_id, None)
+        self.evicted += 1
+
+    def voice_state_changed(self, member: Member, before: discord.VoiceState, after: discord.VoiceState):
+        guild = member.guild
+        if member.id == self.bot.user.id and after.channel is None:
+            # Rozłączenie bota (także wyrzucenie z kanału lub zerwane połączenie) - stan muzyki jest już nieaktualny.
+            if music := getattr(self.bot, 'music_cog', None): music.forget(guild.id)
+            self.idle_since.pop(guild.id, None)
+        elif vc := guild.voice_client: self._mark(guild.id, vc)
+
+    def _mark(self, guild_id: int, vc: discord.VoiceClient) -> bool:
+        idle = not vc.is_playing() or not any(not m.bot for m in vc.channel.members)
+        if idle: self.idle_since.setdefault(guild_id, time.monotonic())
+        else: self.idle_since.pop(guild_id, None)
+        return idle
+
+    async def sweep(self):
+        live = {guild.id for guild in self.bot.guilds}
+        voice = {vc.guild.id: vc for vc in self.bot.voice_clients}
+        music = getattr(self.bot, 'music_cog', None)
+        if music:
+            for guild_id in music.guild_ids() - live: self.forget_guild(guild_id)
+            # Stan bez połączenia głosowego i bez wczytywanej playlisty to pozostałość po zerwanym połączeniu.
+            for guild_id in music.guild_ids() - voice.keys():
+                if not music.resolvers.get(guild_id): music.forget(guild_id)
+        for guild_id in self.bot.leaderboards.indexes.keys() - live: self.forget_guild(guild_id)
+        for guild_id in self.idle_since.keys() - voice.keys(): del self.idle_since[guild_id]
+        now = time.monotonic()
+        for guild_id, vc in voice.items():
+            if self._mark(guild_id, vc) and now - self.idle_since[guild_id] >= self.idle_timeout:
+                self.idle_since.pop(guild_id, None)
+                if music: await music.teardown(guild_id)
+                else: await vc.disconnect()
+                self.disconnected += 1
+        self.bot.xp_cooldowns.sweep()
+
+    def structures(self) -> dict:
+        structures = {'xp_cooldowns': self.bot.xp_cooldowns._expiries, 'xp_cooldown_buckets': self.bot.xp_cooldowns._buckets,
+                      'leaderboards': self.bot.leaderboards.indexes, 'voice_idle': self.idle_since,
+                      'join_pending': self.bot.joins.pending, 'role_grants': self.bot.joins.grants, 'rest_queue_urgent': self.bot.rest._heaps[True], 'rest_queue_background': self.bot.rest._heaps[False], 'purges_active': self.bot.purger.active,
+                      'persistence_fragments': self.bot.persistence._fragments}
+        if music := getattr(self.bot, 'music_cog', None):
+            structures.update({'music_queues': music.queues, 'music_loop_states': music.loop_states, 'music_now_playing': music.now_playing_message,
+                               'music_resolvers': music.resolvers, 'music_prefetchers': music.prefetchers, 'music_track_ends_at': music.track_ends_at, 'music_volumes': music.volumes, 'music_play_locks': music.play_locks,
+                               'search_cache_memory': music.search_cache._memory, 'audio_cache_files': music.audio_cache.files, 'audio_cache_plays': music.audio_cache.plays})
+        return structures
+
+    def memory_report(self) -> list:
+        """(nazwa, liczba wpisów, przybliżony rozmiar w bajtach) dla każdej struktury, od największej."""
+        return sorted(((name, len(value), deep_sizeof(value)) for name, value in self.structures().items()), key=lambda row: row[2], reverse=True)
+
+
+# =================================================================
+# SEKCJA 1M: CZYSZCZENIE KANAŁÓW
+# =================================================================
+PURGE_MAX_MESSAGES = int(os.getenv("PURGE_MAX_MESSAGES", "50000"))   # górna granica dla /moderacja clear
+PURGE_SCAN_LIMIT = int(os.getenv("PURGE_SCAN_LIMIT", "200000"))      # ile wiadomości historii można przejrzeć w jednym czyszczeniu
+PURGE_SINGLE_RATE = float(os.getenv("PURGE_SINGLE_RATE", "1"))       # pojedyncze usunięcia starych wiadomości na sekundę
+PURGE_PROGRESS_INTERVAL = float(os.getenv("PURGE_PROGRESS_INTERVAL", "3"))
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14, minutes=-2)        # Discord odrzuca masowe usuwanie starszych wiadomości; 2 min zapasu
+
+class ChannelPurger:
+    """Strumieniowe czyszczenie kanału: historia jest czytana porcjami, a w pamięci jest najwyżej jedna paczka.
+
+    Pasujące wiadomości młodsze niż 14 dni idą do masowego usuwania po 100 sztuk; historia jest czytana od
+    najnowszych, więc po pierwszej starszej wiadomości reszta jest usuwana pojedynczo, w tempie PURGE_SINGLE_RATE.
+    Wszystkie wywołania idą pasem moderacji; na jednym kanale może trwać tylko jedno czyszczenie.
+    """
+    def __init__(self, bot_instance, single_rate: float = PURGE_SINGLE_RATE, scan_limit: int = PURGE_SCAN_LIMIT):
+        self.bot = bot_instance
+        self.single_rate, self.scan_limit = single_rate, scan_limit
+        self.active = set()
+        self.scanned = self.bulk_deleted = self.single_deleted = self.failed = 0
+
+    def stats(self) -> dict:
+        return {'active': len(self.active), 'scanned': self.scanned, 'bulk_deleted': self.bulk_deleted,
+                'single_deleted': self.single_deleted, 'failed': self.failed}
+
+    @staticmethod
+    def matcher(author_id: Optional[int] = None, pattern: Optional[re.Pattern] = None, attachments: Optional[bool] = None):
+        """Zwraca funkcję filtrującą wiadomości albo None, gdy nie podano żadnego filtra."""
+        checks = []
+        if author_id is not None: checks.append(lambda m: m.author.id == author_id)
+        if pattern is not None: checks.append(lambda m: pattern.search(m.content) is not None)
+        if attachments is not None: checks.append(lambda m: bool(m.attachments) == attachments)
+        return (lambda m: all(check(m) for check in checks)) if checks else None
+
+    async def purge(self, channel, limit: int, check=None, after: Optional[datetime.datetime] = None, progress=None) -> dict:
+        """Usuwa do `limit` wiadomości spełniających `check`; `progress(counts)` jest wołane co PURGE_PROGRESS_INTERVAL s.
+
+        Kanał rezerwuje wywołujący (reserve/release) - jeszcze przed pierwszym await, żeby dwa czyszczenia się nie nałożyły.
+        """
+        counts = {'scanned': 0, 'deleted': 0, 'old': 0, 'failed': 0}
+        bucket = TokenBucket(self.single_rate, 1)
+        batch, matched, reported = [], 0, time.monotonic()
+        async for message in channel.history(limit=self.scan_limit, after=after, oldest_first=False):
+            counts['scanned'] += 1; self.scanned += 1
+            if check is None or check(message):
+                matched += 1
+                if message.created_at > discord.utils.utcnow() - BULK_DELETE_MAX_AGE:
+                    batch.append(message)
+                    if len(batch) == 100: await self._bulk(channel, batch, bucket, counts); batch = []
+                else:
+                    if batch: await self._bulk(channel, batch, bucket, counts); batch = []
+                    await self._single(message, bucket, counts)
+                if matched >= limit: break
+            if progress and time.monotonic() - reported >= PURGE_PROGRESS_INTERVAL:
+                reported = time.monotonic(); progress(counts)
+        if batch: await self._bulk(channel, batch, bucket, counts)
+        return counts
+
+    def reserve(self, channel_id: int) -> bool:
+        """Zajmuje kanał dla jednego czyszczenia; False, jeśli już trwa tam inne."""
+        if channel_id in self.active: return False
+        self.active.add(channel_id)
+        return True
+
+    def release(self, channel_id: int):
+        self.active.discard(channel_id)
+
+    async def _bulk(self, channel, messages: list, bucket: TokenBucket, counts: dict):
+        # Paczka mogła się zestarzeć podczas zbierania - przeterminowane wiadomości wracają do ścieżki pojedynczej.
+        cutoff = discord.utils.utcnow() - BULK_DELETE_MAX_AGE
+        fresh = [m for m in messages if m.created_at > cutoff]
+        if len(fresh) >= 2:
+            try:
+                await self.bot.rest.run('moderation', lambda: channel.delete_messages(fresh))
+                counts['deleted'] += len(fresh); self.bulk_deleted += len(fresh)
+                fresh = []
+            except discord.Forbidden: raise
+            except discord.HTTPException as e: print(f"Masowe usuwanie na kanale {channel.id} nie powiodło się, usuwam pojedynczo: {e}")
+        for message in fresh + [m for m in messages if m.created_at <= cutoff]: await self._single(message, bucket, counts)
+
+    async def _single(self, message: discord.Message, bucket: TokenBucket, counts: dict):
+        await bucket.acquire()
+        try:
+            await self.bot.rest.run('moderation', message.delete)
+            counts['deleted'] += 1; counts['old'] += message.created_at <= discord.utils.utcnow() - BULK_DELETE_MAX_AGE; self.single_deleted += 1
+        except discord.NotFound: pass
+        except discord.Forbidden: raise
+        except discord.HTTPException: counts['failed'] += 1; self.failed += 1
 
 
 # =================================================================
 # SEKCJA 2: GŁÓWNA KLASA BOTA I JEJ INSTANCJA
 # =================================================================
-class ConfigurableBot(commands.Bot):
-    """Główna klasa bota, dziedzicząca po commands.Bot dla rozszerzalności."""
+COMMAND_SYNC = os.getenv("COMMAND_SYNC", "auto")      # auto = tylko po zmianie drzewa, force = zawsze, off = nigdy
+DEV_GUILD_ID = int(os.getenv("DEV_GUILD_ID", "0"))    # serwer testowy do szybkiej synchronizacji komend
+
+class ConfigurableBot(commands.AutoShardedBot):
+    """Główna klasa bota, dziedzicząca po commands.AutoShardedBot dla rozszerzalności i shardingu.
+
+    Zakres shardów można zawęzić przez SHARD_COUNT/SHARD_IDS (ustawiane przez launcher klastra).
+    """
     def __init__(self):
         intents = discord.Intents.default()
         intents.members = True
         intents.message_content = True
-        super().__init__(command_prefix="!unused!", intents=intents)
-
-        self.server_configs = self.load_data('server_configs.json')
-        self.warnings_data = self.load_data('warnings.json')
+        shard_ids = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i]
+        super().__init__(command_prefix="!unused!", intents=intents, shard_count=int(os.getenv("SHARD_COUNT", "0")) or None, shard_ids=shard_ids or None)
+        self.cluster = ClusterStats(os.environ["CLUSTER_SHM"], int(os.environ["CLUSTER_COUNT"]), CLUSTER_ID) if CLUSTER_ID is not None else None
+
+        self.persistence = PersistenceEngine()
+        self.storage = SqliteStorage() if STORAGE_BACKEND == "sqlite" else JsonStorage(self.persistence)
+        self.leaderboards = Leaderboards(self.storage)
+        self.xp_pipeline = XpPipeline(self)
+        self.joins = JoinAggregator(self)
+        self.rest = RestScheduler()
+        self.purger = ChannelPurger(self)
+        self.reaper = StateReaper(self)
         self.notes_data = self.load_data('notes.json')
-        self.levels_data = self.load_data('levels.json')
-        self.xp_cooldowns = {}
+        self.xp_cooldowns = CooldownStore()
+        self.watchdog = StallWatchdog(STALL_THRESHOLD_MS / 1000) if STALL_THRESHOLD_MS else None
+        self.profiler = SamplingProfiler()
+        self.startup = StartupTimer()
+        self.startup.mark("konstrukcja bota")
 
     def load_data(self, filename):
-        try:
-            with open(filename, 'r', encoding='utf-8') as f: return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError): return {}
+        return self.persistence.load(filename)
+
+    def save_data(self, data, filename, key=None):
+        """Nie zapisuje od razu - oznacza dane jako brudne, zapis wykona PersistenceEngine w tle."""
+        self.persistence.mark_dirty(data, filename, key)
+
+    def owns_guild(self, guild_id: int) -> bool:
+        """Czy serwer trafia na shard obsługiwany przez ten proces (poza klastrem - zawsze)."""
+        return not self.shard_ids or (guild_id >> 22) % self.shard_count in self.shard_ids
 
-    def save_data(self, data, filename):
-        with open(filename, 'w', encoding='utf-8') as f: json.dump(data, f, indent=4)
+    async def get_guild_config(self, guild_id: int) -> GuildConfig:
+        return await self.storage.get_guild_config(guild_id)
 
-    def get_config(self, guild_id: int, key: str):
-        return self.server_configs.get(str(guild_id), {}).get(key, None)
+    async def get_config(self, guild_id: int, key: str):
+        return (await self.storage.get_guild_config(guild_id)).get(key)
 
-    def set_config(self, guild_id: int, key: str, value):
-        guild_id_str = str(guild_id)
-        if guild_id_str not in self.server_configs: self.server_configs[guild_id_str] = {}
-        self.server_configs[guild_id_str][key] = value
-        self.save_data(self.server_configs, 'server_configs.json')
+    async def set_config(self, guild_id: int, key: str, value):
+        await self.storage.update_config(guild_id, {key: value})
+
+    async def update_config(self, guild_id: int, **values):
+        """Kilka kluczy naraz - jedna zmiana obiektu i jeden zapis."""
+        await self.storage.update_config(guild_id, values)
+
+    async def get_level_curve(self, guild_id: int) -> LevelCurve:
+        return level_curve(tuple((await self.get_guild_config(guild_id)).level_curve or DEFAULT_LEVEL_CURVE))
 
     async def setup_hook(self):
         """Metoda wywoływana przy starcie bota. Rejestruje komendy i widoki."""
         self.session = aiohttp.ClientSession()
+        self.persistence.start()
+        self.rest.start()
+        self.reaper.start()
+        self.xp_pipeline.start()
+        if self.watchdog: self.watchdog.start()
+        if PROFILE_ON_START:
+            self.profiler.start()
+            self.loop.call_later(PROFILE_ON_START, lambda: print(f"Zapisano profil: {self.profiler.stop()}"))
 
         # Inicjalizacja Coga Muzycznego i jego widoku
         self.music_cog = Music(self)
@@ -65,6 +1655,10 @@ class ConfigurableBot(commands.Bot):
         self.add_view(TicketCreateView(self))
         self.add_view(TicketCloseView(self))
         self.add_view(VerificationView(self))
+        self.giveaways = GiveawayManager(self)
+        await self.giveaways.load()
+        self.add_view(GiveawayView(self))
+        self.giveaways.start()
 
         # Rejestracja wszystkich grup komend
         self.tree.add_command(Konfiguracja(self))
@@ -72,17 +1666,83 @@ class ConfigurableBot(commands.Bot):
         self.tree.add_command(Uzytkowe(self))
         self.tree.add_command(Rozrywka(self))
         self.tree.add_command(self.music_cog)
+        self.tree.add_command(Debug(self))
 
         # Rejestracja samodzielnych komend
         self.tree.add_command(giveaway)
+        self.tree.add_command(giveaway_reroll)
         self.tree.add_command(embed)
 
-        synced = await self.tree.sync()
-        print(f"Zsynchronizowano {len(synced)} komend.")
+        metrics.instrument_tree(self.tree)
+        metrics.add_gauges(self.collect_metrics)
+        metrics.start()
+        self.startup.mark("setup_hook")
+
+        if CLUSTER_ID:
+            return  # komendy są globalne - synchronizuje je tylko pierwszy proces klastra
+        synced = await self.sync_commands()
+        self.startup.mark("synchronizacja komend")
+        print(f"Zsynchronizowano {synced} komend." if synced is not None else "Drzewo komend bez zmian - pominięto synchronizację.")
+
+    def command_fingerprint(self, guild: Optional[discord.abc.Snowflake] = None) -> str:
+        payload = sorted((command.to_dict(self.tree) for command in self.tree.get_commands(guild=guild)), key=lambda c: (c.get('type', 1), c['name']))
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+    async def sync_commands(self) -> Optional[int]:
+        """Synchronizuje drzewo komend tylko wtedy, gdy jego odcisk różni się od zapisanego po ostatniej synchronizacji.
+
+        Z DEV_GUILD_ID komendy trafiają tylko na serwer testowy (od razu widoczne, bez globalnego limitu).
+        Zwraca liczbę zsynchronizowanych komend albo None, jeśli synchronizacja była zbędna.
+        """
+        guild = discord.Object(id=DEV_GUILD_ID) if DEV_GUILD_ID else None
+        if guild: self.tree.copy_global_to(guild=guild)
+        target, fingerprint = str(DEV_GUILD_ID) if guild else "global", self.command_fingerprint(guild)
+        state = self.load_data(data_file('command_sync.json'))
+        if COMMAND_SYNC == "off" or (COMMAND_SYNC == "auto" and state.get(target) == fingerprint): return None
+        synced = await self.tree.sync(guild=guild)
+        state[target] = fingerprint
+        self.save_data(state, data_file('command_sync.json'), target)
+        await self.persistence.flush()  # odcisk musi przetrwać nawet szybki restart
+        return len(synced)
+
+    def collect_metrics(self) -> list:
+        """Wskaźniki stanu bota dla endpointu /metrics (wywoływane na pętli zdarzeń)."""
+        values = [("bot_guilds", {}, len(self.guilds)), ("bot_xp_cooldown_entries", {}, len(self.xp_cooldowns)),
+                  ("bot_xp_queue_depth", {}, len(self.xp_pipeline.queue)), ("bot_xp_dropped", {}, self.xp_pipeline.dropped),
+                  *((f"bot_joins_{key}", {}, value) for key, value in self.joins.stats().items()), *self.rest.stats(),
+                  *((f"bot_purge_{key}", {}, value) for key, value in self.purger.stats().items()),
+                  *(("bot_state_entries", {'structure': name}, len(value)) for name, value in self.reaper.structures().items()),
+                  ("bot_state_evicted_guilds", {}, self.reaper.evicted), ("bot_voice_idle_disconnects", {}, self.reaper.disconnected),
+                  ("bot_persistence_flushes", {}, self.persistence.flush_count), ("bot_giveaways_pending", {}, len(self.giveaways._heap))]
+        if math.isfinite(self.latency): values.append(("bot_gateway_latency_seconds", {}, self.latency))
+        if music := getattr(self, 'music_cog', None):
+            values.append(("bot_music_queue_depth", {}, sum(len(queue) for queue in music.queues.values())))
+            values.append(("bot_music_voice_clients", {}, len(self.voice_clients)))
+            for key, value in music.extractor.stats().items(): values.append((f"bot_ytdl_{key}", {}, value))
+            for key, value in music.search_cache.stats().items(): values.append((f"bot_search_cache_{key}", {}, value))
+            for key, value in music.audio_cache.stats().items(): values.append((f"bot_audio_cache_{key}", {}, value))
+        return values
 
     async def on_ready(self):
         print(f'Zalogowano jako: {self.user.name} | ID: {self.user.id}')
-        status_task.start()
+        if not self.startup.reported:
+            self.startup.mark("logowanie i gateway"); self.startup.reported = True
+            print(self.startup.report())
+            self.music_cog.warm_up()
+        if not status_task.is_running(): status_task.start()
+
+    async def close(self):
+        if giveaways := getattr(self, 'giveaways', None): giveaways.stop()
+        if self.watchdog: self.watchdog.stop()
+        self.reaper.stop()
+        if path := self.profiler.stop(): print(f"Zapisano profil: {path}")
+        self.joins.stop()
+        await self.xp_pipeline.stop()
+        await self.persistence.stop()
+        await self.storage.close()
+        if music_cog := getattr(self, 'music_cog', None): await music_cog.close()
+        self.rest.stop()
+        await super().close()
 
 bot = ConfigurableBot()
 
@@ -92,7 +1752,9 @@ bot = ConfigurableBot()
 # =================================================================
 @tasks.loop(seconds=30)
 async def status_task():
-    await bot.change_presence(activity=discord.Game(f"na {len(bot.guilds)} serwerach"))
+    guild_count = len(bot.guilds)
+    if bot.cluster: bot.cluster.publish(guild_count); guild_count = bot.cluster.total()
+    bot.rest.post('cosmetic', lambda: bot.change_presence(activity=discord.Game(f"na {guild_count} serwerach")), key='presence')
 
 def parse_duration(duration_str: str) -> Optional[datetime.timedelta]:
     matches = re.findall(r'(\d+)([dhms])', duration_str.lower())
@@ -103,44 +1765,38 @@ def parse_duration(duration_str: str) -> Optional[datetime.timedelta]:
     return datetime.timedelta(**delta_args)
 
 @bot.event
+@metrics.timed("bot_event", event="on_member_join")
 async def on_member_join(member: Member):
-    guild = member.guild
-    welcome_channel_id = bot.get_config(guild.id, 'welcome_channel_id')
-    if welcome_channel_id and (channel := guild.get_channel(welcome_channel_id)):
-        embed = discord.Embed(title=f"Witaj na serwerze {guild.name}!", description=f"Cieszymy się, że dołączyłeś/aś, {member.mention}!", color=discord.Color.green())
-        embed.set_thumbnail(url=member.display_avatar.url)
-        await channel.send(embed=embed)
-    auto_role_id = bot.get_config(guild.id, 'auto_role_id')
-    if auto_role_id and (role := guild.get_role(auto_role_id)):
-        try: await member.add_roles(role)
-        except discord.Forbidden: print(f"Błąd uprawnień: Nie mogę nadać roli '{role.name}' na serwerze '{guild.name}'.")
+    bot.joins.add(member)
 
 @bot.event
 async def on_member_remove(member: Member):
-    goodbye_channel_id = bot.get_config(member.guild.id, 'goodbye_channel_id')
-    if goodbye_channel_id and (channel := member.guild.get_channel(goodbye_channel_id)):
+    if channel := (await bot.get_guild_config(member.guild.id)).channel(member.guild, 'goodbye_channel_id'):
         embed = discord.Embed(title="Użytkownik opuścił serwer", description=f"Żegnaj, **{member.display_name}**.", color=discord.Color.red())
         embed.set_thumbnail(url=member.display_avatar.url)
-        await channel.send(embed=embed)
+        bot.rest.post('cosmetic', lambda: channel.send(embed=embed))
 
 @bot.event
+@metrics.timed("bot_event", event="on_message")
 async def on_message(message: discord.Message):
     if message.author.bot or not message.guild: return
-    guild_id, user_id = str(message.guild.id), str(message.author.id)
-    cooldown_key = f"{guild_id}-{user_id}"
-    if cooldown_key in bot.xp_cooldowns and (datetime.datetime.utcnow() - bot.xp_cooldowns[cooldown_key]).total_seconds() < 60: return
-    bot.xp_cooldowns[cooldown_key] = datetime.datetime.utcnow()
-    if guild_id not in bot.levels_data: bot.levels_data[guild_id] = {}
-    if user_id not in bot.levels_data[guild_id]: bot.levels_data[guild_id][user_id] = {'xp': 0, 'level': 1}
-    bot.levels_data[guild_id][user_id]['xp'] += random.randint(15, 25)
-    current_level = bot.levels_data[guild_id][user_id]['level']
-    xp_needed = int(5 * (current_level ** 2) + 50 * current_level + 100)
-    if bot.levels_data[guild_id][user_id]['xp'] >= xp_needed:
-        bot.levels_data[guild_id][user_id]['level'] += 1
-        new_level = bot.levels_data[guild_id][user_id]['level']
-        try: await message.channel.send(f"🎉 Gratulacje, {message.author.mention}! Osiągnąłeś **{new_level}** poziom!", delete_after=15)
-        except discord.Forbidden: pass
-    bot.save_data(bot.levels_data, 'levels.json')
+    bot.xp_pipeline.ingest(message.guild.id, message.author.id, message.channel.id)
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    bot.reaper.forget_guild(guild.id)
+
+@bot.event
+async def on_voice_state_update(member: Member, before: discord.VoiceState, after: discord.VoiceState):
+    bot.reaper.voice_state_changed(member, before, after)
+
+@bot.event
+async def on_guild_role_delete(role: Role):
+    (await bot.get_guild_config(role.guild.id)).invalidate()
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    (await bot.get_guild_config(channel.guild.id)).invalidate()
 
 # =================================================================
 # SEKCJA 4: WSZYSTKIE KLASY WIDOKÓW I KOMEND
@@ -149,26 +1805,25 @@ class VerificationView(ui.View):
     def __init__(self, bot_instance): super().__init__(timeout=None); self.bot = bot_instance
     @ui.button(label="✅ Zweryfikuj się", style=ButtonStyle.success, custom_id="verify_button")
     async def verify_button(self, interaction: Interaction, button: ui.Button):
-        role_id = self.bot.get_config(interaction.guild.id, 'verification_role_id')
-        if not role_id or not (role := interaction.guild.get_role(role_id)): return await interaction.response.send_message("Błąd: Rola weryfikacyjna nie jest skonfigurowana.", ephemeral=True)
+        config = await self.bot.get_guild_config(interaction.guild.id)
+        if not (role := config.role(interaction.guild, 'verification_role_id')): return await interaction.response.send_message("Błąd: Rola weryfikacyjna nie jest skonfigurowana.", ephemeral=True)
         if role in interaction.user.roles: return await interaction.response.send_message("Jesteś już zweryfikowany.", ephemeral=True)
-        try: await interaction.user.add_roles(role); await interaction.response.send_message("Pomyślnie Cię zweryfikowano!", ephemeral=True)
-        except discord.Forbidden: await interaction.response.send_message("Błąd: Nie mam uprawnień, by nadać Ci tę rolę.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)  # odpowiedź w 3 s, niezależnie od kolejki REST
+        try: await self.bot.rest.run('interaction', lambda: interaction.user.add_roles(role)); await interaction.followup.send("Pomyślnie Cię zweryfikowano!", ephemeral=True)
+        except discord.Forbidden: await interaction.followup.send("Błąd: Nie mam uprawnień, by nadać Ci tę rolę.", ephemeral=True)
 
 class TicketCreateView(ui.View):
     def __init__(self, bot_instance): super().__init__(timeout=None); self.bot = bot_instance
     @ui.button(label="✉️ Utwórz Ticket", style=ButtonStyle.primary, custom_id="create_ticket_button")
     async def create_ticket(self, interaction: Interaction, button: ui.Button):
         await interaction.response.defer(ephemeral=True, thinking=True)
-        category_id = self.bot.get_config(interaction.guild.id, 'ticket_category_id')
-        staff_role_id = self.bot.get_config(interaction.guild.id, 'ticket_staff_role_id')
-        if not category_id or not staff_role_id: return await interaction.followup.send("System ticketów nie jest skonfigurowany.", ephemeral=True)
-        category = interaction.guild.get_channel(category_id)
-        staff_role = interaction.guild.get_role(staff_role_id)
+        config = await self.bot.get_guild_config(interaction.guild.id)
+        category, staff_role = config.channel(interaction.guild, 'ticket_category_id'), config.role(interaction.guild, 'ticket_staff_role_id')
+        if not category or not staff_role: return await interaction.followup.send("System ticketów nie jest skonfigurowany.", ephemeral=True)
         overwrites = {interaction.guild.default_role: discord.PermissionOverwrite(view_channel=False), interaction.user: discord.PermissionOverwrite(view_channel=True), staff_role: discord.PermissionOverwrite(view_channel=True, manage_channels=True)}
-        channel = await category.create_text_channel(name=f"ticket-{interaction.user.name}", overwrites=overwrites)
+        channel = await self.bot.rest.run('interaction', lambda: category.create_text_channel(name=f"ticket-{interaction.user.name}", overwrites=overwrites))
         embed = discord.Embed(title="Ticket otwarty!", description=f"Witaj {interaction.user.mention}! Opisz swój problem, a ktoś z {staff_role.mention} wkrótce się z Tobą skontaktuje.", color=0x2ecc71)
-        await channel.send(content=f"{interaction.user.mention} {staff_role.mention}", embed=embed, view=TicketCloseView(self.bot))
+        await self.bot.rest.run('interaction', lambda: channel.send(content=f"{interaction.user.mention} {staff_role.mention}", embed=embed, view=TicketCloseView(self.bot)))
         await interaction.followup.send(f"Twój ticket został otwarty: {channel.mention}", ephemeral=True)
 
 class TicketCloseView(ui.View):
@@ -177,58 +1832,169 @@ class TicketCloseView(ui.View):
     async def close_ticket(self, interaction: Interaction, button: ui.Button):
         await interaction.response.send_message("Kanał zostanie usunięty za 5 sekund...")
         await asyncio.sleep(5)
-        await interaction.channel.delete(reason=f"Ticket zamknięty przez {interaction.user.name}")
+        await self.bot.rest.run('interaction', lambda: interaction.channel.delete(reason=f"Ticket zamknięty przez {interaction.user.name}"))
 
 class GiveawayView(ui.View):
-    def __init__(self, bot_instance, end_time: datetime.datetime, prize: str):
-        super().__init__(timeout=(end_time - datetime.datetime.utcnow()).total_seconds()); self.bot = bot_instance; self.prize = prize; self.participants = set()
+    """Trwały widok konkursu - jeden dla wszystkich konkursów, kierowany po ID wiadomości."""
+    def __init__(self, bot_instance): super().__init__(timeout=None); self.bot = bot_instance
+
+    @classmethod
+    def detached(cls, bot_instance, disabled: bool = False) -> 'GiveawayView':
+        """Widok tylko do wysłania/edycji wiadomości: zatrzymany, więc discord.py nie zapamięta go dla tej wiadomości.
+
+        Kliknięcia obsługuje jeden trwały widok zarejestrowany w setup_hook (po custom_id).
+        """
+        view = cls(bot_instance)
+        for item in view.children: item.disabled = disabled
+        view.stop()
+        return view
+
     @ui.button(label="🎉 Dołącz", style=ButtonStyle.success, custom_id="join_giveaway_button")
     async def join_giveaway(self, interaction: Interaction, button: ui.Button):
-        if interaction.user.id in self.participants: return await interaction.response.send_message("Już bierzesz udział!", ephemeral=True)
-        self.participants.add(interaction.user.id); await interaction.response.send_message("Pomyślnie dołączyłeś/aś do konkursu!", ephemeral=True)
-    async def on_timeout(self):
-        for item in self.children: item.disabled = True
+        await self.bot.giveaways.join(interaction)
+
+class GiveawayManager:
+    """Konkursy zapisywane w magazynie bota i kończone przez jeden harmonogram oparty na kopcu czasów zakończenia.
+
+    Każdy konkurs jest przypisany do serwera, więc w klastrze proces wczytuje tylko konkursy ze swoich shardów.
+    """
+    RETENTION = 30 * 24 * 3600  # zakończone konkursy trzymamy do ewentualnego losowania ponownie
+
+    def __init__(self, bot_instance: 'ConfigurableBot'):
+        self.bot = bot_instance
+        self.data, self.entrants, self._heap = {}, {}, []
+        self._wake = asyncio.Event()
+        self._task = None
+
+    async def load(self):
+        self.data = await self.bot.storage.load_giveaways(self.bot.owns_guild)
+        now = time.time()
+        if expired := [m for m, g in self.data.items() if g['ended'] and now - g['end_ts'] > self.RETENTION]:
+            for message_id in expired: del self.data[message_id]
+            await self.bot.storage.delete_giveaways(expired)
+        self.entrants = {message_id: set(g['entrants']) for message_id, g in self.data.items()}
+        self._heap = [(g['end_ts'], message_id) for message_id, g in self.data.items() if not g['ended']]
+        heapq.heapify(self._heap)
+
+    def start(self):
+        if self._task is None: self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task: self._task.cancel(); self._task = None
+
+    async def _run(self):
+        while True:
+            self._wake.clear()
+            if not self._heap:
+                await self._wake.wait(); continue
+            delay = self._heap[0][0] - time.time()
+            if delay > 0:
+                try: await asyncio.wait_for(self._wake.wait(), timeout=delay)
+                except asyncio.TimeoutError: pass
+                continue
+            _, message_id = heapq.heappop(self._heap)
+            try: await self.finish(message_id)
+            except Exception as e: print(f"Błąd kończenia konkursu {message_id}: {e}")
+
+    async def create(self, channel: TextChannel, prize: str, duration: datetime.timedelta):
+        end_ts = time.time() + duration.total_seconds()
+        embed = discord.Embed(title="🎉 Nowy Konkurs! 🎉", color=discord.Color.magenta())
+        embed.add_field(name="Nagroda", value=f"**{prize}**", inline=False).add_field(name="Koniec za", value=f"<t:{int(end_ts)}:R>", inline=False)
+        message = await channel.send(embed=embed, view=GiveawayView.detached(self.bot))
+        message_id = str(message.id)
+        giveaway_data = self.data[message_id] = {'guild_id': channel.guild.id, 'channel_id': channel.id, 'prize': prize, 'end_ts': end_ts, 'entrants': [], 'winners': [], 'ended': False}
+        self.entrants[message_id] = set()
+        await self.bot.storage.save_giveaway(message_id, giveaway_data)
+        heapq.heappush(self._heap, (end_ts, message_id))
+        if self._heap[0][1] == message_id: self._wake.set()
+
+    async def join(self, interaction: Interaction):
+        message_id = str(interaction.message.id)
+        giveaway_data = self.data.get(message_id)
+        if not giveaway_data or giveaway_data['ended']: return await interaction.response.send_message("Ten konkurs już się zakończył.", ephemeral=True)
+        if interaction.user.id in self.entrants[message_id]: return await interaction.response.send_message("Już bierzesz udział!", ephemeral=True)
+        self.entrants[message_id].add(interaction.user.id); giveaway_data['entrants'].append(interaction.user.id)
+        await self.bot.storage.save_giveaway(message_id, giveaway_data)
+        await interaction.response.send_message("Pomyślnie dołączyłeś/aś do konkursu!", ephemeral=True)
+
+    def _draw(self, message_id: str) -> Optional[int]:
+        candidates = list(self.entrants[message_id] - set(self.data[message_id]['winners']))
+        return random.choice(candidates) if candidates else None
+
+    async def finish(self, message_id: str):
+        giveaway_data = self.data.get(message_id)
+        if not giveaway_data or giveaway_data['ended']: return
+        giveaway_data['ended'] = True
+        winner_id = self._draw(message_id)
+        if winner_id: giveaway_data['winners'].append(winner_id)
+        await self.bot.storage.save_giveaway(message_id, giveaway_data)
         try:
-            message = await self.message.channel.fetch_message(self.message.id)
+            channel = self.bot.get_channel(giveaway_data['channel_id']) or await self.bot.fetch_channel(giveaway_data['channel_id'])
+            message = await channel.fetch_message(int(message_id))
             original_embed = message.embeds[0]
-        except (discord.NotFound, AttributeError):
+        except (discord.NotFound, discord.Forbidden, IndexError):
             print("Nie udało się pobrać oryginalnej wiadomości konkursu (prawdopodobnie została usunięta).")
             return
 
         original_embed.color = discord.Color.greyple()
-        winner_id = random.choice(list(self.participants)) if self.participants else None
-
-        if winner_id and (winner_user := self.bot.get_user(winner_id)):
-            end_text = f"Zwycięzca: {winner_user.mention}"
-            await message.channel.send(f"🎉 Gratulacje {winner_user.mention}! Wygrałeś/aś **{self.prize}**!")
+        if winner_id:
+            end_text = f"Zwycięzca: <@{winner_id}>"
+            await self.bot.rest.run('interaction', lambda: channel.send(f"🎉 Gratulacje <@{winner_id}>! Wygrałeś/aś **{giveaway_data['prize']}**!"))
         else:
             end_text = "Zwycięzca: Brak (nikt nie wziął udziału)"
 
-        original_embed.description += f"\n\n**Zakończono!**\n{end_text}"
-        await message.edit(embed=original_embed, view=self)
+        view = GiveawayView.detached(self.bot, disabled=True)
+        original_embed.description = (original_embed.description or "") + f"\n\n**Zakończono!**\n{end_text}"
+        await self.bot.rest.run('interaction', lambda: message.edit(embed=original_embed, view=view), key=('edit', message.id))
+
+    async def reroll(self, message_id: str) -> Optional[int]:
+        giveaway_data = self.data.get(message_id)
+        if not giveaway_data or not giveaway_data['ended']: return None
+        if (winner_id := self._draw(message_id)) is None: return None
+        giveaway_data['winners'].append(winner_id)
+        await self.bot.storage.save_giveaway(message_id, giveaway_data)
+        return winner_id
 
 class Konfiguracja(app_commands.Group):
     def __init__(self, bot_instance): super().__init__(name="konfiguracja"); self.bot = bot_instance
     @app_commands.command(name="powitania", description="Ustaw kanał powitań.")
     @app_commands.checks.has_permissions(administrator=True)
     async def powitania(self, interaction: Interaction, kanał: TextChannel):
-        self.bot.set_config(interaction.guild.id, 'welcome_channel_id', kanał.id); await interaction.response.send_message(f"✅ Ustawiono kanał powitań na {kanał.mention}.", ephemeral=True)
+        await self.bot.set_config(interaction.guild.id, 'welcome_channel_id', kanał.id); await interaction.response.send_message(f"✅ Ustawiono kanał powitań na {kanał.mention}.", ephemeral=True)
     @app_commands.command(name="pozegnania", description="Ustaw kanał pożegnań.")
     @app_commands.checks.has_permissions(administrator=True)
     async def pozegnania(self, interaction: Interaction, kanał: TextChannel):
-        self.bot.set_config(interaction.guild.id, 'goodbye_channel_id', kanał.id); await interaction.response.send_message(f"✅ Ustawiono kanał pożegnań na {kanał.mention}.", ephemeral=True)
+        await self.bot.set_config(interaction.guild.id, 'goodbye_channel_id', kanał.id); await interaction.response.send_message(f"✅ Ustawiono kanał pożegnań na {kanał.mention}.", ephemeral=True)
     @app_commands.command(name="auto-rola", description="Ustaw rolę nadawaną po wejściu.")
     @app_commands.checks.has_permissions(administrator=True)
     async def auto_rola(self, interaction: Interaction, rola: Role):
-        self.bot.set_config(interaction.guild.id, 'auto_role_id', rola.id); await interaction.response.send_message(f"✅ Ustawiono auto-rolę na {rola.mention}.", ephemeral=True)
+        await self.bot.set_config(interaction.guild.id, 'auto_role_id', rola.id); await interaction.response.send_message(f"✅ Ustawiono auto-rolę na {rola.mention}.", ephemeral=True)
     @app_commands.command(name="weryfikacja", description="Tworzy panel weryfikacyjny.")
     @app_commands.checks.has_permissions(administrator=True)
     async def weryfikacja(self, interaction: Interaction, kanał: TextChannel, rola: Role, tresc_wiadomosci: str):
-        self.bot.set_config(interaction.guild.id, 'verification_role_id', rola.id); embed = discord.Embed(title="✅ Weryfikacja", description=tresc_wiadomosci, color=discord.Color.gold()); await kanał.send(embed=embed, view=VerificationView(self.bot)); await interaction.response.send_message(f"✅ Panel weryfikacyjny utworzono na {kanał.mention}.", ephemeral=True)
+        await self.bot.set_config(interaction.guild.id, 'verification_role_id', rola.id); embed = discord.Embed(title="✅ Weryfikacja", description=tresc_wiadomosci, color=discord.Color.gold()); await kanał.send(embed=embed, view=VerificationView(self.bot)); await interaction.response.send_message(f"✅ Panel weryfikacyjny utworzono na {kanał.mention}.", ephemeral=True)
     @app_commands.command(name="tickety", description="Konfiguruje system ticketów.")
     @app_commands.checks.has_permissions(administrator=True)
     async def tickety(self, interaction: Interaction, kategoria: CategoryChannel, rola_staffu: Role, kanał_panelu: TextChannel):
-        self.bot.set_config(interaction.guild.id, 'ticket_category_id', kategoria.id); self.bot.set_config(interaction.guild.id, 'ticket_staff_role_id', rola_staffu.id); embed = discord.Embed(title="Wsparcie Techniczne", description="Kliknij przycisk, aby otworzyć prywatny kanał z administracją.", color=discord.Color.blue()); await kanał_panelu.send(embed=embed, view=TicketCreateView(self.bot)); await interaction.response.send_message(f"✅ Panel ticketów utworzono na {kanał_panelu.mention}.", ephemeral=True)
+        await self.bot.update_config(interaction.guild.id, ticket_category_id=kategoria.id, ticket_staff_role_id=rola_staffu.id); embed = discord.Embed(title="Wsparcie Techniczne", description="Kliknij przycisk, aby otworzyć prywatny kanał z administracją.", color=discord.Color.blue()); await kanał_panelu.send(embed=embed, view=TicketCreateView(self.bot)); await interaction.response.send_message(f"✅ Panel ticketów utworzono na {kanał_panelu.mention}.", ephemeral=True)
+
+    @app_commands.command(name="xp-cooldown", description="Ustaw odstęp (w sekundach) między wiadomościami nagradzanymi XP.")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def xp_cooldown(self, interaction: Interaction, sekundy: app_commands.Range[int, 0, 3600]):
+        await self.bot.set_config(interaction.guild.id, 'xp_cooldown', sekundy); await interaction.response.send_message(f"✅ Ustawiono cooldown XP na `{sekundy}` s.", ephemeral=True)
+    @app_commands.command(name="mnoznik-xp", description="Ustaw mnożnik XP za wiadomość na tym serwerze.")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def mnoznik_xp(self, interaction: Interaction, mnoznik: app_commands.Range[float, 0.0, 10.0]):
+        await self.bot.set_config(interaction.guild.id, 'xp_multiplier', mnoznik); await interaction.response.send_message(f"✅ Ustawiono mnożnik XP na `x{mnoznik:g}`.", ephemeral=True)
+    @app_commands.command(name="krzywa-poziomow", description="Ustaw krzywą poziomów a*L² + b*L + c (bez argumentów: domyślna).")
+    @app_commands.checks.has_permissions(administrator=True)
+    async def krzywa_poziomow(self, interaction: Interaction, a: app_commands.Range[int, 0, 1000] = DEFAULT_LEVEL_CURVE[0], b: app_commands.Range[int, 0, 10000] = DEFAULT_LEVEL_CURVE[1], c: app_commands.Range[int, 1, 100000] = DEFAULT_LEVEL_CURVE[2]):
+        if a == b == 0: return await interaction.response.send_message("Krzywa musi rosnąć - `a` lub `b` musi być większe od zera.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        coefficients = (a, b, c)
+        await self.bot.set_config(interaction.guild.id, 'level_curve', None if coefficients == DEFAULT_LEVEL_CURVE else list(coefficients))
+        changed = await recompute_guild_levels(self.bot.storage, self.bot.leaderboards, interaction.guild.id, level_curve(coefficients))
+        await interaction.followup.send(f"✅ Ustawiono krzywą `{a}*L² + {b}*L + {c}`. Przeliczono poziomy: zmieniono `{changed}` użytkowników.")
 
 class Moderacja(app_commands.Group):
     def __init__(self, bot_instance): super().__init__(name="moderacja"); self.bot = bot_instance
@@ -236,16 +2002,19 @@ class Moderacja(app_commands.Group):
     @app_commands.checks.has_permissions(ban_members=True)
     async def ban(self, interaction: Interaction, uzytkownik: Member, powod: Optional[str] = "Brak powodu"):
         if uzytkownik.top_role >= interaction.user.top_role and interaction.guild.owner != interaction.user: return await interaction.response.send_message("Nie możesz banować osób z wyższą/taką samą rolą!", ephemeral=True)
-        await uzytkownik.ban(reason=f"{interaction.user.name}: {powod}"); await interaction.response.send_message(f"✅ **{uzytkownik.display_name}** został zbanowany.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)  # odpowiedź w 3 s, niezależnie od kolejki REST
+        await self.bot.rest.run('moderation', lambda: uzytkownik.ban(reason=f"{interaction.user.name}: {powod}")); await interaction.followup.send(f"✅ **{uzytkownik.display_name}** został zbanowany.", ephemeral=True)
     @app_commands.command(name="unban", description="Odbanowuje użytkownika po ID.")
     @app_commands.checks.has_permissions(ban_members=True)
     async def unban(self, interaction: Interaction, user_id: str):
-        try: user = discord.Object(id=int(user_id)); await interaction.guild.unban(user); await interaction.response.send_message(f"✅ Użytkownik o ID `{user_id}` został odbanowany.", ephemeral=True)
-        except (ValueError, discord.NotFound): await interaction.response.send_message("Nieprawidłowe ID lub użytkownik nie jest zbanowany.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        try: user = discord.Object(id=int(user_id)); await self.bot.rest.run('moderation', lambda: interaction.guild.unban(user)); await interaction.followup.send(f"✅ Użytkownik o ID `{user_id}` został odbanowany.", ephemeral=True)
+        except (ValueError, discord.NotFound): await interaction.followup.send("Nieprawidłowe ID lub użytkownik nie jest zbanowany.", ephemeral=True)
     @app_commands.command(name="kick", description="Wyrzuca użytkownika.")
     @app_commands.checks.has_permissions(kick_members=True)
     async def kick(self, interaction: Interaction, uzytkownik: Member, powod: Optional[str] = "Brak powodu"):
-        await uzytkownik.kick(reason=f"{interaction.user.name}: {powod}"); await interaction.response.send_message(f"✅ **{uzytkownik.display_name}** został wyrzucony.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
+        await self.bot.rest.run('moderation', lambda: uzytkownik.kick(reason=f"{interaction.user.name}: {powod}")); await interaction.followup.send(f"✅ **{uzytkownik.display_name}** został wyrzucony.", ephemeral=True)
     @app_commands.command(name="mute", description="Wycisza użytkownika (max 28 dni).")
     @app_commands.checks.has_permissions(moderate_members=True)
     async def mute(self, interaction: Interaction, uzytkownik: Member, czas_trwania: str, powod: Optional[str] = "Brak powodu"):
@@ -254,45 +2023,74 @@ class Moderacja(app_commands.Group):
         duration = parse_duration(czas_trwania)
         if not duration or duration.days > 28:
             return await interaction.response.send_message("Nieprawidłowy format czasu lub czas jest dłuższy niż 28 dni!", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
         try:
-            await uzytkownik.timeout(duration, reason=powod)
-            await interaction.response.send_message(f"🔇 **{uzytkownik.display_name}** został wyciszony na `{czas_trwania}`.", ephemeral=True)
+            await self.bot.rest.run('moderation', lambda: uzytkownik.timeout(duration, reason=powod))
+            await interaction.followup.send(f"🔇 **{uzytkownik.display_name}** został wyciszony na `{czas_trwania}`.", ephemeral=True)
         except discord.Forbidden:
-            await interaction.response.send_message("Błąd: Nie mam uprawnień do wyciszania użytkowników na tym serwerze.", ephemeral=True)
+            await interaction.followup.send("Błąd: Nie mam uprawnień do wyciszania użytkowników na tym serwerze.", ephemeral=True)
     @app_commands.command(name="unmute", description="Zdejmuje wyciszenie.")
     @app_commands.checks.has_permissions(moderate_members=True)
     async def unmute(self, interaction: Interaction, uzytkownik: Member):
         if not uzytkownik.is_timed_out():
             return await interaction.response.send_message("Ten użytkownik nie jest wyciszony.", ephemeral=True)
+        await interaction.response.defer(ephemeral=True, thinking=True)
         try:
-            await uzytkownik.timeout(None, reason=f"Odciszony przez {interaction.user.name}")
-            await interaction.response.send_message(f"🔊 Zdjęto wyciszenie z **{uzytkownik.display_name}**.", ephemeral=True)
+            await self.bot.rest.run('moderation', lambda: uzytkownik.timeout(None, reason=f"Odciszony przez {interaction.user.name}"))
+            await interaction.followup.send(f"🔊 Zdjęto wyciszenie z **{uzytkownik.display_name}**.", ephemeral=True)
         except discord.Forbidden:
-            await interaction.response.send_message("Błąd: Nie mam uprawnień, by zdejmować wyciszenia.", ephemeral=True)
-    @app_commands.command(name="clear", description="Czyści wiadomości.")
+            await interaction.followup.send("Błąd: Nie mam uprawnień, by zdejmować wyciszenia.", ephemeral=True)
+    @app_commands.command(name="clear", description="Czyści wiadomości, opcjonalnie tylko pasujące do filtrów.")
     @app_commands.checks.has_permissions(manage_messages=True)
-    async def clear(self, interaction: Interaction, liczba: app_commands.Range[int, 1, 100]):
+    async def clear(self, interaction: Interaction, liczba: app_commands.Range[int, 1, PURGE_MAX_MESSAGES], autor: Optional[discord.User] = None,
+                    wzorzec: Optional[app_commands.Range[str, 1, 200]] = None, zalaczniki: Optional[bool] = None, okres: Optional[str] = None):
+        purger = self.bot.purger
+        try: pattern = re.compile(wzorzec, re.IGNORECASE) if wzorzec else None
+        except re.error as e: return await interaction.response.send_message(f"Nieprawidłowe wyrażenie regularne: `{e}`", ephemeral=True)
+        after = None
+        if okres:
+            if not (duration := parse_duration(okres)): return await interaction.response.send_message("Nieprawidłowy format okresu (np. `2h`, `1d30m`).", ephemeral=True)
+            after = discord.utils.utcnow() - duration
+        # Rezerwacja przed pierwszym await - inaczej dwa /clear na tym samym kanale przeszłyby oba sprawdzenie.
+        if not purger.reserve(interaction.channel.id): return await interaction.response.send_message("Na tym kanale trwa już czyszczenie.", ephemeral=True)
+        try: await self._clear(interaction, liczba, ChannelPurger.matcher(autor.id if autor else None, pattern, zalaczniki), after)
+        finally: purger.release(interaction.channel.id)
+
+    async def _clear(self, interaction: Interaction, liczba: int, check, after: Optional[datetime.datetime]):
+        purger = self.bot.purger
         await interaction.response.defer(ephemeral=True, thinking=True)
-        deleted = await interaction.channel.purge(limit=liczba)
-        await interaction.followup.send(f"✅ Usunięto `{len(deleted)}` wiadomości.")
+        # Token interakcji wygasa po 15 minutach; później edycje tylko by się nie udawały (z zapasem na kolejkę REST).
+        token_alive = lambda: discord.utils.utcnow() < interaction.expires_at - datetime.timedelta(seconds=30)
+        def progress(counts):
+            if not token_alive(): return
+            content = f"⏳ Przejrzano `{counts['scanned']}` wiadomości, usunięto `{counts['deleted']}`..."
+            self.bot.rest.post('interaction', lambda: interaction.edit_original_response(content=content), key=('purge', interaction.id))
+        try: counts = await purger.purge(interaction.channel, liczba, check, after, progress)
+        except discord.Forbidden: content = "Błąd: Nie mam uprawnień do usuwania wiadomości na tym kanale."
+        else:
+            content = f"✅ Usunięto `{counts['deleted']}` wiadomości (przejrzano `{counts['scanned']}`)."
+            if counts['old']: content += f" Starszych niż 14 dni, usuniętych pojedynczo: `{counts['old']}`."
+            if counts['failed']: content += f" Nie udało się usunąć: `{counts['failed']}`."
+        # Ten sam klucz co postęp: zaległa edycja postępu nie nadpisze już końcowego komunikatu.
+        # Po wygaśnięciu tokenu wynik trafia na kanał jako zwykła wiadomość.
+        try:
+            if token_alive(): await self.bot.rest.run('interaction', lambda: interaction.edit_original_response(content=content), key=('purge', interaction.id))
+            else: await self.bot.rest.run('interaction', lambda: interaction.channel.send(f"{interaction.user.mention} {content}", delete_after=60))
+        except discord.HTTPException: pass
     @app_commands.command(name="warn", description="Daje ostrzeżenie.")
     @app_commands.checks.has_permissions(manage_messages=True)
     async def warn(self, interaction: Interaction, uzytkownik: Member, powod: str):
-        guild_id, user_id = str(interaction.guild.id), str(uzytkownik.id)
-        if guild_id not in self.bot.warnings_data: self.bot.warnings_data[guild_id] = {}
-        if user_id not in self.bot.warnings_data[guild_id]: self.bot.warnings_data[guild_id][user_id] = []
-        self.bot.warnings_data[guild_id][user_id].append({'reason': powod, 'moderator_id': interaction.user.id, 'timestamp': datetime.datetime.utcnow().isoformat()}); self.bot.save_data(self.bot.warnings_data, 'warnings.json')
-        await interaction.response.send_message(f"⚠️ **{uzytkownik.display_name}** otrzymał ostrzeżenie (łącznie: {len(self.bot.warnings_data[guild_id][user_id])}).")
+        total = await self.bot.storage.add_warning(interaction.guild.id, uzytkownik.id, {'reason': powod, 'moderator_id': interaction.user.id, 'timestamp': datetime.datetime.utcnow().isoformat()})
+        await interaction.response.send_message(f"⚠️ **{uzytkownik.display_name}** otrzymał ostrzeżenie (łącznie: {total}).")
     @app_commands.command(name="del-warn", description="Usuwa ostrzeżenie.")
     @app_commands.checks.has_permissions(manage_messages=True)
     async def del_warn(self, interaction: Interaction, uzytkownik: Member, numer_warna: int):
-        user_warns = self.bot.warnings_data.get(str(interaction.guild.id), {}).get(str(uzytkownik.id), [])
-        if 1 <= numer_warna <= len(user_warns): user_warns.pop(numer_warna - 1); self.bot.save_data(self.bot.warnings_data, 'warnings.json'); await interaction.response.send_message(f"✅ Usunięto ostrzeżenie nr `{numer_warna}`.", ephemeral=True)
+        if numer_warna >= 1 and await self.bot.storage.delete_warning(interaction.guild.id, uzytkownik.id, numer_warna - 1): await interaction.response.send_message(f"✅ Usunięto ostrzeżenie nr `{numer_warna}`.", ephemeral=True)
         else: await interaction.response.send_message("Nieprawidłowy numer ostrzeżenia.", ephemeral=True)
     @app_commands.command(name="history", description="Pokazuje historię ostrzeżeń.")
     @app_commands.checks.has_permissions(manage_messages=True)
     async def history(self, interaction: Interaction, uzytkownik: Member):
-        warns = self.bot.warnings_data.get(str(interaction.guild.id), {}).get(str(uzytkownik.id), []); embed = discord.Embed(title=f"Historia - {uzytkownik.display_name}", color=uzytkownik.color)
+        warns = await self.bot.storage.get_warnings(interaction.guild.id, uzytkownik.id); embed = discord.Embed(title=f"Historia - {uzytkownik.display_name}", color=uzytkownik.color)
         if warns: text = "".join(f"**{i}.** <t:{int(discord.utils.parse_time(w['timestamp']).timestamp())}:D> - `{w['reason']}`\n" for i, w in enumerate(warns, 1)); embed.add_field(name=f"Ostrzeżenia ({len(warns)})", value=text)
         else: embed.add_field(name="Ostrzeżenia", value="Brak.")
         await interaction.response.send_message(embed=embed, ephemeral=True)
@@ -311,21 +2109,25 @@ class Uzytkowe(app_commands.Group):
     @app_commands.command(name="level", description="Sprawdza Twój poziom lub innej osoby.")
     async def level(self, interaction: Interaction, uzytkownik: Optional[Member] = None):
         target = uzytkownik or interaction.user
-        user_data = self.bot.levels_data.get(str(interaction.guild.id), {}).get(str(target.id), None)
+        user_data = await self.bot.storage.get_level(interaction.guild.id, target.id)
         if not user_data: return await interaction.response.send_message(f"**{target.display_name}** nie ma jeszcze poziomu.", ephemeral=True)
-        lvl, xp = user_data['level'], user_data['xp']; xp_needed = int(5 * (lvl ** 2) + 50 * lvl + 100)
-        progress = int((xp / xp_needed) * 20) if xp_needed > 0 else 0; progress_bar = '🟩' * progress + '⬛' * (20 - progress)
+        curve = await self.bot.get_level_curve(interaction.guild.id); xp = user_data['xp']
+        lvl, gained, span = curve.progress(xp); xp_needed = curve.next_threshold(lvl)
+        progress = int((gained / span) * 20) if span > 0 else 20; progress_bar = '🟩' * progress + '⬛' * (20 - progress)
         embed = discord.Embed(title=f"Poziom - {target.display_name}", color=target.color); embed.set_thumbnail(url=target.display_avatar.url)
-        embed.add_field(name="Poziom", value=f"**{lvl}**").add_field(name="XP", value=f"`{xp}/{xp_needed}`").add_field(name="Postęp", value=f"[{progress_bar}]", inline=False)
+        index = await self.bot.leaderboards.get(interaction.guild.id)
+        embed.add_field(name="Poziom", value=f"**{lvl}**").add_field(name="XP", value=f"`{xp}/{xp_needed}`" if xp_needed else f"`{xp}` (max)").add_field(name="Ranking", value=f"#{index.rank(target.id)} z {len(index)}").add_field(name="Postęp", value=f"[{progress_bar}]", inline=False)
         await interaction.response.send_message(embed=embed)
-    @app_commands.command(name="leaderboard", description="Wyświetla ranking 10 najlepszych użytkowników.")
-    async def leaderboard(self, interaction: Interaction):
-        guild_levels = self.bot.levels_data.get(str(interaction.guild.id), {})
-        if not guild_levels: return await interaction.response.send_message("Na tym serwerze nikt jeszcze nie zdobył poziomu!", ephemeral=True)
-        sorted_users = sorted(guild_levels.items(), key=lambda item: (item[1].get('level', 0), item[1].get('xp', 0)), reverse=True)
+    @app_commands.command(name="leaderboard", description="Wyświetla ranking użytkowników (po 10 na stronę).")
+    async def leaderboard(self, interaction: Interaction, strona: app_commands.Range[int, 1, 10000] = 1):
+        index = await self.bot.leaderboards.get(interaction.guild.id)
+        if not len(index): return await interaction.response.send_message("Na tym serwerze nikt jeszcze nie zdobył poziomu!", ephemeral=True)
+        pages = (len(index) + 9) // 10
+        if strona > pages: return await interaction.response.send_message(f"Ranking ma tylko `{pages}` stron.", ephemeral=True)
+        offset = (strona - 1) * 10
         embed = discord.Embed(title=f"🏆 Ranking serwera {interaction.guild.name}", color=discord.Color.gold())
-        description = "".join(f"**{i}.** <@{user_id}> - Poziom: **{data.get('level', 0)}** (XP: {data.get('xp', 0)})\n" for i, (user_id, data) in enumerate(sorted_users[:10], 1))
-        embed.description = description; await interaction.response.send_message(embed=embed)
+        description = "".join(f"**{i}.** <@{user_id}> - Poziom: **{level}** (XP: {xp})\n" for i, (user_id, level, xp) in enumerate(index.page(offset, 10), offset + 1))
+        embed.description = description; embed.set_footer(text=f"Strona {strona}/{pages}"); await interaction.response.send_message(embed=embed)
     @app_commands.command(name="powiedz", description="Bot powtarza wiadomość.")
     @app_commands.checks.has_permissions(manage_messages=True)
     async def powiedz(self, interaction: Interaction, wiadomosc: str):
@@ -362,6 +2164,28 @@ class Rozrywka(app_commands.Group):
     @app_commands.command(name="slap", description="Daj komuś z liścia.")
     async def slap(self, interaction: Interaction, uzytkownik: Member): await send_interaction_gif(interaction, uzytkownik, "daje z liścia", ["https://media1.tenor.com/m/VEe-d_iF0iAAAAAC/anime-slap-mad.gif"], discord.Color.dark_red())
 
+class Debug(app_commands.Group):
+    """Narzędzia diagnostyczne dostępne tylko dla właściciela bota."""
+    def __init__(self, bot_instance): super().__init__(name="debug"); self.bot = bot_instance
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        if await self.bot.is_owner(interaction.user): return True
+        await interaction.response.send_message("Ta komenda jest dostępna tylko dla właściciela bota.", ephemeral=True); return False
+    @app_commands.command(name="profiler", description="Włącza lub wyłącza profiler próbkujący pętlę zdarzeń.")
+    @app_commands.choices(akcja=[app_commands.Choice(name="start", value="start"), app_commands.Choice(name="stop", value="stop")])
+    async def profiler(self, interaction: Interaction, akcja: app_commands.Choice[str]):
+        if akcja.value == "start":
+            if self.bot.profiler.running: return await interaction.response.send_message("Profiler już działa.", ephemeral=True)
+            self.bot.profiler.start(); await interaction.response.send_message("▶️ Profiler uruchomiony.", ephemeral=True)
+        elif path := await asyncio.to_thread(self.bot.profiler.stop):
+            await interaction.response.send_message(f"⏹️ Zapisano profil do `{path}` ({sum(self.bot.profiler.samples.values())} próbek).", ephemeral=True)
+        else: await interaction.response.send_message("Profiler nie był uruchomiony.", ephemeral=True)
+    @app_commands.command(name="pamiec", description="Pokazuje, ile pamięci zajmują struktury stanu bota.")
+    async def pamiec(self, interaction: Interaction):
+        rows = self.bot.reaper.memory_report()
+        lines = [f"{name:<24}{entries:>9,}{size / 1024:>11,.1f} KiB" for name, entries, size in rows]
+        footer = f"Usunięte serwery: {self.bot.reaper.evicted}, rozłączenia z bezczynności: {self.bot.reaper.disconnected}"
+        await interaction.response.send_message(f"```\n{'struktura':<24}{'wpisy':>9}{'rozmiar':>15}\n" + "\n".join(lines) + f"\n```{footer}", ephemeral=True)
+
 async def send_interaction_gif(interaction: Interaction, uzytkownik: Member, action_text: str, gifs: list, color: discord.Color):
     if uzytkownik == interaction.user: return await interaction.response.send_message("Nie możesz tego zrobić samemu sobie!", ephemeral=True)
     embed = discord.Embed(description=f"{interaction.user.mention} {action_text} {uzytkownik.mention}!", color=color); embed.set_image(url=random.choice(gifs)); await interaction.response.send_message(embed=embed)
@@ -372,14 +2196,18 @@ async def giveaway(interaction: Interaction, czas_trwania: str, nagroda: str, ka
     channel = kanał or interaction.channel
     duration = parse_duration(czas_trwania)
     if not duration: return await interaction.response.send_message("Nieprawidłowy format czasu.", ephemeral=True)
-    end_time = datetime.datetime.utcnow() + duration
-    embed = discord.Embed(title="🎉 Nowy Konkurs! 🎉", color=discord.Color.magenta())
-    embed.add_field(name="Nagroda", value=f"**{nagroda}**", inline=False).add_field(name="Koniec za", value=f"<t:{int(end_time.timestamp())}:R>", inline=False)
-    view = GiveawayView(bot, end_time, nagroda)
-    message = await channel.send(embed=embed, view=view)
-    view.message = message
+    await bot.giveaways.create(channel, nagroda, duration)
     await interaction.response.send_message(f"Konkurs rozpoczęto na {channel.mention}!", ephemeral=True)
 
+@app_commands.command(name="giveaway-reroll", description="Losuje ponownie zwycięzcę zakończonego konkursu.")
+@app_commands.checks.has_permissions(manage_guild=True)
+async def giveaway_reroll(interaction: Interaction, id_wiadomosci: str):
+    giveaway_data = bot.giveaways.data.get(id_wiadomosci.strip())
+    if not giveaway_data or giveaway_data['guild_id'] != interaction.guild.id: return await interaction.response.send_message("Nie znaleziono konkursu o tym ID.", ephemeral=True)
+    if not giveaway_data['ended']: return await interaction.response.send_message("Ten konkurs jeszcze trwa.", ephemeral=True)
+    if not (winner_id := await bot.giveaways.reroll(id_wiadomosci.strip())): return await interaction.response.send_message("Brak kolejnych uczestników do wylosowania.", ephemeral=True)
+    await interaction.response.send_message(f"🎉 Nowy zwycięzca konkursu o **{giveaway_data['prize']}**: <@{winner_id}>!")
+
 class EmbedBuilderModal(ui.Modal):
     embed_title = ui.TextInput(label="Tytuł", style=discord.TextStyle.short, required=True, max_length=256)
     embed_description = ui.TextInput(label="Opis", style=discord.TextStyle.long, required=True, max_length=2000)
@@ -455,6 +2283,507 @@ async def embed(interaction: Interaction):
     )
 
 # --- NOWE FUNKCJE: SYSTEM MUZYCZNY (OSTATECZNA WERSJA) ---
+MUSIC_RESOLVE_CONCURRENCY = int(os.getenv("MUSIC_RESOLVE_CONCURRENCY", "5"))
+SEARCH_CACHE_PATH = os.getenv("SEARCH_CACHE_PATH", "search_cache.db")
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", str(7 * 24 * 3600)))
+SEARCH_CACHE_MEMORY_SIZE = int(os.getenv("SEARCH_CACHE_MEMORY_SIZE", "2000"))
+SEARCH_CACHE_DISK_SIZE = int(os.getenv("SEARCH_CACHE_DISK_SIZE", "50000"))
+STREAM_URL_MARGIN = 300  # sekundy zapasu przed wygaśnięciem linku googlevideo
+MUSIC_PREFETCH_AHEAD = int(os.getenv("MUSIC_PREFETCH_AHEAD", "3"))
+MUSIC_HISTORY_SIZE = int(os.getenv("MUSIC_HISTORY_SIZE", "50"))
+MUSIC_QUEUE_PAGE = 10
+AUDIO_ENGINE = os.getenv("AUDIO_ENGINE", "opus")  # "opus" (passthrough / głośność w FFmpeg) albo "pcm" (dekodowanie i skalowanie w Pythonie)
+MUSIC_DEFAULT_VOLUME = 0.5  # jak dotąd w obu silnikach; w "opus" realizowane filtrem volume FFmpeg (przepuszczanie tylko przy 100%)
+FFMPEG_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+AUDIO_CACHE_DIR = os.getenv("AUDIO_CACHE_DIR", "audio_cache")
+AUDIO_CACHE_MAX_MB = float(os.getenv("AUDIO_CACHE_MAX_MB", "2048"))
+AUDIO_CACHE_THRESHOLD = int(os.getenv("AUDIO_CACHE_THRESHOLD", "3"))  # liczba odtworzeń, po której utwór trafia na dysk
+AUDIO_CACHE_MAX_DURATION = 900  # dłuższe nagrania (miksy, streamy) nie są zapisywane
+YTDL_POOL_MODE = os.getenv("YTDL_POOL_MODE", "thread")  # "thread" albo "process"
+YTDL_WORKERS = int(os.getenv("YTDL_WORKERS", "4"))
+YTDL_MAX_QUEUE = int(os.getenv("YTDL_MAX_QUEUE", "64"))
+YTDL_TIMEOUT = float(os.getenv("YTDL_TIMEOUT", "30"))
+MUSIC_BUSY_MESSAGE = "⏳ Wyszukiwarka utworów jest teraz przeciążona - spróbuj ponownie za chwilę."
+
+SPOTIFY_CACHE_TTL = float(os.getenv("SPOTIFY_CACHE_TTL", "3600"))
+
+class AsyncSpotify:
+    """Asynchroniczna nakładka na spotipy.Spotify: wywołania w wątkach, cache metadanych z TTL
+    i równoległe pobieranie wszystkich stron playlisty."""
+    PAGE_SIZE = 100
+    PLAYLIST_FIELDS = "total,items(track(name,artists(name)))"
+
+    def __init__(self, client: 'spotipy.Spotify', ttl: float = SPOTIFY_CACHE_TTL, workers: int = 4):
+        self.client, self.ttl = client, ttl
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="spotify")
+        self._cache = {}
+
+    @staticmethod
+    def parse_id(url: str, kind: str) -> Optional[str]:
+        match = re.search(rf"{kind}[/:]([A-Za-z0-9]+)", url)
+        return match.group(1) if match else None
+
+    async def _call(self, func, *args, **kwargs):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    def _cache_get(self, key):
+        entry = self._cache.get(key)
+        if entry and entry[0] > time.monotonic(): return entry[1]
+        self._cache.pop(key, None)
+        return None
+
+    def _cache_put(self, key, value):
+        now = time.monotonic()
+        if len(self._cache) >= 1024:
+            for stale in [k for k, (expires, _) in self._cache.items() if expires <= now]: del self._cache[stale]
+        self._cache[key] = (now + self.ttl, value)
+
+    async def track(self, url: str) -> dict:
+        """Zwraca {'name', 'artist'} utworu."""
+        key = ('track', self.parse_id(url, 'track') or url)
+        if (cached := self._cache_get(key)) is None:
+            data = await self._call(self.client.track, url)
+            cached = {'name': data['name'], 'artist': data['artists'][0]['name']}
+            self._cache_put(key, cached)
+        return cached
+
+    async def playlist_tracks(self, url: str) -> list:
+        """Zwraca listę {'name', 'artist'} wszystkich utworów playlisty; strony po pierwszej są pobierane równolegle."""
+        key = ('playlist', self.parse_id(url, 'playlist') or url)
+        if (cached := self._cache_get(key)) is None:
+            first = await self._call(self.client.playlist_items, url, fields=self.PLAYLIST_FIELDS, limit=self.PAGE_SIZE, offset=0)
+            pages = await asyncio.gather(*(self._call(self.client.playlist_items, url, fields=self.PLAYLIST_FIELDS, limit=self.PAGE_SIZE, offset=offset)
+                                           for offset in range(self.PAGE_SIZE, first.get('total', 0), self.PAGE_SIZE)))
+            items = [item for page in (first, *pages) for item in page['items']]
+            cached = [{'name': item['track']['name'], 'artist': item['track']['artists'][0]['name']} for item in items if item and item.get('track') and item['track'].get('artists')]
+            self._cache_put(key, cached)
+        return cached
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+class ExtractionQueueFull(Exception):
+    pass
+
+class ExtractionPool:
+    """Pula pracowników yt-dlp z ograniczoną kolejką, limitem czasu na żądanie i metrykami.
+
+    W trybie "process" ekstrakcja działa w osobnych procesach i nie konkuruje o GIL z pętlą bota.
+    Przy pełnej kolejce żądanie czeka na wolne miejsce (najwyżej `timeout` sekund), zanim zostanie odrzucone.
+    """
+    def __init__(self, options: dict, mode: str = YTDL_POOL_MODE, workers: int = YTDL_WORKERS, max_queue: int = YTDL_MAX_QUEUE, timeout: float = YTDL_TIMEOUT):
+        self.mode, self.max_queue, self.timeout = mode, max_queue, timeout
+        executor_cls = concurrent.futures.ProcessPoolExecutor if mode == "process" else concurrent.futures.ThreadPoolExecutor
+        extra = {} if mode == "process" else {'thread_name_prefix': "yt-dlp"}
+        self._executor = executor_cls(max_workers=workers, initializer=ytdl_worker.init_worker, initargs=(options,), **extra)
+        self.pending = self.waiting = 0
+        self._slots = asyncio.Semaphore(max_queue)
+        self.completed = self.failed = self.timeouts = self.rejected = 0
+        self.latency_total = self.latency_max = 0.0
+        self.latencies = collections.deque(maxlen=512)
+
+    def _finished(self, future: concurrent.futures.Future):
+        self.pending -= 1
+        self._slots.release()
+
+    async def extract(self, query: str) -> dict:
+        self.waiting += 1
+        try: await asyncio.wait_for(self._slots.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise ExtractionQueueFull(f"Kolejka ekstrakcji jest pełna ({self.pending}/{self.max_queue}).") from None
+        finally: self.waiting -= 1
+        loop, started = asyncio.get_running_loop(), time.perf_counter()
+        self.pending += 1
+        future = self._executor.submit(ytdl_worker.extract_info, query, self.mode == "process")
+        # Licznik zwalniany dopiero, gdy pracownik faktycznie skończy - także po przekroczeniu limitu czasu.
+        future.add_done_callback(lambda f: loop.call_soon_threadsafe(self._finished, f))
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1; raise
+        except Exception:
+            self.failed += 1; raise
+        elapsed = time.perf_counter() - started
+        self.completed += 1
+        self.latency_total += elapsed
+        self.latency_max = max(self.latency_max, elapsed)
+        self.latencies.append(elapsed)
+        return result
+
+    def stats(self) -> dict:
+        recent = sorted(self.latencies)
+        return {'queue_depth': self.pending, 'waiting': self.waiting, 'completed': self.completed, 'failed': self.failed, 'timeouts': self.timeouts, 'rejected': self.rejected,
+                'latency_avg': self.latency_total / self.completed if self.completed else 0.0, 'latency_max': self.latency_max,
+                'latency_p95': recent[int(len(recent) * 0.95)] if recent else 0.0}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def warm_up(self):
+        """Uruchamia pracowników (i import yt-dlp) zawczasu, żeby pierwsze /music play nie płaciło za start."""
+        await asyncio.wrap_future(self._executor.submit(int))
+
+class SearchCache:
+    """Dwupoziomowa pamięć wyników wyszukiwania: LRU w pamięci + SQLite na dysku.
+
+    Trzyma tylko stabilne metadane (ID filmu, tytuł, miniatura). Krótkotrwałe linki do
+    strumienia są przechowywane osobno per ID filmu, z czasem wygaśnięcia z parametru `expire`.
+    """
+    def __init__(self, path: str = SEARCH_CACHE_PATH, ttl: float = SEARCH_CACHE_TTL, memory_size: int = SEARCH_CACHE_MEMORY_SIZE, disk_size: int = SEARCH_CACHE_DISK_SIZE):
+        self.ttl, self.memory_size, self.disk_size = ttl, memory_size, disk_size
+        self._memory = collections.OrderedDict()
+        self._streams = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-cache")
+        self._conn = None
+        self._puts = 0
+        self.hits_memory = self.hits_disk = self.misses = 0
+        self.stream_hits = self.stream_misses = 0
+        self._executor.submit(self._open, path).result()
+
+    def _open(self, path: str):
+        self._conn = sqlite3.connect(path, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS search_cache (query TEXT PRIMARY KEY, video_id TEXT NOT NULL, title TEXT, thumbnail TEXT, duration REAL, cached_at REAL NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_search_cache_used ON search_cache (last_used)")
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.casefold().split())
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    def _disk_get(self, key: str, now: float):
+        row = self._conn.execute("SELECT video_id, title, thumbnail, duration, cached_at FROM search_cache WHERE query = ?", (key,)).fetchone()
+        if not row: return None
+        if now - row[4] > self.ttl:
+            with self._conn: self._conn.execute("DELETE FROM search_cache WHERE query = ?", (key,))
+            return None
+        with self._conn: self._conn.execute("UPDATE search_cache SET last_used = ? WHERE query = ?", (now, key))
+        return {'id': row[0], 'title': row[1], 'thumbnail': row[2], 'duration': row[3], 'cached_at': row[4]}
+
+    def _disk_put(self, key: str, meta: dict, now: float, evict: bool):
+        with self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?, ?, ?, ?)", (key, meta['id'], meta['title'], meta.get('thumbnail'), meta.get('duration'), meta['cached_at'], now))
+            if evict:
+                self._conn.execute("DELETE FROM search_cache WHERE cached_at < ?", (now - self.ttl,))
+                self._conn.execute("DELETE FROM search_cache WHERE query IN (SELECT query FROM search_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)", (self.disk_size,))
+
+    async def get(self, query: str) -> Optional[dict]:
+        key, now = self.normalize(query), time.time()
+        if (meta := self._memory.get(key)) is not None:
+            if now - meta['cached_at'] <= self.ttl:
+                self._memory.move_to_end(key); self.hits_memory += 1
+                return meta
+            del self._memory[key]
+        if (meta := await self._run(self._disk_get, key, now)) is not None:
+            self._remember(key, meta); self.hits_disk += 1
+            return meta
+        self.misses += 1
+        return None
+
+    async def put(self, query: str, song: 'Song'):
+        key, now = self.normalize(query), time.time()
+        meta = {'id': song.id, 'title': song.title, 'thumbnail': song.thumbnail, 'duration': song.duration, 'cached_at': now}
+        self._remember(key, meta)
+        self._puts += 1
+        await self._run(self._disk_put, key, meta, now, self._puts % 100 == 0)
+
+    def _remember(self, key: str, meta: dict):
+        self._memory[key] = meta
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size: self._memory.popitem(last=False)
+
+    def get_stream(self, video_id: str) -> Optional[str]:
+        entry = self._streams.get(video_id)
+        if entry and entry[1] - time.time() > STREAM_URL_MARGIN:
+            self.stream_hits += 1
+            return entry[0]
+        self._streams.pop(video_id, None)
+        self.stream_misses += 1
+        return None
+
+    def drop_stream(self, video_id: str):
+        self._streams.pop(video_id, None)
+
+    def put_stream(self, video_id: str, url: str):
+        self._streams[video_id] = (url, self.stream_expiry(url))
+        if len(self._streams) > self.memory_size:
+            now = time.time()
+            for stale in [vid for vid, (_, expires) in self._streams.items() if expires - now <= STREAM_URL_MARGIN]: del self._streams[stale]
+
+    @staticmethod
+    def stream_expiry(url: str) -> float:
+        """Czas wygaśnięcia linku z parametru `expire` (googlevideo); domyślnie 5 godzin od teraz."""
+        expire = urllib.parse.parse_qs(urllib.parse.urlsplit(url).query).get('expire')
+        try: return float(expire[0]) if expire else time.time() + 5 * 3600
+        except ValueError: return time.time() + 5 * 3600
+
+    def stats(self) -> dict:
+        return {'hits_memory': self.hits_memory, 'hits_disk': self.hits_disk, 'misses': self.misses, 'memory_entries': len(self._memory),
+                'stream_hits': self.stream_hits, 'stream_misses': self.stream_misses, 'stream_entries': len(self._streams)}
+
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+
+class TrackedOpusAudio(discord.FFmpegOpusAudio):
+    """FFmpegOpusAudio liczący wysłane ramki (20 ms) - pozycja odtwarzania do restartu strumienia od tego samego miejsca."""
+    def __init__(self, *args, start_at: float = 0.0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.start_at, self.frames = start_at, 0
+
+    def read(self) -> bytes:
+        self.frames += 1
+        return super().read()
+
+    @property
+    def elapsed(self) -> float:
+        return self.start_at + self.frames * 0.02
+
+class MappedOggAudio(discord.AudioSource):
+    """Plik Ogg/Opus z lokalnej pamięci podręcznej czytany przez mmap - bez procesu FFmpeg i bez kodowania."""
+    def __init__(self, path: str, start_at: float = 0.0):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._packets = discord.oggparse.OggStream(self._map).iter_packets()
+        self.start_at, self.frames = start_at, 0
+        # Pliki z pamięci podręcznej mają ramki 20 ms, więc przewinięcie to pominięcie pakietów.
+        for _ in range(int(start_at / 0.02)): next(self._packets, None)
+
+    def read(self) -> bytes:
+        packet = next(self._packets, b'')
+        if packet: self.frames += 1
+        return packet
+
+    def is_opus(self) -> bool:
+        return True
+
+    @property
+    def elapsed(self) -> float:
+        return self.start_at + self.frames * 0.02
+
+    def cleanup(self):
+        self._packets.close()
+        if not self._map.closed: self._map.close()
+        self._file.close()
+
+async def open_audio_source(url: str, volume: float, start_at: float = 0.0, engine: str = AUDIO_ENGINE) -> discord.AudioSource:
+    """Tworzy źródło dźwięku dla utworu (`url` może być też ścieżką do pliku z AudioCache).
+
+    Silnik "opus" przy głośności 100% przepuszcza strumień Opus z YouTube bez dekodowania (kodek z ffprobe),
+    a lokalny plik czyta bezpośrednio przez mmap; przy innej głośności FFmpeg stosuje filtr volume i sam koduje
+    Opus, więc Python tylko przekazuje pakiety. Silnik "pcm" to dotychczasowa ścieżka: PCM z FFmpeg, skalowanie
+    w PCMVolumeTransformer i kodowanie w procesie bota.
+    """
+    local = "://" not in url
+    if local and engine == "opus" and volume == 1.0: return MappedOggAudio(url, start_at)
+    before_options = ("" if local else FFMPEG_BEFORE_OPTIONS) + (f" -ss {start_at:.2f}" if start_at else "")
+    if engine == "pcm":
+        return discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(url, before_options=before_options, options='-vn'), volume=volume)
+    if volume == 1.0:
+        return await TrackedOpusAudio.from_probe(url, method='fallback', before_options=before_options, options='-vn', start_at=start_at)
+    return TrackedOpusAudio(url, before_options=before_options, options=f'-vn -filter:a volume={volume:.2f}', start_at=start_at)
+
+class AudioCache:
+    """Dyskowa pamięć podręczna popularnych utworów jako pliki Ogg/Opus, kluczowana ID filmu.
+
+    Utwór jest zapisywany w tle (FFmpeg: kopia strumienia Opus, a gdy się nie da - transkodowanie) dopiero po
+    AUDIO_CACHE_THRESHOLD odtworzeniach. Łączny rozmiar plików jest ograniczony; przy przekroczeniu usuwane są
+    najdawniej odtwarzane (LRU, odtwarzane z kolejności mtime po restarcie). Indeks plików jest lokalny dla procesu,
+    więc w klastrze każdy proces ma własny podkatalog i równą część limitu rozmiaru.
+    """
+    VIDEO_ID = re.compile(r'^[A-Za-z0-9_-]{6,20}$')
+    MAX_TRACKED_PLAYS = 20000
+
+    def __init__(self, directory: str = AUDIO_CACHE_DIR, max_bytes: int = int(AUDIO_CACHE_MAX_MB * 1024 * 1024), threshold: int = AUDIO_CACHE_THRESHOLD):
+        if CLUSTER_ID is not None:
+            directory, max_bytes = os.path.join(directory, f"cluster{CLUSTER_ID}"), max_bytes // int(os.getenv("CLUSTER_COUNT", "1"))
+        self.directory, self.max_bytes, self.threshold = directory, max_bytes, threshold
+        os.makedirs(directory, exist_ok=True)
+        for entry in os.scandir(directory):
+            if entry.name.endswith('.part'): os.remove(entry.path)  # niedokończone zapisy sprzed restartu
+        entries = sorted((entry for entry in os.scandir(directory) if entry.name.endswith('.ogg')), key=lambda entry: entry.stat().st_mtime)
+        self.files = collections.OrderedDict((entry.name[:-4], entry.stat().st_size) for entry in entries)
+        self.size = sum(self.files.values())
+        self.plays = collections.OrderedDict()
+        self._jobs = {}
+        self.hits = self.misses = self.stored = self.evicted = self.failed = 0
+
+    def path(self, video_id: str) -> str:
+        return os.path.join(self.directory, f"{video_id}.ogg")
+
+    def lookup(self, video_id: Optional[str], count: bool = True) -> Optional[str]:
+        """Ścieżka pliku utworu albo None; count=False nie wlicza wywołania do trafień (np. przebudowa źródła)."""
+        if video_id in self.files:
+            # Plik mógł zniknąć poza indeksem (ręczne czyszczenie katalogu) - wtedy utwór idzie ze strumienia.
+            try: os.utime(self.path(video_id))
+            except FileNotFoundError: self.size -= self.files.pop(video_id)
+            except OSError: pass
+            if video_id in self.files:
+                self.files.move_to_end(video_id); self.hits += count
+                return self.path(video_id)
+        self.misses += count
+        return None
+
+    def record_play(self, song: 'Song'):
+        """Liczy odtworzenie; po przekroczeniu progu zleca zapis utworu na dysk."""
+        if not song.id or not self.VIDEO_ID.match(song.id) or song.id in self.files or song.id in self._jobs: return
+        if (song.duration or AUDIO_CACHE_MAX_DURATION + 1) > AUDIO_CACHE_MAX_DURATION: return
+        plays = self.plays.pop(song.id, 0) + 1
+        if plays < self.threshold:
+            self.plays[song.id] = plays
+            if len(self.plays) > self.MAX_TRACKED_PLAYS: self.plays.popitem(last=False)
+            return
+        task = self._jobs[song.id] = asyncio.create_task(self._populate(song.id, song.url))
+        task.add_done_callback(lambda _: self._jobs.pop(song.id, None))
+
+    async def _ffmpeg(self, url: str, target: str, codec: list) -> bool:
+        process = await asyncio.create_subprocess_exec('ffmpeg', '-loglevel', 'error', '-y', *FFMPEG_BEFORE_OPTIONS.split(), '-i', url, '-vn', *codec, '-f', 'ogg', target,
+                                                       stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.DEVNULL)
+        try: return await process.wait() == 0
+        except asyncio.CancelledError: process.kill(); raise
+
+    async def _populate(self, video_id: str, url: str):
+        target, temp = self.path(video_id), f"{self.path(video_id)}.{os.getpid()}.part"
+        try:
+            if not await self._ffmpeg(url, temp, ['-c:a', 'copy']) and not await self._ffmpeg(url, temp, ['-c:a', 'libopus', '-b:a', '128k', '-frame_duration', '20']):
+                self.failed += 1; return
+            os.replace(temp, target)
+        except OSError as e:
+            self.failed += 1; print(f"Nie udało się zapisać '{video_id}' w pamięci podręcznej audio: {e}"); return
+        finally:
+            if os.path.exists(temp): os.remove(temp)
+        self.files[video_id] = os.path.getsize(target); self.size += self.files[video_id]; self.stored += 1
+        while self.size > self.max_bytes and len(self.files) > 1:
+            old_id, old_size = self.files.popitem(last=False)
+            # Otwarte mmapy trzymają dane usuniętego pliku do końca odtwarzania, więc usuwanie jest bezpieczne.
+            try: os.remove(self.path(old_id))
+            except OSError: pass
+            self.size -= old_size; self.evicted += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {'files': len(self.files), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'stored': self.stored, 'evicted': self.evicted, 'failed': self.failed, 'pending': len(self._jobs)}
+
+    def close(self):
+        for task in list(self._jobs.values()): task.cancel()
+
+class Song:
+    """Wpis kolejki muzycznej. `url` to krótkotrwały link do strumienia, `id` to ID filmu na YouTube."""
+    __slots__ = ('id', 'url', 'title', 'thumbnail', 'duration')
+
+    def __init__(self, id: Optional[str], url: str, title: Optional[str] = None, thumbnail: Optional[str] = None, duration: Optional[float] = None):
+        self.id, self.url, self.title, self.thumbnail, self.duration = id, url, title or 'Brak tytułu', thumbnail, duration
+
+    @property
+    def key(self) -> str:
+        return self.id or self.url
+
+class MusicQueue:
+    """Kolejka utworów jednego serwera na deque: O(1) pobieranie z początku, operacje zbiorcze i historia.
+
+    `current` to utwór, który właśnie gra; przy przejściu do kolejnego trafia do `history` (dla "poprzedni").
+    """
+    __slots__ = ('songs', 'history', 'current', 'rewinding')
+
+    def __init__(self, history_size: int = MUSIC_HISTORY_SIZE):
+        self.songs = collections.deque()
+        self.history = collections.deque(maxlen=history_size)
+        self.current, self.rewinding = None, False
+
+    def __len__(self): return len(self.songs)
+    def __bool__(self): return bool(self.songs)
+    def __iter__(self): return iter(self.songs)
+
+    def append(self, song: Song): self.songs.append(song)
+    def extend(self, songs): self.songs.extend(songs)
+    def popleft(self) -> Song: return self.songs.popleft()
+    def clear(self): self.songs.clear()
+
+    def page(self, offset: int, count: int) -> list:
+        return list(itertools.islice(self.songs, offset, offset + count))
+
+    def remove(self, index: int) -> Song:
+        song = self.songs[index]
+        del self.songs[index]
+        return song
+
+    def discard(self, song: Song) -> bool:
+        """Usuwa dokładnie ten obiekt (nie równy mu utwór) - bezpieczne, gdy kolejka zmieniła się w międzyczasie."""
+        for index, item in enumerate(self.songs):
+            if item is song: del self.songs[index]; return True
+        return False
+
+    def move(self, source: int, target: int):
+        song = self.remove(source)
+        self.songs.insert(target, song)
+
+    def dedupe(self) -> int:
+        seen, before = set(), len(self.songs)
+        self.songs = collections.deque(song for song in self.songs if not (song.key in seen or seen.add(song.key)))
+        return before - len(self.songs)
+
+    def shuffle(self):
+        songs = list(self.songs); random.shuffle(songs); self.songs = collections.deque(songs)
+
+    def advance(self, song: Song):
+        """Ustawia nowy bieżący utwór, odkładając poprzedni do historii (chyba że właśnie cofamy)."""
+        if self.current is not None and self.current is not song and not self.rewinding: self.history.append(self.current)
+        self.current, self.rewinding = song, False
+
+    def rewind(self) -> Optional[Song]:
+        """Wstawia poprzedni utwór (i bieżący za nim) na początek kolejki; zwraca poprzedni albo None."""
+        if not self.history: return None
+        previous = self.history.pop()
+        if self.current is not None: self.songs.appendleft(self.current)
+        self.songs.appendleft(previous)
+        self.rewinding = True
+        return previous
+
+class QueueView(ui.View):
+    """Stronicowany podgląd kolejki - każda strona jest wycinkiem deque budowanym dopiero przy wyświetleniu."""
+    def __init__(self, music_cog, guild_id: int, owner_id: int):
+        super().__init__(timeout=120)
+        self.music, self.guild_id, self.owner_id, self.page = music_cog, guild_id, owner_id, 0
+        self.update_buttons()
+
+    def pages(self) -> int:
+        return max(1, (len(self.music.get_queue(self.guild_id)) + MUSIC_QUEUE_PAGE - 1) // MUSIC_QUEUE_PAGE)
+
+    def update_buttons(self):
+        self.page = min(self.page, self.pages() - 1)
+        self.previous_page.disabled = self.page == 0
+        self.next_page.disabled = self.page >= self.pages() - 1
+
+    def build_embed(self) -> discord.Embed:
+        queue = self.music.get_queue(self.guild_id)
+        embed = discord.Embed(title="🎶 Kolejka Odtwarzania", color=discord.Color.purple())
+        description = f"**Teraz gram:** [{queue.current.title}]({queue.current.url})\n\n" if queue.current else ""
+        if not queue: description += "Kolejka jest pusta."
+        else:
+            offset = self.page * MUSIC_QUEUE_PAGE
+            description += "**W kolejce:**\n" + "".join(f"**{i}.** {song.title}\n" for i, song in enumerate(queue.page(offset, MUSIC_QUEUE_PAGE), offset + 1))
+            embed.set_footer(text=f"Strona {self.page + 1}/{self.pages()} • {len(queue)} utworów")
+        embed.description = description
+        return embed
+
+    async def interaction_check(self, interaction: Interaction) -> bool:
+        if interaction.user.id == self.owner_id: return True
+        await interaction.response.send_message("Użyj `/music queue`, aby przeglądać kolejkę samodzielnie.", ephemeral=True); return False
+
+    async def show(self, interaction: Interaction, delta: int):
+        self.page += delta; self.update_buttons()
+        await interaction.response.edit_message(embed=self.build_embed(), view=self)
+
+    @ui.button(label="◀️", style=ButtonStyle.secondary)
+    async def previous_page(self, interaction: Interaction, button: ui.Button): await self.show(interaction, -1)
+    @ui.button(label="🔄", style=ButtonStyle.secondary)
+    async def refresh(self, interaction: Interaction, button: ui.Button): await self.show(interaction, 0)
+    @ui.button(label="▶️", style=ButtonStyle.secondary)
+    async def next_page(self, interaction: Interaction, button: ui.Button): await self.show(interaction, 1)
 
 class MusicView(ui.View):
     def __init__(self, bot_instance, music_cog):
@@ -494,80 +2823,257 @@ class Music(app_commands.Group):
         self.queues = {}
         self.loop_states = {}
         self.now_playing_message = {}
+        self.resolvers = {}
+        self.prefetchers = {}
+        self.track_ends_at = {}
+        self.volumes = {}
+        self.play_locks = {}
+        self.search_cache = SearchCache()
+        self.audio_cache = AudioCache()
         self.YDL_OPTIONS = {'format': 'bestaudio', 'noplaylist': True, 'quiet': True, 'default_search': 'ytsearch1'}
-        self.FFMPEG_OPTIONS = {'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5', 'options': '-vn'}
-        try:
-            self.sp = spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=os.getenv("SPOTIPY_CLIENT_ID"), client_secret=os.getenv("SPOTIPY_CLIENT_SECRET")))
-        except Exception as e:
-            print(f"Błąd inicjalizacji Spotify: {e}."); self.sp = None
+        self.extractor = ExtractionPool(self.YDL_OPTIONS)
+        self.sp = self.spotify = None
+        self._warmup = None
+
+    def warm_up(self) -> asyncio.Task:
+        """Ładuje w tle spotipy, klienta Spotify i pracowników yt-dlp; komendy muzyczne czekają na to zadanie."""
+        if self._warmup is None: self._warmup = asyncio.create_task(self._warm_up())
+        return self._warmup
+
+    async def _warm_up(self):
+        started = time.perf_counter()
+        self.sp = await asyncio.to_thread(self._create_spotify)
+        self.spotify = AsyncSpotify(self.sp) if self.sp else None
+        try: await self.extractor.warm_up()
+        except Exception as e: print(f"Błąd uruchamiania pracowników yt-dlp: {e}")
+        print(f"System muzyczny gotowy w tle po {time.perf_counter() - started:.2f} s.")
+
+    @staticmethod
+    def _create_spotify():
+        import spotipy
+        from spotipy.oauth2 import SpotifyClientCredentials
+        try: return spotipy.Spotify(auth_manager=SpotifyClientCredentials(client_id=os.getenv("SPOTIPY_CLIENT_ID"), client_secret=os.getenv("SPOTIPY_CLIENT_SECRET")))
+        except Exception as e: print(f"Błąd inicjalizacji Spotify: {e}."); return None
 
     async def teardown(self, guild_id: int):
-        if message := self.now_playing_message.pop(guild_id, None):
-            try: await message.delete()
-            except discord.HTTPException: pass
-        if vc := self.bot.get_guild(guild_id).voice_client:
+        self.forget(guild_id)
+        if (guild := self.bot.get_guild(guild_id)) and (vc := guild.voice_client):
             await vc.disconnect()
-        if guild_id in self.queues: self.queues[guild_id] = []
-        if guild_id in self.loop_states: self.loop_states[guild_id] = False
 
-    def get_queue(self, guild_id: int): return self.queues.get(guild_id, [])
+    def forget(self, guild_id: int):
+        """Usuwa cały stan muzyczny serwera (bez rozłączania) - klucze znikają, a nie są zerowane."""
+        self.cancel_resolvers(guild_id)
+        if task := self.prefetchers.pop(guild_id, None): task.cancel()
+        if message := self.now_playing_message.pop(guild_id, None):
+            self.bot.rest.post('music', message.delete)
+        self.track_ends_at.pop(guild_id, None)
+        self.queues.pop(guild_id, None)
+        self.loop_states.pop(guild_id, None)
+        self.volumes.pop(guild_id, None)
+        self.play_locks.pop(guild_id, None)
+
+    def guild_ids(self) -> set:
+        return set().union(self.queues, self.loop_states, self.now_playing_message, self.resolvers, self.prefetchers, self.track_ends_at, self.volumes, self.play_locks)
+
+    async def close(self):
+        """Zwalnia zasoby systemu muzycznego przy zamykaniu bota."""
+        if self._warmup and not self._warmup.done(): self._warmup.cancel()
+        await self.search_cache.close()
+        self.audio_cache.close()
+        self.extractor.shutdown()
+        if self.spotify: self.spotify.shutdown()
+
+    def cancel_resolvers(self, guild_id: int):
+        for task in self.resolvers.pop(guild_id, set()): task.cancel()
+
+    def get_queue(self, guild_id: int) -> MusicQueue:
+        # Bez `or`: kolejka z samym bieżącym utworem jest fałszywa (len == 0), a wciąż potrzebna do "Teraz gram".
+        return MusicQueue() if (queue := self.queues.get(guild_id)) is None else queue
+    def queue_for(self, guild_id: int) -> MusicQueue:
+        if (queue := self.queues.get(guild_id)) is None: queue = self.queues[guild_id] = MusicQueue()
+        return queue
     def is_looping(self, guild_id: int) -> bool: return self.loop_states.get(guild_id, False)
     def toggle_loop(self, guild_id: int) -> bool: self.loop_states[guild_id] = not self.is_looping(guild_id); return self.loop_states[guild_id]
     def shuffle_queue(self, guild_id: int) -> bool:
         queue = self.get_queue(guild_id)
         if not queue: return False
-        random.shuffle(queue); return True
+        queue.shuffle(); return True
 
     async def play_next(self, interaction: Interaction):
+        """Uruchamia następny utwór; wywołania z callbacku `after` i z wczytywania playlisty są kolejkowane per serwer.
+
+        Bez blokady oba mogłyby w trakcie odświeżania linku zdjąć utwór z kolejki, a drugie vc.play rzuciłoby
+        "Already playing" - utwór przepadłby. Wywołanie, które zastanie coś odtwarzanego, nic nie robi.
+        """
+        async with self.play_locks.setdefault(interaction.guild.id, asyncio.Lock()):
+            if (vc := interaction.guild.voice_client) and (vc.is_playing() or vc.is_paused()): return
+            await self._play_next(interaction)
+
+    async def _play_next(self, interaction: Interaction):
         guild_id = interaction.guild.id
         vc = interaction.guild.voice_client
         if not vc or not vc.is_connected():
             return await self.teardown(guild_id)
 
         if message := self.now_playing_message.pop(guild_id, None):
-            try: await message.delete()
-            except discord.HTTPException: pass
+            self.bot.rest.post('music', message.delete)
+
+        queue = self.queue_for(guild_id)
+        replay = self.is_looping(guild_id) and vc.source is not None and queue.current is not None and not queue.rewinding
+        # Pętla zamiast rekurencji: martwe lub błędne utwory są pomijane po kolei, bez lawiny wywołań play_next.
+        while True:
+            if replay:
+                song, replay = queue.current, False
+            elif queue:
+                song = queue.popleft()
+            elif self.resolvers.get(guild_id):
+                return  # playlista wciąż się wczytuje - resolve_playlist wznowi odtwarzanie
+            else:
+                self.bot.rest.post('music', lambda: interaction.channel.send("Koniec kolejki, rozłączam się.", delete_after=15))
+                return await self.teardown(guild_id)
+
+            # Plik z lokalnej pamięci podręcznej nie potrzebuje ważnego linku do strumienia.
+            local = self.audio_cache.lookup(song.id)
+            if not local and not await self.refresh_song(song):
+                self.bot.rest.post('music', lambda title=song.title: interaction.channel.send(f"Pomijam niedostępny utwór `{title}`.", delete_after=15))
+                continue
+            try:
+                source = await open_audio_source(local or song.url, self.volumes.get(guild_id, MUSIC_DEFAULT_VOLUME))
+                source.original_song_info = song
+                if not local: self.audio_cache.record_play(song)
+                vc.play(source, after=lambda e: asyncio.run_coroutine_threadsafe(self.play_next(interaction), self.bot.loop) if not e else print(f"Player error: {e}"))
+                queue.advance(song)
+                self.track_ends_at[guild_id] = time.time() + (song.duration or 0)
+                self.schedule_prefetch(guild_id)
+
+                embed = discord.Embed(title="🎵 Teraz odtwarzane", description=f"**[{song.title}]({song.url})**", color=discord.Color.green())
+                if song.thumbnail: embed.set_thumbnail(url=song.thumbnail)
+                self.now_playing_message[guild_id] = await self.bot.rest.run('music', lambda: interaction.channel.send(embed=embed, view=MusicView(self.bot, self)))
+                return
+            except Exception as e:
+                await interaction.channel.send(f"Błąd odtwarzania `{song.title}`: {e}")
+                if vc.is_playing(): return
+
+    async def stream_alive(self, url: str) -> bool:
+        try:
+            async with self.bot.session.head(url, allow_redirects=True, timeout=aiohttp.ClientTimeout(total=5)) as r: return r.status < 400
+        except (aiohttp.ClientError, asyncio.TimeoutError): return False
+
+    async def refresh_song(self, song: Song, plays_at: Optional[float] = None, validate: bool = False) -> bool:
+        """Pilnuje, by link do strumienia był ważny w chwili odtwarzania; w razie potrzeby pobiera nowy po ID filmu.
+
+        Zwraca False, gdy utworu nie da się już odtworzyć.
+        """
+        if not song.id: return True
+        if song.url and SearchCache.stream_expiry(song.url) > (plays_at or time.time()) + STREAM_URL_MARGIN and (not validate or await self.stream_alive(song.url)):
+            return True
+        self.search_cache.drop_stream(song.id)
+        if not (url := await self.stream_url(song.id)): return False
+        song.url = url
+        return True
 
-        queue = self.get_queue(guild_id)
-        song_info = None
-        if self.is_looping(guild_id) and vc.source:
-            song_info = vc.source.original_song_info
-        elif queue:
-            song_info = queue.pop(0)
-        else:
-            await interaction.channel.send("Koniec kolejki, rozłączam się.", delete_after=15)
-            return await self.teardown(guild_id)
+    def schedule_prefetch(self, guild_id: int):
+        if (task := self.prefetchers.get(guild_id)) and not task.done(): task.cancel()
+        self.prefetchers[guild_id] = asyncio.create_task(self.prefetch(guild_id))
 
-        try:
-            source = discord.FFmpegPCMAudio(song_info['url'], **self.FFMPEG_OPTIONS)
-            source = discord.PCMVolumeTransformer(source, volume=0.5)
-            source.original_song_info = song_info
-            vc.play(source, after=lambda e: asyncio.run_coroutine_threadsafe(self.play_next(interaction), self.bot.loop) if not e else print(f"Player error: {e}"))
-
-            embed = discord.Embed(title="🎵 Teraz odtwarzane", description=f"**[{song_info.get('title', 'Brak tytułu')}]({song_info.get('url')})**", color=discord.Color.green())
-            if thumbnail := song_info.get('thumbnail'): embed.set_thumbnail(url=thumbnail)
-            self.now_playing_message[guild_id] = await interaction.channel.send(embed=embed, view=MusicView(self.bot, self))
-        except Exception as e:
-            await interaction.channel.send(f"Błąd odtwarzania `{song_info.get('title')}`: {e}")
-            await self.play_next(interaction)
+    async def prefetch(self, guild_id: int):
+        """Sprawdza MUSIC_PREFETCH_AHEAD najbliższych utworów: odświeża linki wygasające przed ich kolejką i usuwa martwe wpisy."""
+        plays_at = self.track_ends_at.get(guild_id, time.time())
+        queue = self.get_queue(guild_id)
+        for song in queue.page(0, MUSIC_PREFETCH_AHEAD):
+            if await self.refresh_song(song, plays_at, validate=True):
+                plays_at += song.duration or 0
+            elif queue.discard(song):
+                print(f"Usunięto z kolejki niedostępny utwór '{song.title}'.")
 
     async def search_song_on_yt(self, query: str):
-        loop = self.bot.loop
+        if (cached := await self.search_cache.get(query)) and (song := await self.resolve_stream(cached)):
+            return song, None
+
         search_suffixes = ["", " lyrics", " audio"]
 
         for suffix in search_suffixes:
             try:
-                search_query = f"ytsearch1:{query}{suffix}"
-                data = await loop.run_in_executor(None, lambda: youtube_dl.YoutubeDL(self.YDL_OPTIONS).extract_info(search_query, download=False))
+                data = await self.extractor.extract(f"ytsearch1:{query}{suffix}")
                 if 'entries' in data and data['entries']:
                     entry = data['entries'][0]
-                    return {'url': entry['url'], 'title': entry.get('title', 'Brak tytułu'), 'thumbnail': entry.get('thumbnail')}, None
+                    song = Song(entry.get('id'), entry['url'], entry.get('title'), entry.get('thumbnail'), entry.get('duration'))
+                    if song.id:
+                        self.search_cache.put_stream(song.id, song.url)
+                        await self.search_cache.put(query, song)
+                    return song, None
+            except ExtractionQueueFull:
+                # Przeciążenie to nie brak wyniku - kolejne warianty zapytania zostałyby odrzucone tak samo.
+                return None, MUSIC_BUSY_MESSAGE
             except Exception:
                 print(f"Wyszukiwanie dla '{query}{suffix}' nie powiodło się, próbuje dalej...")
                 continue
 
         return None, f"Nie udało mi się znaleźć grywalnej wersji dla: `{query}`."
 
+    async def stream_url(self, video_id: str) -> Optional[str]:
+        """Aktualny link do strumienia filmu; wygasły pobiera po ID filmu, bez ponownego wyszukiwania."""
+        if not (url := self.search_cache.get_stream(video_id)):
+            try:
+                data = await self.extractor.extract(f"https://www.youtube.com/watch?v={video_id}")
+                url = data['url']
+            except Exception as e:
+                print(f"Nie udało się odświeżyć strumienia dla '{video_id}': {e}")
+                return None
+            self.search_cache.put_stream(video_id, url)
+        return url
+
+    async def resolve_stream(self, meta: dict) -> Optional[Song]:
+        """Buduje utwór z metadanych z pamięci wyszukiwań, doklejając aktualny link do strumienia."""
+        if not (url := await self.stream_url(meta['id'])): return None
+        return Song(meta['id'], url, meta['title'], meta.get('thumbnail'), meta.get('duration'))
+
+    async def resolve_playlist(self, interaction: Interaction, search_queries: list):
+        """Wyszukuje utwory równolegle (najwyżej MUSIC_RESOLVE_CONCURRENCY naraz) i dokłada je do kolejki w kolejności playlisty.
+
+        Odtwarzanie rusza zaraz po znalezieniu pierwszego utworu; postęp trafia do oryginalnej odpowiedzi.
+        """
+        guild_id, total = interaction.guild.id, len(search_queries)
+        semaphore = asyncio.Semaphore(MUSIC_RESOLVE_CONCURRENCY)
+        busy = 0
+        async def resolve(search_query):
+            nonlocal busy
+            async with semaphore: song, error = await self.search_song_on_yt(search_query)
+            if error == MUSIC_BUSY_MESSAGE: busy += 1
+            return song
+
+        # Okno zadań ogranicza liczbę jednocześnie istniejących tasków przy bardzo długich playlistach.
+        remaining = iter(search_queries)
+        pending = collections.deque(asyncio.create_task(resolve(q)) for q in itertools.islice(remaining, MUSIC_RESOLVE_CONCURRENCY * 2))
+        added = processed = 0
+        last_progress = time.monotonic()
+        try:
+            while pending:
+                # Wszystkie kolejne gotowe wyniki trafiają do kolejki jednym wywołaniem extend.
+                results = [await pending.popleft()]
+                while pending and pending[0].done(): results.append(pending.popleft().result())
+                for next_query in itertools.islice(remaining, len(results)): pending.append(asyncio.create_task(resolve(next_query)))
+                processed += len(results)
+                if songs := [song for song in results if song]:
+                    self.queue_for(guild_id).extend(songs); added += len(songs)
+                    vc = interaction.guild.voice_client
+                    if vc and vc.is_connected() and not vc.is_playing() and not vc.is_paused(): await self.play_next(interaction)
+                if time.monotonic() - last_progress >= 3:
+                    last_progress = time.monotonic()
+                    content = f"⏳ Przetworzono `{processed}/{total}` utworów (dodano `{added}`)..."
+                    self.bot.rest.post('music', lambda content=content: interaction.edit_original_response(content=content), key=('progress', interaction.id))
+        except asyncio.CancelledError:
+            for task in pending: task.cancel()
+            content = f"⏹️ Przerwano dodawanie playlisty (dodano `{added}/{total}` utworów)."
+            self.bot.rest.post('music', lambda: interaction.edit_original_response(content=content), key=('progress', interaction.id))
+            raise
+        content = f"✅ Dodano `{added}` utworów do kolejki." if added else "Nie udało się znaleźć żadnych pasujących utworów."
+        if added < total and added: content += f" Pominięto `{total - added}`."
+        if busy: content += f" `{busy}` utworów pominięto z powodu przeciążenia wyszukiwarki - spróbuj ponownie później."
+        # Ten sam klucz co postęp: zaległa edycja postępu nie nadpisze już końcowego komunikatu.
+        try: await self.bot.rest.run('music', lambda: interaction.edit_original_response(content=content), key=('progress', interaction.id))
+        except discord.HTTPException: pass
+
     @app_commands.command(name="play", description="Odtwarza piosenkę lub playlistę.")
     async def play(self, interaction: Interaction, query: str):
         if not interaction.user.voice:
@@ -576,43 +3082,44 @@ class Music(app_commands.Group):
 
         vc = interaction.guild.voice_client
         if not vc: vc = await interaction.user.voice.channel.connect()
+        await self.warm_up()
 
         guild_id = interaction.guild.id
-        if guild_id not in self.queues: self.queues[guild_id] = []
 
         search_queries = []
         # POPRAWKA: Niezawodne wykrywanie linków Spotify
-        if self.sp and "open.spotify.com" in query:
+        if self.spotify and "open.spotify.com" in query:
             if "track" in query:
-                try: search_queries.append(f"{self.sp.track(query)['name']} {self.sp.track(query)['artists'][0]['name']}")
+                try: track = await self.spotify.track(query); search_queries.append(f"{track['name']} {track['artist']}")
                 except Exception as e: return await interaction.followup.send(f"Błąd przetwarzania utworu Spotify: {e}")
             elif "playlist" in query:
-                try: search_queries = [f"{item['track']['name']} {item['track']['artists'][0]['name']}" for item in self.sp.playlist_items(query)['items'] if item and item.get('track')]
+                try: search_queries = [f"{track['name']} {track['artist']}" for track in await self.spotify.playlist_tracks(query)]
                 except Exception as e: return await interaction.followup.send(f"Błąd przetwarzania playlisty Spotify: {e}")
         else:
             search_queries.append(query)
 
-        songs_added_info = []
         if len(search_queries) > 1:
             await interaction.followup.send(f"✅ Przetwarzam `{len(search_queries)}` utworów...")
+            task = asyncio.create_task(self.resolve_playlist(interaction, search_queries))
+            self.resolvers.setdefault(guild_id, set()).add(task)
+            task.add_done_callback(lambda t: self.resolvers.get(guild_id, set()).discard(t))
+            return
 
+        songs_added_info, error = [], None
         for search_query in search_queries:
-            song_info, error = await self.search_song_on_yt(search_query)
-            if song_info:
-                self.queues[guild_id].append(song_info)
-                songs_added_info.append(song_info)
+            song, error = await self.search_song_on_yt(search_query)
+            if song: songs_added_info.append(song)
+        self.queue_for(guild_id).extend(songs_added_info)
 
         if not songs_added_info:
-            return await interaction.edit_original_response(content="Nie udało się znaleźć żadnych pasujących utworów.")
+            return await interaction.edit_original_response(content=MUSIC_BUSY_MESSAGE if error == MUSIC_BUSY_MESSAGE else "Nie udało się znaleźć żadnych pasujących utworów.")
 
-        if len(songs_added_info) > 1:
-            await interaction.edit_original_response(content=f"✅ Dodano `{len(songs_added_info)}` utworów do kolejki.")
-        elif not vc.is_playing():
+        if not vc.is_playing():
              await interaction.delete_original_response()
         else:
-             await interaction.followup.send(f"✅ Dodano **{songs_added_info[0]['title']}** do kolejki.")
+             await interaction.followup.send(f"✅ Dodano **{songs_added_info[0].title}** do kolejki.")
 
-        if not vc.is_playing() and self.queues[guild_id]:
+        if not vc.is_playing() and self.get_queue(guild_id):
             await self.play_next(interaction)
 
     @app_commands.command(name="volume", description="Ustawia głośność bota (1-200%).")
@@ -621,8 +3128,18 @@ class Music(app_commands.Group):
         vc = interaction.guild.voice_client
         if not vc or not vc.source:
             return await interaction.response.send_message("Bot niczego nie odtwarza.", ephemeral=True)
-        vc.source.volume = poziom / 100.0
+        volume = self.volumes[interaction.guild.id] = poziom / 100.0
         await interaction.response.send_message(f"✅ Ustawiono głośność na **{poziom}%**.", ephemeral=True)
+        if isinstance(vc.source, discord.PCMVolumeTransformer): vc.source.volume = volume; return
+        # Głośność jest częścią procesu FFmpeg - podmieniamy strumień na nowy, startujący od bieżącej pozycji.
+        old = vc.source
+        song = old.original_song_info
+        try: source = await open_audio_source(self.audio_cache.lookup(song.id, count=False) or song.url, volume, start_at=old.elapsed)
+        except Exception as e: return print(f"Nie udało się zmienić głośności: {e}")
+        source.original_song_info = old.original_song_info
+        if vc.source is not old: return source.cleanup()  # utwór zmienił się w trakcie tworzenia źródła
+        vc.source = source
+        self.bot.loop.call_later(1, old.cleanup)  # wątek odtwarzacza mógł jeszcze sięgać po ramkę ze starego źródła
 
     @app_commands.command(name="skip", description="Pomija aktualnie odtwarzany utwór.")
     async def skip(self, interaction: Interaction):
@@ -637,8 +3154,9 @@ class Music(app_commands.Group):
     @app_commands.command(name="stop", description="Zatrzymuje muzykę i czyści kolejkę.")
     async def stop(self, interaction: Interaction):
         vc = interaction.guild.voice_client
+        self.cancel_resolvers(interaction.guild.id)
         if vc:
-            self.queues[interaction.guild.id] = []
+            self.get_queue(interaction.guild.id).clear()
             vc.stop()
         if not interaction.response.is_done():
             await interaction.response.send_message("⏹️ Zatrzymałem muzykę.")
@@ -647,30 +3165,44 @@ class Music(app_commands.Group):
     async def nowplaying(self, interaction: Interaction):
         vc = interaction.guild.voice_client
         if vc and vc.source:
-            song_info = vc.source.original_song_info
-            embed = discord.Embed(title="🎵 Teraz odtwarzane", description=f"**[{song_info.get('title', 'Brak tytułu')}]({song_info.get('url')})**", color=discord.Color.green())
-            if thumbnail := song_info.get('thumbnail'): embed.set_thumbnail(url=thumbnail)
+            song = vc.source.original_song_info
+            embed = discord.Embed(title="🎵 Teraz odtwarzane", description=f"**[{song.title}]({song.url})**", color=discord.Color.green())
+            if song.thumbnail: embed.set_thumbnail(url=song.thumbnail)
             await interaction.response.send_message(embed=embed)
         else:
             await interaction.response.send_message("Nic nie jest teraz odtwarzane.", ephemeral=True)
 
-    @app_commands.command(name="queue", description="Wyświetla kolejkę utworów.")
+    @app_commands.command(name="queue", description="Wyświetla kolejkę utworów (stronami).")
     async def queue(self, interaction: Interaction):
-        queue = self.get_queue(interaction.guild.id)
-        embed = discord.Embed(title="🎶 Kolejka Odtwarzania", color=discord.Color.purple())
-        description = ""
+        view = QueueView(self, interaction.guild.id, interaction.user.id)
+        await interaction.response.send_message(embed=view.build_embed(), view=view)
+
+    @app_commands.command(name="previous", description="Wraca do poprzedniego utworu.")
+    async def previous(self, interaction: Interaction):
         vc = interaction.guild.voice_client
-        if vc and vc.source:
-            song_info = vc.source.original_song_info
-            description += f"**Teraz gram:** [{song_info['title']}]({song_info['url']})\n\n"
-        if not queue:
-            description += "Kolejka jest pusta."
-        else:
-            description += "**W kolejce:**\n"
-            description += "".join(f"**{i}.** {song['title']}\n" for i, song in enumerate(queue[:15], 1))
-            if len(queue) > 15: description += f"\n... i {len(queue) - 15} więcej."
-        embed.description = description
-        await interaction.response.send_message(embed=embed)
+        if not vc or not vc.is_connected(): return await interaction.response.send_message("Bot nie jest na kanale głosowym.", ephemeral=True)
+        queue = self.queue_for(interaction.guild.id)
+        if not (song := queue.rewind()): return await interaction.response.send_message("Brak poprzednich utworów.", ephemeral=True)
+        await interaction.response.send_message(f"⏮️ Wracam do **{song.title}**.", ephemeral=True)
+        if vc.is_playing() or vc.is_paused(): vc.stop()
+        else: await self.play_next(interaction)
+
+    @app_commands.command(name="remove", description="Usuwa utwór z kolejki po numerze.")
+    async def remove(self, interaction: Interaction, numer: app_commands.Range[int, 1]):
+        queue = self.get_queue(interaction.guild.id)
+        if numer > len(queue): return await interaction.response.send_message(f"Kolejka ma tylko `{len(queue)}` utworów.", ephemeral=True)
+        song = queue.remove(numer - 1); await interaction.response.send_message(f"🗑️ Usunięto **{song.title}** z kolejki.", ephemeral=True)
+
+    @app_commands.command(name="move", description="Przenosi utwór na inną pozycję w kolejce.")
+    async def move(self, interaction: Interaction, z: app_commands.Range[int, 1], na: app_commands.Range[int, 1]):
+        queue = self.get_queue(interaction.guild.id)
+        if max(z, na) > len(queue): return await interaction.response.send_message(f"Kolejka ma tylko `{len(queue)}` utworów.", ephemeral=True)
+        queue.move(z - 1, na - 1); await interaction.response.send_message(f"↕️ Przeniesiono utwór z pozycji `{z}` na `{na}`.", ephemeral=True)
+
+    @app_commands.command(name="dedupe", description="Usuwa z kolejki powtórzone utwory.")
+    async def dedupe(self, interaction: Interaction):
+        removed = self.get_queue(interaction.guild.id).dedupe()
+        await interaction.response.send_message(f"🧹 Usunięto `{removed}` duplikatów z kolejki.", ephemeral=True)
 
 # =================================================================
 # SEKCJA 5: URUCHOMIENIE BOTA
@@ -679,6 +3211,8 @@ if __name__ == "__main__":
     token = os.getenv("TOKEN")
     if not token:
         print("BŁĄD: Nie znaleziono tokenu w Replit Secrets.")
+    elif CLUSTER_LAUNCHER:
+        run_cluster(token, int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1)
     else:
        
         try:
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Funkcje pracowników yt-dlp dla ExtractionPool.
+
+Osobny, lekki moduł: w trybie "process" każdy pracownik importuje tylko ten plik (i yt-dlp),
+a nie cały main.py z botem, komendami i jego zależnościami.
+"""
+import threading
+
+_state = threading.local()
+
+def init_worker(options: dict):
+    """Inicjalizator wątku/procesu roboczego: jedna, długowieczna instancja YoutubeDL na pracownika."""
+    import yt_dlp as youtube_dl
+    _state.ydl = youtube_dl.YoutubeDL(options)
+
+def extract_info(query: str, in_process: bool) -> dict:
+    if not in_process: return _state.ydl.extract_info(query, download=False)
+    # Wynik i wyjątek wracają do bota przez pickle, a wyjątki yt-dlp trzymają nieserializowalny exc_info.
+    try: return _state.ydl.sanitize_info(_state.ydl.extract_info(query, download=False))
+    except Exception as e: raise RuntimeError(f"{type(e).__name__}: {e}") from None